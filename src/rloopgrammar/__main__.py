@@ -0,0 +1,3 @@
+import rloopgrammar.cli as cli
+
+cli.main()
@@ -1,4 +1,3 @@
-import multiprocessing
 import importlib
 import sys
 import os
@@ -10,7 +9,7 @@ import re
 
 from typing import *
 
-NUMBER_OF_PROCESSES = 5
+import rloopgrammar.execution as execution
 
 PLASMID_1 = "pFC53_GYRASE"
 PLASMID_2 = "pFC8_GYRASE"
@@ -177,8 +176,9 @@ def main() -> None:
 
     print(f"TOTAL #RUNS = {len(runs)}")
 
-    with multiprocessing.Pool(NUMBER_OF_PROCESSES) as pool:
-        pool.map(do_workflow, runs)
+    execution.run_tasks(
+        do_workflow, runs, describe=lambda _, run: f"run {run.run_number}"
+    )
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,10 @@
-import json
 import argparse
 import pathlib
 import collections
 import pprint
 
+from rloopgrammar.model.grammar_dictionary import GrammarDictionary
+
 class DictionaryEntry:
     def __init__(self, symbol: str, number: int):
         self.symbol = symbol
@@ -42,13 +43,12 @@ def main():
 
     for n, p in enumerate(paths):
         print(n, p)
-        with open(p) as f:
-            d = json.load(f)
-            for k in diff_dictionary.keys():
-                print(f"{k}: {len(diff_dictionary[k])}")
-                for i, j in d[k].items():
-                    for v in j:
-                        diff_dictionary[k][v].add(DictionaryEntry(i, n))
+        d = GrammarDictionary.load(p)
+        for k in diff_dictionary.keys():
+            print(f"{k}: {len(diff_dictionary[k])}")
+            for i, j in d.symbols[k].items():
+                for v in j:
+                    diff_dictionary[k][v].add(DictionaryEntry(i, n))
 
     diff_dictionary_differences = dict(
         region1=collections.defaultdict(lambda : []),
@@ -12,6 +12,8 @@ import prettytable
 
 import scipy.stats
 
+import rloopgrammar.model.ensemble_summary as ensemble_summary
+
 from typing import *
 
 import warnings
@@ -135,7 +137,12 @@ RLOOPER_FILE_GENE_MAP = {
 
 
 def aggregate_graph(
-    plasmid_type, plasmid, folder, avg_only: bool = False, rlooper: bool = False
+    plasmid_type,
+    plasmid,
+    folder,
+    avg_only: bool = False,
+    rlooper: bool = False,
+    padding: int = 13,
 ) -> None:
     print(folder)
     subfolders = [f for f in pathlib.Path(folder).iterdir() if f.is_dir()]
@@ -149,6 +156,18 @@ def aggregate_graph(
     average_probabilities_list = None
     print(plasmid_type, plasmid, files)
 
+    # The ensemble summary written by predict replaces the workbooks of the runs for the average
+    summary = (
+        pathlib.Path(folder)
+        / f"{plasmid}_{plasmid_type}_p{padding}_w{WIDTH}_ensemble.npz"
+    )
+
+    if avg_only and summary.exists():
+        average_probabilities_list = ensemble_summary.EnsembleSummary.by_position(
+            ensemble_summary.EnsembleSummary.read(summary).mean()
+        )
+        files = []
+
     for file in files:
         wb = openpyxl.load_workbook(file)
         ws = wb.active
@@ -185,8 +204,11 @@ def aggregate_graph(
                 label=f"Run {run_number}",
             )
 
-    div_by_file_len = lambda x: x / len(files)
-    average_probabilities_list = list(map(div_by_file_len, average_probabilities_list))
+    if files:
+        div_by_file_len = lambda x: x / len(files)
+        average_probabilities_list = list(
+            map(div_by_file_len, average_probabilities_list)
+        )
 
     wb = openpyxl.load_workbook(
         pathlib.Path("experimental") / f"{plasmid}_{plasmid_type}_experimental.xlsx"
@@ -311,6 +333,7 @@ if __name__ == "__main__":
                         folder,
                         avg_only=GRAPH_AVG_ONLY,
                         rlooper=GRAPH_RLOOPER,
+                        padding=padding,
                     )
 
                     row = [plasmid_type, plasmid, WIDTH, padding]
@@ -0,0 +1,790 @@
+import sys
+import os
+import pathlib
+import dataclasses
+import itertools
+import json
+import math
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import time
+import tracemalloc
+import argparse
+
+from typing import *
+
+import numpy as np
+
+import rloopgrammar
+import rloopgrammar.model.candidate_index as candidate_index
+import rloopgrammar.model.grammar_dict as grammar_dict
+import rloopgrammar.model.grammar_training as grammar_training
+import rloopgrammar.model.grammar_word as grammar_word
+import rloopgrammar.model.in_loop_probs as in_loop_probs
+import rloopgrammar.model.probabilistic_language as probabilistic_language
+import rloopgrammar.model.regions_extractor as regions_extractor
+import rloopgrammar.model.regions_threshold as regions_threshold
+
+from rloopgrammar.config_reader import Plasmid
+
+"""
+Benchmarks of the stages of a model and of a prediction on synthetic plasmids.
+
+
+Every case is a random plasmid with a gene of the given length, flanked by FLANK_LENGTH random
+bases on each side, and the given number of R-loops drawn uniformly inside the gene. The stages
+run through their file based entry points, in the order of a model build followed by a
+prediction, each stage reading the files written by the ones before it:
+
+    weights                 RegionsExtractor.extract_regions
+    threshold               RegionsThreshold.extract_regions
+    dictionary              GrammarDict.extract_regions
+    training_words          GrammarWord.extract_word on the R-loops
+    training                GrammarTraining.find_probabilities
+    candidate_words         GrammarWord.extract_word on every candidate R-loop of the gene
+    word_probabilities      Probabilistic_Language.word_probabilities
+    in_loop_probabilities   Loop_probabilities.in_loop_probabilities
+
+The build-model and predict entry points run end to end as commands in the folder of the case,
+with one model, serially.
+
+Each stage is timed over a number of repeats, followed by one more run under tracemalloc for
+the peak of the memory it allocates; commands report the maximum resident set size of their
+process instead. The results are written as one JSON record per case and stage, along with the
+scaling exponent of every stage, the slope of its best time against the gene length or the
+number of R-loops on a log-log scale, and one log-log plot per parameter that varies.
+
+With --startup the startup of the command line tools is benchmarked instead: the time to import
+the dispatcher and the module of every command (STARTUP_MODULES), as python -X importtime
+reports it in a new interpreter, after a first import that compiles the modules. The interpreter
+first imports the dependencies every command needs (STARTUP_REFERENCE), and the module is timed
+on top of them, so its budget is a ratio of the reference time measured in the same process and
+does not move with the speed of the machine. A module over its budget, or one that loads a
+dependency deferred to the code paths using it (DEFERRED_MODULES), fails the benchmark.
+
+"""
+
+FLANK_LENGTH = 100
+MIN_RLOOP_LENGTH = 20
+PLASMID_NAME = "SYN"
+
+STAGES = (
+    "weights",
+    "threshold",
+    "dictionary",
+    "training_words",
+    "training",
+    "candidate_words",
+    "word_probabilities",
+    "in_loop_probabilities",
+)
+COMMANDS = ("build-model", "predict")
+SCALING_AXES = ("gene_length", "rloops")
+
+# Module -> import budget as a ratio of the import time of STARTUP_REFERENCE, the dispatcher
+# only parses its arguments. The commands take about 0.4 of the reference, and the budgets
+# leave as much again for the noise of the measures
+STARTUP_REFERENCE = ("numpy", "gmpy2")
+STARTUP_MODULES = {
+    "rloopgrammar.cli": 0.1,
+    "rloopgrammar.build_model": 0.75,
+    "rloopgrammar.kfold_model": 0.75,
+    "rloopgrammar.union_models": 0.75,
+    "rloopgrammar.predict": 0.75,
+    "rloopgrammar.graph_prediction": 0.75,
+    "rloopgrammar.report": 0.75,
+}
+DEFERRED_MODULES = ("matplotlib", "openpyxl", "xlsxwriter", "scipy")
+
+# Runs a module as __main__ and writes the peak resident set size of the process to the
+# file given first. VmHWM starts over at exec while ru_maxrss keeps the peak of the process
+# that forked it, so the latter is only used where there is no /proc (in bytes on macOS).
+COMMAND_WRAPPER = """
+import resource, runpy, sys
+
+peak_file, sys.argv = sys.argv[1], sys.argv[2:]
+
+try:
+    runpy.run_module(sys.argv[0], run_name="__main__", alter_sys=True)
+finally:
+    try:
+        with open("/proc/self/status", "r") as fin:
+            peak = next(int(l.split()[1]) * 1024 for l in fin if l.startswith("VmHWM:"))
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024
+
+    with open(peak_file, "w") as fout:
+        fout.write(str(peak))
+"""
+
+PROGRAM_NAME = pathlib.Path(sys.argv[0]).parts[-1][:-4]
+DESCRIPTION = "Benchmark the stages of the R-loop grammar on synthetic plasmids."
+
+
+class SupressOutput:
+    def __init__(self):
+        pass
+
+    def __enter__(self):
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, type, value, traceback):
+        sys.stdout = sys.__stdout__
+
+
+@dataclasses.dataclass
+class BenchmarkCase:
+    folder: pathlib.Path
+    gene_length: int
+    rloops: int
+    window_length: int
+    padding_length: int
+    max_rloop_length: int
+    seed: int
+    numeric: str = "exact"
+    artifacts: str = "xlsx"
+
+    @property
+    def name(self) -> str:
+        return (
+            f"{PLASMID_NAME}_g{self.gene_length}_r{self.rloops}_w{self.window_length}"
+        )
+
+    @property
+    def plasmid(self) -> Plasmid:
+        return Plasmid(
+            PLASMID_NAME,
+            FLANK_LENGTH,
+            FLANK_LENGTH + self.gene_length,
+            str(self.folder / f"{PLASMID_NAME}.fa"),
+            str(self.folder / f"{PLASMID_NAME}.bed"),
+        )
+
+    def file(self, suffix: str) -> str:
+        return str(self.folder / f"{self.name}{suffix}")
+
+
+def write_synthetic_plasmid(case: BenchmarkCase) -> None:
+    # FASTA, BED and plasmids.ini of the case, the same for the same seed
+    rng = random.Random(
+        f"{case.seed}_{case.gene_length}_{case.rloops}_{case.window_length}"
+    )
+    plasmid = case.plasmid
+
+    seq = "".join(
+        rng.choice("ACGT") for _ in range(case.gene_length + 2 * FLANK_LENGTH)
+    )
+
+    with open(plasmid.fasta_file, "w") as fout:
+        fout.write(f">{plasmid.name}\n{seq}\n")
+
+    # R-loops keep a window from the ends of the gene, their start can still be adjusted
+    first = plasmid.gene_start + case.window_length
+    last = plasmid.gene_end - case.window_length
+
+    if last - first < MIN_RLOOP_LENGTH:
+        raise AssertionError(f"Gene of length {case.gene_length} too short for R-loops")
+
+    with open(plasmid.bed_file, "w") as fout:
+        for n in range(case.rloops):
+            start = rng.randint(first, last - MIN_RLOOP_LENGTH)
+            end = rng.randint(
+                start + MIN_RLOOP_LENGTH,
+                min(start + max(case.max_rloop_length, MIN_RLOOP_LENGTH), last),
+            )
+            fout.write(f"{plasmid.name}\t{start}\t{end}\t{plasmid.name}_rloop{n}\n")
+
+    with open(case.folder / "plasmids.ini", "w") as fout:
+        fout.write(
+            f"[{plasmid.name}]\n"
+            f"GeneStart = {plasmid.gene_start}\n"
+            f"GeneEnd = {plasmid.gene_end}\n"
+            f"FastaFile = {pathlib.Path(plasmid.fasta_file).name}\n"
+            f"BEDFile = {pathlib.Path(plasmid.bed_file).name}\n"
+        )
+
+    candidate_index.CandidateIndex.write(
+        candidate_index.CandidateIndex.generate(
+            plasmid.gene_start, plasmid.gene_end, case.window_length
+        ),
+        case.file("_all_rloops.npy"),
+    )
+
+
+def run_stage(case: BenchmarkCase, stage: str) -> None:
+    plasmid = case.plasmid
+
+    if stage == "weights":
+        regions_extractor.RegionsExtractor.extract_regions(
+            plasmid.fasta_file,
+            plasmid.bed_file,
+            plasmid.gene_start,
+            plasmid.gene_end,
+            case.window_length,
+            case.file("_weight.xlsx"),
+            4,
+            case.padding_length,
+            True,
+            case.file(".bed_extra.bed"),
+        )
+    elif stage == "threshold":
+        regions_threshold.RegionsThreshold.extract_regions(
+            case.file("_weight.xlsx"), case.file("_weight_shannon.xlsx"), True
+        )
+    elif stage == "dictionary":
+        grammar_dict.GrammarDict.extract_regions(
+            plasmid.fasta_file,
+            case.file(".bed_extra.bed"),
+            case.file("_weight.xlsx"),
+            plasmid.gene_start,
+            plasmid.gene_end,
+            case.window_length,
+            case.file("_weight_shannon.xlsx"),
+            case.file("_DICT_SHANNON.xlsx"),
+        )
+    elif stage == "training_words":
+        grammar_word.GrammarWord.extract_word(
+            plasmid.fasta_file,
+            case.file(".bed_extra.bed"),
+            case.file("_DICT_SHANNON.xlsx.json"),
+            plasmid.gene_start,
+            plasmid.gene_end,
+            case.window_length,
+            case.file("_training-set_WORDS_SHANNON.txt"),
+        )
+    elif stage == "training":
+        grammar_training.GrammarTraining.find_probabilities(
+            case.file("_training-set_WORDS_SHANNON.txt"),
+            case.window_length,
+            case.file("_probabilities.json"),
+        )
+    elif stage == "candidate_words":
+        grammar_word.GrammarWord.extract_word(
+            plasmid.fasta_file,
+            case.file("_all_rloops.npy"),
+            case.file("_DICT_SHANNON.xlsx.json"),
+            plasmid.gene_start,
+            plasmid.gene_end,
+            case.window_length,
+            case.file("_all_rloops_WORDS_SHANNON"),
+        )
+    elif stage == "word_probabilities":
+        # The probabilities are appended to the output file
+        if os.path.exists(case.file("_prob_lang.py")):
+            os.remove(case.file("_prob_lang.py"))
+
+        probabilistic_language.Probabilistic_Language.word_probabilities(
+            case.file("_all_rloops_WORDS_SHANNON"),
+            case.file("_probabilities.json"),
+            case.window_length,
+            case.file("_prob_lang.py"),
+            case.numeric,
+        )
+    elif stage == "in_loop_probabilities":
+        in_loop_probs.Loop_probabilities.in_loop_probabilities(
+            None,
+            case.file("_all_rloops.npy"),
+            plasmid.gene_start + plasmid.gene_end,
+            plasmid.gene_start,
+            plasmid.gene_end,
+            case.file("_prob_lang.py"),
+            case.window_length,
+            case.file("_base_in_loop"),
+        )
+    else:
+        raise AssertionError(f"Unsupported stage: {stage}")
+
+
+def benchmark_stage(case: BenchmarkCase, stage: str, repeat: int, memory: bool) -> dict:
+    seconds = []
+
+    with SupressOutput():
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run_stage(case, stage)
+            seconds.append(time.perf_counter() - started)
+
+        peak = None
+
+        if memory:
+            tracemalloc.start()
+            run_stage(case, stage)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    return dict(seconds=seconds, peak_memory_bytes=peak, memory="tracemalloc")
+
+
+def command_arguments(case: BenchmarkCase, command: str) -> list:
+    if command == "build-model":
+        return [
+            "rloopgrammar.build_model",
+            "models",
+            "-c",
+            "1",
+            "-p",
+            str(case.padding_length),
+            "-w",
+            str(case.window_length),
+            "--plasmids",
+            PLASMID_NAME,
+            "-tp",
+            "100",
+            "--artifacts",
+            case.artifacts,
+        ]
+
+    if command == "predict":
+        return [
+            "rloopgrammar.predict",
+            "prediction",
+            "-i",
+            "models",
+            "--plasmids",
+            PLASMID_NAME,
+            "-n",
+            case.numeric,
+        ]
+
+    raise AssertionError(f"Unsupported command: {command}")
+
+
+def run_command(case: BenchmarkCase, command: str) -> Tuple[float, int]:
+    # Wall time and maximum resident set size in bytes of the command, which runs in the
+    # folder of the case, so the paths given to it are absolute
+    folder = case.folder.resolve()
+    output_folder = folder / ("models" if command == "build-model" else "prediction")
+
+    if output_folder.exists():
+        shutil.rmtree(output_folder)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(pathlib.Path(rloopgrammar.__file__).parents[1])]
+        + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+
+    peak_file = folder / f"{command}_peak.txt"
+
+    with open(folder / f"{command}_log.txt", "w") as log:
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", COMMAND_WRAPPER, str(peak_file)]
+            + command_arguments(case, command)
+            + ["-j", "1", "--backend", "serial"],
+            cwd=folder,
+            env=env,
+            stdout=log,
+            stderr=log,
+        )
+        seconds = time.perf_counter() - started
+
+    if completed.returncode != 0:
+        raise AssertionError(
+            f"{command} failed on {case.name}, see {folder / f'{command}_log.txt'}"
+        )
+
+    with open(peak_file, "r") as fin:
+        max_rss = int(fin.read())
+
+    return seconds, max_rss
+
+
+def benchmark_command(case: BenchmarkCase, command: str, repeat: int) -> dict:
+    seconds = []
+    peak = 0
+
+    for _ in range(repeat):
+        elapsed, max_rss = run_command(case, command)
+        seconds.append(elapsed)
+        peak = max(peak, max_rss)
+
+    return dict(seconds=seconds, peak_memory_bytes=peak, memory="max_rss")
+
+
+def scaling_exponents(records: list) -> list:
+    # Slope of log(best time) against log(parameter), for every stage and group of cases
+    # that only differ by that parameter
+    exponents = []
+
+    for axis in SCALING_AXES:
+        fixed = [
+            key for key in ("gene_length", "rloops", "window_length") if key != axis
+        ]
+        key = lambda record: (record["stage"], *(record[k] for k in fixed))
+
+        for group_key, group in itertools.groupby(sorted(records, key=key), key=key):
+            points = sorted((record[axis], record["best_seconds"]) for record in group)
+
+            if len(set(x for x, _ in points)) < 2 or any(y <= 0 for _, y in points):
+                continue
+
+            slope = np.polyfit(
+                [math.log(x) for x, _ in points], [math.log(y) for _, y in points], 1
+            )[0]
+            exponents.append(
+                dict(
+                    stage=group_key[0],
+                    axis=axis,
+                    **dict(zip(fixed, group_key[1:])),
+                    exponent=float(slope),
+                )
+            )
+
+    return exponents
+
+
+def plot_scaling(records: list, exponents: list, output_folder: pathlib.Path) -> list:
+    # One log-log plot per parameter that varies, a line per stage and fixed parameters
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as pyplot
+
+    plots = []
+
+    for axis in SCALING_AXES:
+        lines = [e for e in exponents if e["axis"] == axis]
+
+        if not lines:
+            continue
+
+        fig, ax = pyplot.subplots(figsize=(9, 6))
+
+        for line in lines:
+            fixed = {
+                k: v for k, v in line.items() if k not in ("stage", "axis", "exponent")
+            }
+            points = sorted(
+                (record[axis], record["best_seconds"])
+                for record in records
+                if record["stage"] == line["stage"]
+                and all(record[k] == v for k, v in fixed.items())
+            )
+            label = ", ".join(f"{k}={v}" for k, v in fixed.items())
+            ax.plot(
+                [x for x, _ in points],
+                [y for _, y in points],
+                marker="o",
+                label=f"{line['stage']} ({label}): slope {line['exponent']:.2f}",
+            )
+
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel(axis.replace("_", " "))
+        ax.set_ylabel("best time (s)")
+        ax.legend(fontsize="small")
+        fig.tight_layout()
+
+        plot_file = output_folder / f"scaling_{axis}.png"
+        fig.savefig(plot_file)
+        pyplot.close(fig)
+        plots.append(str(plot_file))
+
+    return plots
+
+
+def import_time(module: str) -> Tuple[float, float, list]:
+    # Import times of STARTUP_REFERENCE and then of module in a new interpreter, in
+    # milliseconds, and the modules it loaded
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {', '.join(STARTUP_REFERENCE)}; import {module}",
+        ],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    if process.returncode != 0:
+        raise AssertionError(f"Could not import {module}:\n{process.stderr}")
+
+    reference_microseconds = 0
+    microseconds = 0
+    loaded = []
+
+    # import time: self [us] | cumulative | imported package, nested ones indented
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+
+        if not cumulative.strip().isdigit():
+            continue
+
+        loaded.append(name.strip())
+
+        # Only the imports at the top, the interpreter imports the rest
+        if name.rstrip() in (f" {reference}" for reference in STARTUP_REFERENCE):
+            reference_microseconds += int(cumulative)
+        elif name.startswith(" rloopgrammar"):
+            microseconds += int(cumulative)
+
+    return reference_microseconds / 1000, microseconds / 1000, loaded
+
+
+def benchmark_startup(module: str, budget: float, repeat: int) -> dict:
+    import_time(module)
+    reference_milliseconds = []
+    milliseconds = []
+
+    for _ in range(repeat):
+        reference_ms, ms, loaded = import_time(module)
+        reference_milliseconds.append(reference_ms)
+        milliseconds.append(ms)
+
+    deferred = sorted(
+        set(name.split(".")[0] for name in loaded) & set(DEFERRED_MODULES)
+    )
+    ratio = statistics.median(
+        ms / reference_ms for ms, reference_ms in zip(milliseconds, reference_milliseconds)
+    )
+
+    return dict(
+        module=module,
+        milliseconds=milliseconds,
+        reference_milliseconds=reference_milliseconds,
+        median_ms=statistics.median(milliseconds),
+        median_reference_ms=statistics.median(reference_milliseconds),
+        ratio=ratio,
+        budget=budget,
+        margin=budget - ratio,
+        modules_loaded=len(loaded),
+        deferred_loaded=deferred,
+        passed=ratio <= budget and not deferred,
+    )
+
+
+parser = argparse.ArgumentParser(prog=PROGRAM_NAME, description=DESCRIPTION)
+parser.add_argument("output_folder")
+parser.add_argument(
+    "-g",
+    "--gene-lengths",
+    type=int,
+    nargs="+",
+    default=[300, 600, 1200],
+    help="Lengths of the synthetic genes.",
+)
+parser.add_argument(
+    "-r",
+    "--rloops",
+    type=int,
+    nargs="+",
+    default=[50, 100, 200],
+    help="Numbers of R-loops of the synthetic plasmids.",
+)
+parser.add_argument("-w", "--widths", type=int, nargs="+", default=[4])
+parser.add_argument("-p", "--padding", type=int, default=13)
+parser.add_argument(
+    "--max-rloop-length",
+    type=int,
+    default=300,
+    help="Maximum length of the synthetic R-loops.",
+)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--stages",
+    choices=STAGES + COMMANDS,
+    nargs="+",
+    default=list(STAGES + COMMANDS),
+    help="Stages and commands to benchmark, every stage runs the ones it depends on.",
+)
+parser.add_argument(
+    "-n",
+    "--numeric",
+    choices=["exact", "log"],
+    default="exact",
+    help="Numeric mode of the word probabilities.",
+)
+parser.add_argument(
+    "--artifacts",
+    choices=["none", "json", "xlsx"],
+    default="xlsx",
+    help="Files written by the build-model command.",
+)
+parser.add_argument(
+    "--repeat", type=int, default=3, help="Timed runs of every stage and command."
+)
+parser.add_argument(
+    "--no-memory",
+    action="store_true",
+    help="Skip the run of every stage under tracemalloc.",
+)
+parser.add_argument(
+    "--no-plots", action="store_true", help="Only write the JSON results."
+)
+parser.add_argument(
+    "--startup",
+    action="store_true",
+    help="Benchmark the import time of the command line tools against their budgets.",
+)
+parser.add_argument(
+    "--startup-budget",
+    type=float,
+    default=None,
+    help="Import budget of every command module as a ratio of the reference import, instead of the default one.",
+)
+
+
+def main() -> None:
+    args = parser.parse_args()
+
+    output_folder = pathlib.Path(args.output_folder)
+    os.mkdir(output_folder)
+
+    if args.startup:
+        main_startup(args, output_folder)
+        return
+
+    # Stages run in pipeline order, up to the last one requested
+    selected = [stage for stage in STAGES if stage in args.stages]
+    pipeline = STAGES[: STAGES.index(selected[-1]) + 1] if selected else ()
+    commands = [command for command in COMMANDS if command in args.stages]
+
+    records = []
+
+    for gene_length, rloops, window_length in itertools.product(
+        args.gene_lengths, args.rloops, args.widths
+    ):
+        case = BenchmarkCase(
+            output_folder / f"g{gene_length}_r{rloops}_w{window_length}",
+            gene_length,
+            rloops,
+            window_length,
+            args.padding,
+            args.max_rloop_length,
+            args.seed,
+            args.numeric,
+            args.artifacts,
+        )
+        os.mkdir(case.folder)
+        write_synthetic_plasmid(case)
+
+        results = []
+
+        for stage in pipeline:
+            if stage in selected:
+                results.append(
+                    (
+                        stage,
+                        benchmark_stage(case, stage, args.repeat, not args.no_memory),
+                    )
+                )
+            else:
+                with SupressOutput():
+                    run_stage(case, stage)
+
+        # The prediction needs a model collection
+        if "predict" in commands and "build-model" not in commands:
+            run_command(case, "build-model")
+
+        for command in commands:
+            results.append((command, benchmark_command(case, command, args.repeat)))
+
+        for stage, result in results:
+            record = dict(
+                gene_length=gene_length,
+                rloops=rloops,
+                window_length=window_length,
+                padding=args.padding,
+                numeric=args.numeric,
+                stage=stage,
+                best_seconds=min(result["seconds"]),
+                median_seconds=statistics.median(result["seconds"]),
+                **result,
+            )
+            records.append(record)
+
+            peak = record["peak_memory_bytes"]
+            print(
+                f"{case.name} {stage}: {record['best_seconds']:.4f}s"
+                + (f", {peak / 2 ** 20:.1f} MiB ({record['memory']})" if peak else ""),
+                file=sys.stderr,
+            )
+
+    exponents = scaling_exponents(records)
+
+    with open(output_folder / "benchmark.json", "w") as fout:
+        json.dump(
+            dict(
+                python=platform.python_version(),
+                platform=platform.platform(),
+                numpy=np.__version__,
+                repeat=args.repeat,
+                results=records,
+                scaling=exponents,
+            ),
+            fout,
+            indent=4,
+        )
+
+    if not args.no_plots:
+        plot_scaling(records, exponents, output_folder)
+
+
+def main_startup(args, output_folder: pathlib.Path) -> None:
+    results = []
+
+    for module, budget in STARTUP_MODULES.items():
+        if args.startup_budget is not None and module != "rloopgrammar.cli":
+            budget = args.startup_budget
+
+        result = benchmark_startup(module, budget, args.repeat)
+        results.append(result)
+
+        print(
+            f"{module:<32} {result['median_ms']:>8.1f} ms"
+            f" = {result['ratio']:.2f} x {result['median_reference_ms']:.1f} ms"
+            f" / {budget:.2f}, margin {result['margin']:+.2f}"
+            + (
+                f", loads {', '.join(result['deferred_loaded'])}"
+                if result["deferred_loaded"]
+                else ""
+            )
+            + ("" if result["passed"] else "  FAILED"),
+            file=sys.stderr,
+        )
+
+    with open(output_folder / "startup.json", "w") as fout:
+        json.dump(
+            dict(
+                python=platform.python_version(),
+                platform=platform.platform(),
+                repeat=args.repeat,
+                reference=list(STARTUP_REFERENCE),
+                results=results,
+            ),
+            fout,
+            indent=4,
+        )
+
+    failed = [result for result in results if not result["passed"]]
+
+    if failed:
+        print(
+            "Startup over budget: "
+            + ", ".join(
+                f"{result['module']} at {result['ratio']:.2f} of the reference"
+                f" for a budget of {result['budget']:.2f}"
+                + (
+                    f" and loading {', '.join(result['deferred_loaded'])}"
+                    if result["deferred_loaded"]
+                    else ""
+                )
+                for result in failed
+            ),
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
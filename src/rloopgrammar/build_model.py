@@ -1,4 +1,3 @@
-import multiprocessing
 import sys
 import os
 import pathlib
@@ -12,14 +11,12 @@ import shutil
 
 from typing import *
 
-NUMBER_OF_PROCESSES = 10
-
-import rloopgrammar.model.regions_extractor as region_extractor
-import rloopgrammar.model.regions_threshold as region_threshold
 import rloopgrammar.model.training_set as training_set
-import rloopgrammar.model.grammar_dict as grammar_dict
-import rloopgrammar.model.grammar_word as grammar_word
-import rloopgrammar.model.grammar_training as grammar_training
+import rloopgrammar.model.model_pipeline as model_pipeline
+import rloopgrammar.model.stage_cache as stage_cache
+
+import rloopgrammar.execution as execution
+import rloopgrammar.instrumentation as instrumentation
 
 from rloopgrammar.config_reader import read_plasmids
 from rloopgrammar.config_reader import Plasmid
@@ -58,6 +55,9 @@ class ModelParameters:
     training_set_percent: float
     seed_file: Optional[pathlib.Path]
     training_set_file: Optional[pathlib.Path]
+    artifacts: str = "xlsx"
+    bed_extra_file: Optional[pathlib.Path] = None
+    cache: Optional[stage_cache.StageCache] = None
 
 
 def build_model(mp: ModelParameters) -> None:
@@ -81,6 +81,15 @@ def build_model(mp: ModelParameters) -> None:
     logger.info(dataclasses.asdict(mp))
     logger.info(f"Extracting critical regions.")
 
+    metrics = instrumentation.StageMetrics(
+        mp.parent_folder / instrumentation.METRICS_FILE_NAME,
+        tool="build-model",
+        run=run_folder.name,
+        plasmid=mp.plasmid.name,
+        window_length=mp.window_length,
+        padding=mp.padding_length,
+    )
+
     if mp.seed_file:
         with open(mp.seed_file, "rb") as seed_file_handle:
             seed_bytes = seed_file_handle.read()
@@ -99,10 +108,6 @@ def build_model(mp: ModelParameters) -> None:
     with open(seed_filename, "wb") as seed_file:
         seed_file.write(seed)
 
-    bed_extra_filename = str(
-        run_folder
-        / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}.bed_extra.bed"
-    )
     weight_xlsx_filename = str(
         run_folder
         / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_weight.xlsx"
@@ -111,6 +116,14 @@ def build_model(mp: ModelParameters) -> None:
         run_folder
         / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_weight_shannon.xlsx"
     )
+    weight_npz_filename = str(
+        run_folder
+        / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_weight.npz"
+    )
+    weight_shannon_entropy_npz_filename = str(
+        run_folder
+        / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_weight_shannon.npz"
+    )
     bed_extra_training_set_filename = str(
         run_folder
         / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}.bed_extra_training-set.bed"
@@ -123,6 +136,10 @@ def build_model(mp: ModelParameters) -> None:
         run_folder
         / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_DICT_SHANNON.xlsx.json"
     )
+    dict_shannon_blocks_filename = str(
+        run_folder
+        / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_DICT_SHANNON_blocks.tsv"
+    )
     training_set_words_filename = str(
         run_folder
         / f"{mp.plasmid.name}_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_training-set_WORDS_SHANNON.txt"
@@ -131,6 +148,10 @@ def build_model(mp: ModelParameters) -> None:
         run_folder
         / f"{mp.plasmid.name}_SHANNON_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_probabilities.json"
     )
+    counts_filename = str(
+        run_folder
+        / f"{mp.plasmid.name}_SHANNON_p{mp.padding_length}_w{mp.window_length}_{mp.run_number}_counts.json"
+    )
 
     with open(mp.plasmid.bed_file, "r") as bed_file_fd:
         bed_file_length = len(bed_file_fd.readlines())
@@ -138,82 +159,52 @@ def build_model(mp: ModelParameters) -> None:
     training_set_size = math.ceil(bed_file_length * (mp.training_set_percent / 100.0))
     logger.info("Training set size: {training_set_size}.")
 
-    if not mp.training_set_file:
-        with SupressOutput():
-            region_extractor.RegionsExtractor.extract_regions(
-                mp.plasmid.fasta_file,
-                mp.plasmid.bed_file,
-                mp.plasmid.gene_start,
-                mp.plasmid.gene_end,
-                window_length=mp.window_length,
-                num_regions=4,
-                padding=mp.padding_length,
-                bed_extra=True,
-                bed_extra_output=bed_extra_filename,
-                create_weights=False,
-            )
+    seq = model_pipeline.ModelPipeline.read_sequence(mp.plasmid.fasta_file)
 
-        logger.info("Creating training set.")
-        training_set.TrainingSet.training_set(
-            bed_extra_filename, training_set_size, bed_extra_training_set_filename
-        )
-    else:
-        logger.info("Duplicating training set.")
-        shutil.copyfile(mp.training_set_file, bed_extra_training_set_filename)
-
-    with SupressOutput():
-        region_extractor.RegionsExtractor.extract_regions(
-            mp.plasmid.fasta_file,
-            bed_extra_training_set_filename,
-            mp.plasmid.gene_start,
-            mp.plasmid.gene_end,
-            window_length=mp.window_length,
-            out_pref=weight_xlsx_filename,
-            num_regions=4,
-            padding=mp.padding_length,
-            bed_extra=False,
-            create_weights=True,
-        )
-
-    logger.info("Thresholding critical regions.")
-
-    with SupressOutput():
-        region_threshold.RegionsThreshold.extract_regions(
-            weight_xlsx_filename,
-            weight_shannon_entropy_xlsx_filename,
-            True,  # Shannon Entropy
-        )
-
-    logger.info("Creating dictionary.")
-
-    with SupressOutput():
-        grammar_dict.GrammarDict.extract_regions(
-            mp.plasmid.fasta_file,
-            bed_extra_training_set_filename,
-            weight_xlsx_filename,
-            mp.plasmid.gene_start,
-            mp.plasmid.gene_end,
-            mp.window_length,
-            weight_shannon_entropy_xlsx_filename,
-            dict_shannon_xlsx_filename,
-        )
+    with instrumentation.stage(
+        metrics, "training_set", [bed_extra_training_set_filename]
+    ) as inputs:
+        if not mp.training_set_file:
+            bed_extra_lines = model_pipeline.ModelPipeline.read_bed_extra(
+                mp.plasmid.bed_file, mp.window_length, mp.bed_extra_file
+            )
 
-    logger.info("Extracting training set words.")
-
-    with SupressOutput():
-        grammar_word.GrammarWord.extract_word(
-            mp.plasmid.fasta_file,
-            bed_extra_training_set_filename,
-            dict_shannon_json_filename,
-            mp.plasmid.gene_start,
-            mp.plasmid.gene_end,
-            mp.window_length,
-            training_set_words_filename,
-        )
+            logger.info("Creating training set.")
+            training_set_lines = training_set.TrainingSet.sample(
+                bed_extra_lines, training_set_size
+            )
 
-    logger.info("Finding probabilities.")
-    grammar_training.GrammarTraining.find_probabilities(
-        training_set_words_filename, mp.window_length, probabilities_filename
+            with open(bed_extra_training_set_filename, "w") as fout:
+                fout.writelines(training_set_lines)
+        else:
+            logger.info("Duplicating training set.")
+            shutil.copyfile(mp.training_set_file, bed_extra_training_set_filename)
+
+            with open(bed_extra_training_set_filename, "r") as fin:
+                training_set_lines = fin.readlines()
+
+        inputs["rloops"] = len(training_set_lines)
+
+    model_pipeline.ModelPipeline.build(
+        seq,
+        training_set_lines,
+        mp.plasmid.gene_start,
+        mp.plasmid.gene_end,
+        mp.window_length,
+        mp.padding_length,
+        artifacts=mp.artifacts,
+        weight_xlsx=weight_xlsx_filename,
+        weight_shannon_xlsx=weight_shannon_entropy_xlsx_filename,
+        dict_xlsx=dict_shannon_xlsx_filename,
+        dict_json=dict_shannon_json_filename,
+        dict_blocks=dict_shannon_blocks_filename,
+        words_out=training_set_words_filename,
+        probabilities_out=probabilities_filename,
+        cache=mp.cache,
+        counts_out=counts_filename,
+        weight_npz=weight_npz_filename,
+        weight_shannon_npz=weight_shannon_entropy_npz_filename,
+        metrics=metrics,
     )
 
 
@@ -229,6 +220,14 @@ parser.add_argument(
     "--duplicate",
     help="Duplicate the seed from another set of runs, this will override the count.",
 )
+parser.add_argument(
+    "--artifacts",
+    choices=model_pipeline.ARTIFACTS,
+    default="xlsx",
+    help="Files written besides the model: none, text files (json) or also the XLSX workbooks (xlsx).",
+)
+execution.add_arguments(parser)
+stage_cache.add_arguments(parser)
 
 
 def main() -> None:
@@ -308,6 +307,11 @@ def main() -> None:
             with open(parent_folder / "model_settings.ini", "w") as configfile:
                 run_config.write(configfile)
 
+            bed_extra_file = parent_folder / f"{plasmid.name}_w{window_length}.bed_extra.bed"
+            model_pipeline.ModelPipeline.write_bed_extra(
+                plasmid.bed_file, window_length, bed_extra_file
+            )
+
         runs = [
             ModelParameters(
                 parent_folder,
@@ -318,13 +322,23 @@ def main() -> None:
                 training_set_percent,
                 get_run_seed_file(run_number),
                 get_training_set_file(run_number),
+                args.artifacts,
+                bed_extra_file,
+                stage_cache.StageCache.from_arguments(args),
             )
             for run_number in range(number_of_models)
             for padding in paddings
         ]
 
-        with multiprocessing.Pool(NUMBER_OF_PROCESSES) as pool:
-            pool.map(build_model, runs)
+        execution.run_tasks(
+            build_model,
+            runs,
+            args.jobs,
+            args.backend,
+            lambda _, run: f"run {run.run_number} (padding {run.padding_length})",
+            args.profile,
+            parent_folder,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+import sys
+import importlib
+import argparse
+
+"""
+Single entry point of the command line tools.
+
+
+rloopgrammar COMMAND [ARGUMENTS] runs the main function of the module of the command with the
+remaining arguments, as the rloop-grammar-COMMAND script does. Only the module of the command
+is imported, and the modules keep their heavy dependencies (openpyxl, xlsxwriter, matplotlib)
+in the code paths that use them, so that starting a command, or a worker process that imports
+it, does not load them; rloop-grammar-benchmark --startup checks it against a budget.
+
+"""
+
+PROGRAM_NAME = "rloopgrammar"
+
+# Command -> (module, description)
+COMMANDS = {
+    "build-model": (
+        "rloopgrammar.build_model",
+        "Build a collection of R-loop grammar models.",
+    ),
+    "build-kfold-model": (
+        "rloopgrammar.kfold_model",
+        "Build a collection of R-loop grammar models using k-folds.",
+    ),
+    "union-models": (
+        "rloopgrammar.union_models",
+        "Build a hybrid model based off the union of two or more dictionaries.",
+    ),
+    "predict": (
+        "rloopgrammar.predict",
+        "Form a prediction for a given collection of R-loop grammar models.",
+    ),
+    "graph-prediction": (
+        "rloopgrammar.graph_prediction",
+        "Graph a r-loop grammar prediction.",
+    ),
+    "report": (
+        "rloopgrammar.report",
+        "Summarize the stage metrics of model and prediction collections.",
+    ),
+    "benchmark": (
+        "rloopgrammar.benchmark",
+        "Benchmark the stages of the R-loop grammar on synthetic plasmids.",
+    ),
+}
+
+parser = argparse.ArgumentParser(
+    prog=PROGRAM_NAME,
+    description="R-loop grammar command line tools.",
+    epilog="commands:\n"
+    + "\n".join(
+        f"  {command:<20}{description}"
+        for command, (_, description) in COMMANDS.items()
+    )
+    + f"\n\nRun {PROGRAM_NAME} COMMAND -h for the arguments of a command.",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+)
+parser.add_argument("command", choices=COMMANDS, metavar="COMMAND")
+parser.add_argument("arguments", nargs=argparse.REMAINDER, metavar="ARGUMENTS")
+
+
+def main() -> None:
+    args = parser.parse_args()
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    program = f"{PROGRAM_NAME} {args.command}"
+
+    # The usage of the command shows how it was run
+    if hasattr(module, "parser"):
+        module.parser.prog = program
+
+    sys.argv = [program] + args.arguments
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
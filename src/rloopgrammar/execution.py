@@ -0,0 +1,188 @@
+import multiprocessing
+import multiprocessing.pool
+import functools
+import os
+import sys
+import time
+import traceback
+
+from typing import *
+
+"""
+Shared execution layer of the command line tools.
+
+Runs the independent tasks of a tool (models, folds, unions, predictions) with a process pool,
+a thread pool or serially, reporting progress and the time of every task as it finishes.
+Given a profile, every task runs under it in its worker and the profiles of the tasks are merged
+into one report once they are all done (see profiling, which is only imported then).
+
+"""
+
+JOBS_ENVIRONMENT_VARIABLE = "RLOOPGRAMMAR_JOBS"
+BACKENDS = ("process", "thread", "serial")
+PROFILES = ("cpu", "mem")
+
+
+def available_cpus() -> int:
+    # CPUs this process may run on, which can be fewer than the CPUs of the node
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def number_of_jobs(jobs: Optional[int] = None) -> int:
+    # --jobs, then RLOOPGRAMMAR_JOBS, then every available CPU; 0 or less also means every CPU
+    if jobs is None:
+        jobs = os.environ.get(JOBS_ENVIRONMENT_VARIABLE, None)
+
+    if jobs is None or int(jobs) <= 0:
+        return available_cpus()
+
+    return int(jobs)
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help=f"Number of workers, defaults to {JOBS_ENVIRONMENT_VARIABLE} or to the available CPUs.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="process",
+        help="Run the tasks in worker processes, in threads or one after the other.",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILES,
+        default=None,
+        help="Profile every task with cProfile (cpu) or tracemalloc (mem), in the profile folder of the collection.",
+    )
+
+
+def _timed_task(function, profile, profile_folder, indexed_task):
+    index, task = indexed_task
+    started = time.perf_counter()
+
+    try:
+        if profile:
+            import rloopgrammar.profiling as profiling
+
+            result = profiling.run_profiled(
+                function,
+                task,
+                profile,
+                profiling.profile_file(profile_folder, profile, index),
+            )
+        else:
+            result = function(task)
+        return index, time.perf_counter() - started, result, None
+    except Exception:
+        return index, time.perf_counter() - started, None, traceback.format_exc()
+
+
+def iter_tasks(
+    function: Callable,
+    tasks: list,
+    jobs: Optional[int] = None,
+    backend: str = "process",
+    describe: Optional[Callable] = None,
+    profile: Optional[str] = None,
+    profile_folder=None,
+) -> Iterator[Tuple[int, Any]]:
+    # (index, result) of the tasks as they finish, in any order; a failed task does not stop
+    # the others and all failures are reported together once the last task is done
+    if backend not in BACKENDS:
+        raise AssertionError(f"Unsupported backend: {backend}")
+
+    if profile and profile_folder is None:
+        raise AssertionError("Profiling needs a folder for the profiles")
+
+    if describe is None:
+        describe = lambda index, task: f"run {index}"
+
+    timed_task = functools.partial(_timed_task, function, profile, profile_folder)
+    indexed_tasks = list(enumerate(tasks))
+    workers = min(number_of_jobs(jobs), max(len(tasks), 1))
+
+    # tracemalloc traces the whole process, so tasks in threads would share one trace
+    if profile == "mem" and backend == "thread" and workers > 1:
+        raise AssertionError("Memory profiles need the process or serial backend")
+
+    failures = []
+
+    def collect(outcomes):
+        for done, (index, seconds, result, error) in enumerate(outcomes, 1):
+            name = describe(index, tasks[index])
+
+            if error is None:
+                print(
+                    f"[{done}/{len(tasks)}] {name} finished in {seconds:.2f}s",
+                    file=sys.stderr,
+                )
+                yield index, result
+            else:
+                failures.append((name, error))
+                print(
+                    f"[{done}/{len(tasks)}] {name} failed after {seconds:.2f}s\n{error}",
+                    file=sys.stderr,
+                )
+
+    if backend == "serial" or workers == 1:
+        yield from collect(map(timed_task, indexed_tasks))
+    elif backend == "thread":
+        with multiprocessing.pool.ThreadPool(workers) as pool:
+            yield from collect(pool.imap_unordered(timed_task, indexed_tasks))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            yield from collect(pool.imap_unordered(timed_task, indexed_tasks))
+
+    if profile and tasks:
+        import rloopgrammar.profiling as profiling
+
+        report = profiling.merge_profiles(profile, profile_folder, range(len(tasks)))
+        print(f"{profile} profile of {len(tasks)} tasks: {report}", file=sys.stderr)
+
+    if failures:
+        raise Exception(
+            f"{len(failures)} of {len(tasks)} tasks failed: "
+            + ", ".join(name for name, _ in failures)
+        )
+
+
+def in_order(indexed_results: Iterable[Tuple[int, Any]]) -> Iterator[Any]:
+    # Results of iter_tasks in the order of the tasks, each as soon as all earlier ones are
+    # in; only the results that finished before an earlier one are held
+    pending = dict()
+    expected = 0
+
+    for index, result in indexed_results:
+        pending[index] = result
+
+        while expected in pending:
+            yield pending.pop(expected)
+            expected += 1
+
+
+def run_tasks(
+    function: Callable,
+    tasks: list,
+    jobs: Optional[int] = None,
+    backend: str = "process",
+    describe: Optional[Callable] = None,
+    profile: Optional[str] = None,
+    profile_folder=None,
+) -> list:
+    # Results in the order of the tasks, see iter_tasks
+    results = [None] * len(tasks)
+
+    for index, result in iter_tasks(
+        function, tasks, jobs, backend, describe, profile, profile_folder
+    ):
+        results[index] = result
+
+    return results
@@ -1,18 +1,11 @@
-import openpyxl
-import openpyxl.chart
-import glob
-import collections
 import pathlib
-import matplotlib.pyplot as pyplot
-import re
 import argparse
 import sys
-import numpy
-import scipy
-import scipy.stats
 
 from typing import *
 
+import rloopgrammar.model.ensemble_summary as ensemble_summary
+
 import warnings
 
 PROGRAM_NAME = pathlib.Path(sys.argv[0]).parts[-1][:-4]
@@ -24,48 +17,19 @@ parser.add_argument("-n", "--name", type=str, default=None)
 
 
 def get_average_probabilities(folder):
-    subfolders = [f for f in pathlib.Path(folder).iterdir() if f.is_dir()]
-    files = []
-
-    for subfolder in subfolders:
-        files.extend(glob.glob(f"{subfolder}/*base_in_loop*.XLSX"))
-
-    average_probabilities_list = None
-
-    for file in files:
-        wb = openpyxl.load_workbook(file)
-        ws = wb.active
-
-        m = re.match(r"^.*_w\d_(\d*)_", str(file))
-        run_number = 0
-
-        row_value_iter = iter(ws.values)
-        next(row_value_iter)  # Skip the column header
-
-        probabilities = collections.defaultdict(lambda: 0)
-        for row in row_value_iter:
-            base_position, probability = row
-            base_position = int(base_position)
-            probability = float(probability)
-
-            probabilities[base_position] = probabilities[base_position] + probability
+    # Mean over the runs of the probability of every base and its mean +/- SEM interval, from
+    # the ensemble summary of the prediction (or from the workbooks of an older prediction)
+    ensemble = ensemble_summary.EnsembleSummary.from_prediction_folder(folder)
 
-        probabilities_list = [
-            probabilities[k] for k in range(1, len(probabilities.keys()) + 1)
-        ]
+    average_probabilities = ensemble.mean()
+    sem = ensemble.sem()
 
-        if not average_probabilities_list:
-            average_probabilities_list = [
-                list() for i in range(len(probabilities_list))
-            ]
-        else:
-            for i in range(len(average_probabilities_list)):
-                average_probabilities_list[i].append(probabilities_list[i])
-
-    return [numpy.mean(p) for p in average_probabilities_list], [
-        (numpy.mean(p) + scipy.stats.sem(p), numpy.mean(p) - scipy.stats.sem(p))
-        for p in average_probabilities_list
-    ]
+    return ensemble_summary.EnsembleSummary.by_position(average_probabilities), list(
+        zip(
+            ensemble_summary.EnsembleSummary.by_position(average_probabilities + sem),
+            ensemble_summary.EnsembleSummary.by_position(average_probabilities - sem),
+        )
+    )
 
 
 def aggregate_graph(name, prediction_folder, axis) -> None:
@@ -131,10 +95,13 @@ def aggregate_graph(name, prediction_folder, axis) -> None:
 
 
 def main():
-    pyplot.rcParams["font.family"] = "Times New Roman"
-
     args = parser.parse_args()
 
+    # matplotlib is only loaded to draw the graph, not to parse the arguments
+    import matplotlib.pyplot as pyplot
+
+    pyplot.rcParams["font.family"] = "Times New Roman"
+
     prediction_folder = args.prediction_folder
     name = prediction_folder if not args.name else args.name
 
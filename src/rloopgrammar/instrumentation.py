@@ -0,0 +1,103 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+from typing import *
+
+"""
+Stage metrics of the command line tools.
+
+
+Every stage of a run appends one JSON line to the metrics file of its collection
+(METRICS_FILE_NAME), with the context of the run (tool, run folder, plasmid, ...), the stage
+name, its inputs (e.g. R-loops, candidate words, dictionary size), its wall and CPU time, the
+peak resident set size of the process while it ran, the bytes of the files it wrote and whether
+it failed. Workers append to the same file, each line with a single write to a file opened for
+appending, so lines of different processes do not interleave.
+
+The peak resident set size is the one of the stage where the peak of the process can be reset
+(Linux, see clear_refs in proc(5)), and the peak of the process so far otherwise, which the
+peak_rss_scope of the record tells. It and the CPU time belong to the whole process, so they
+also count other runs of the thread backend.
+
+rloop-grammar-report summarizes the metrics of one or more collections.
+
+"""
+
+METRICS_FILE_NAME = "stage_metrics.jsonl"
+
+
+def reset_peak_rss() -> str:
+    # Scope of the next peak_rss: the stage when the peak could be reset, the process otherwise
+    try:
+        with open("/proc/self/clear_refs", "w") as fout:
+            fout.write("5")
+        return "stage"
+    except OSError:
+        return "process"
+
+
+def peak_rss() -> int:
+    # Peak resident set size in bytes, VmHWM where there is /proc, ru_maxrss otherwise
+    try:
+        with open("/proc/self/status", "r") as fin:
+            for line in fin:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # Kilobytes on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageMetrics:
+    def __init__(self, metrics_file, **context):
+        self.metrics_file = str(metrics_file)
+        self.context = context
+
+    def write(self, record: dict) -> None:
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        fd = os.open(self.metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, outputs: Iterable = (), **inputs):
+        # Yields the inputs of the record, for the ones only known during the stage; outputs
+        # are the files written by the stage, None for the ones it does not write
+        record = dict(self.context, stage=name, pid=os.getpid(), inputs=dict(inputs))
+        scope = reset_peak_rss()
+        record["started"] = time.time()
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        record["failed"] = True
+
+        try:
+            yield record["inputs"]
+            record["failed"] = False
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall_started
+            record["cpu_seconds"] = time.process_time() - cpu_started
+            record["peak_rss_bytes"] = peak_rss()
+            record["peak_rss_scope"] = scope
+            record["output_bytes"] = sum(
+                os.path.getsize(f) for f in outputs if f and os.path.exists(f)
+            )
+            self.write(record)
+
+
+def stage(metrics: Optional[StageMetrics], name: str, outputs: Iterable = (), **inputs):
+    # Stage of metrics, or a stage that records nothing without metrics
+    if metrics is None:
+        return contextlib.nullcontext(dict())
+
+    return metrics.stage(name, outputs, **inputs)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import argparse
+
+import numpy as np
+
+"""
+Candidate R-loops of a gene for prediction.
+
+
+The candidates (x, y) are all pairs with gene_start + w <= x < gene_end - 2w and
+x + w <= y < gene_end - w where y - x is a multiple of w, ordered by x and then y. They are
+kept as an (n, 2) int32 array, either generated on the fly from (gene_start, gene_end, w) or
+stored as a .npy file that workers memory-map instead of parsing a BED file.
+
+Float sums over the candidates (partition function in log mode, per-base probabilities) are
+taken in BLOCKS fixed blocks of consecutive candidates and added in block order. The blocks
+only depend on the number of candidates, so the sums are the same to the bit however the
+candidates are split into shards.
+
+"""
+
+# Number of blocks the float sums over the candidates are taken in, see blocks
+BLOCKS = 256
+
+
+class CandidateIndex:
+    @classmethod
+    def counts(cls, starts, end_idx, width):
+        # Number of candidates for every start x
+        return np.maximum(end_idx - width - np.asarray(starts) - 1, 0) // width
+
+    @classmethod
+    def generate(cls, start_idx, end_idx, width, x_start=None, x_end=None):
+        # Candidates with x_start <= x < x_end, the whole gene by default
+        first = start_idx + width
+        last = end_idx - 2 * width
+
+        x_start = first if x_start is None else max(x_start, first)
+        x_end = last if x_end is None else min(x_end, last)
+
+        starts = np.arange(x_start, max(x_end, x_start), dtype=np.int64)
+        counts = cls.counts(starts, end_idx, width)
+
+        x = np.repeat(starts, counts)
+        offsets = np.arange(len(x)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        return np.stack((x, x + width * (offsets + 1)), axis=1).astype(np.int32)
+
+    @classmethod
+    def total(cls, start_idx, end_idx, width):
+        # Number of candidates of the gene
+        starts = np.arange(start_idx + width, max(end_idx - 2 * width, start_idx + width))
+
+        return int(np.sum(cls.counts(starts, end_idx, width)))
+
+    @classmethod
+    def generate_range(cls, start_idx, end_idx, width, first, last):
+        # Candidates first <= n < last in the order of generate
+        starts = np.arange(start_idx + width, max(end_idx - 2 * width, start_idx + width))
+        counts = cls.counts(starts, end_idx, width)
+        totals = np.cumsum(counts)
+
+        if last <= first:
+            return np.empty((0, 2), dtype=np.int32)
+
+        a = int(np.searchsorted(totals, first, side="right"))
+        b = int(np.searchsorted(totals, last - 1, side="right"))
+        before = int(totals[a] - counts[a])
+
+        return cls.generate(
+            start_idx, end_idx, width, int(starts[a]), int(starts[b]) + 1
+        )[first - before : last - before]
+
+    @classmethod
+    def blocks(cls, n):
+        # Bounds of the blocks of n candidates, the first one is 0 and the last one n
+        return sorted(set((n * np.arange(BLOCKS + 1) // BLOCKS).tolist()))
+
+    @classmethod
+    def write(cls, candidates, out_file):
+        np.save(out_file, np.asarray(candidates, dtype=np.int32))
+
+    @classmethod
+    def read(cls, index_in):
+        # A .npy index is memory-mapped, any other file is read as a BED file
+        if str(index_in).endswith(".npy"):
+            return np.load(index_in, mmap_mode="r")
+
+        with open(index_in, "r", encoding="utf-8") as fin:
+            rloops = [list(map(int, line.split("\t")[1:3])) for line in fin]
+
+        return np.array(rloops, dtype=np.int32).reshape(-1, 2)
+
+    @classmethod
+    def get_args(cls):
+        parser = argparse.ArgumentParser(description="Candidate R-loops index")
+        parser.add_argument(
+            "-s",
+            "--start-index",
+            metavar="START_INDEX",
+            type=int,
+            required=True,
+            help="Start index of gene region",
+            default=0,
+        )
+        parser.add_argument(
+            "-e",
+            "--end-index",
+            metavar="END_INDEX",
+            type=int,
+            required=True,
+            help="End index of gene region",
+            default=0,
+        )
+        parser.add_argument(
+            "-w",
+            "--window-length",
+            metavar="WINDOW_LENGTH",
+            type=int,
+            required=True,
+            help="Number of nucleotides in single region",
+        )
+        parser.add_argument(
+            "-o",
+            "--output-file",
+            metavar="OUTPUT_FILE",
+            type=str,
+            required=False,
+            help="Output NPY file",
+            default="all_rloops.npy",
+        )
+        return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = vars(CandidateIndex.get_args())
+    CandidateIndex.write(
+        CandidateIndex.generate(
+            args.get("start_index", 0), args.get("end_index", 0), args["window_length"]
+        ),
+        args.get("output_file", "all_rloops.npy"),
+    )
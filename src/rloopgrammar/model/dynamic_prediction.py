@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+import argparse
+import json
+
+import numpy as np
+
+import rloopgrammar.model.probabilistic_language as probabilistic_language
+import rloopgrammar.model.symbol_track as symbol_track
+from rloopgrammar.model.in_loop_probs import Loop_probabilities
+from rloopgrammar.model.probabilistic_language import GrammarSymbol
+
+"""
+Script to find probability of a base being in an R-loop without enumerating the candidate R-loops.
+
+The word of a candidate R-loop (x, y) reads S-symbols up to alpha, R-symbols up to omega and
+Q-symbols up to the end, so its probability factors into a term depending only on x and a term
+depending only on y once the R-symbols are written as a difference of prefix sums along the
+frame of the R-loop. The partition function, the probability of each base being in an R-loop
+and the expected start, end and length then follow from prefix and suffix sums, in O(L * w).
+
+"""
+
+SYMBOL_NAMES = {
+    "SIGMA": GrammarSymbol.SIGMA,
+    "SIGMA^": GrammarSymbol.SIGMA_HAT,
+    "GAMMA": GrammarSymbol.GAMMA,
+    "DELTA": GrammarSymbol.DELTA,
+    "TAU": GrammarSymbol.TAU,
+    "TAU^": GrammarSymbol.TAU_HAT,
+    "RHO": GrammarSymbol.RHO,
+    "BETA": GrammarSymbol.BETA,
+}
+
+
+class DynamicPrediction:
+    @classmethod
+    def __log_track(cls, letters, symbol_probability_map, length):
+        log_probabilities = {
+            k: np.log(float(v)) for k, v in symbol_probability_map.items()
+        }
+
+        track = np.zeros(length)
+        track[: len(letters)] = [
+            log_probabilities[SYMBOL_NAMES[letter]] for letter in letters
+        ]
+
+        return track
+
+    @classmethod
+    def __frame_cumsum(cls, values, window_length):
+        # Sum of the values at p - w, p - 2w, ... separately for every frame
+        out = np.empty_like(values)
+
+        for phase in range(window_length):
+            acc = np.cumsum(values[phase::window_length])
+            out[phase::window_length] = np.concatenate(([0.0], acc[:-1]))
+
+        return out
+
+    @classmethod
+    def __frame_logsumexp(cls, values, window_length, reverse=False):
+        out = np.empty_like(values)
+
+        for phase in range(window_length):
+            frame = values[phase::window_length]
+
+            if reverse:
+                out[phase::window_length] = np.logaddexp.accumulate(frame[::-1])[::-1]
+            else:
+                out[phase::window_length] = np.logaddexp.accumulate(frame)
+
+        return out
+
+    @classmethod
+    def get_args(cls):
+        parser = argparse.ArgumentParser(description="Find in loop probabilities")
+        parser.add_argument(
+            "-f",
+            "--input-fasta",
+            metavar="FASTA_IN_FILE",
+            type=str,
+            required=True,
+            help="FASTA input file",
+            default=None,
+        )
+        parser.add_argument(
+            "-j",
+            "--input-json",
+            metavar="JSON_IN_FILE",
+            type=str,
+            required=True,
+            help="JSON dictionary input file",
+            default=None,
+        )
+        parser.add_argument(
+            "-p",
+            "--input_probabilities",
+            metavar="PROBABILITIES_IN_FILE",
+            type=str,
+            required=True,
+            help="Probabilities input file",
+            default=None,
+        )
+        parser.add_argument(
+            "-s",
+            "--start-index",
+            metavar="START_INDEX",
+            type=int,
+            required=True,
+            help="Start index of gene region",
+            default=0,
+        )
+        parser.add_argument(
+            "-e",
+            "--end-index",
+            metavar="END_INDEX",
+            type=int,
+            required=True,
+            help="End index of gene region",
+            default=0,
+        )
+        parser.add_argument(
+            "-l",
+            "--seq_length",
+            metavar="NUM_BASES",
+            type=int,
+            required=True,
+            help="Number of bases",
+            default=None,
+        )
+        parser.add_argument(
+            "-w",
+            "--width",
+            metavar="WIDTH",
+            type=int,
+            required=True,
+            help="N-Tuple size",
+        )
+        parser.add_argument(
+            "-o",
+            "--output_file",
+            metavar="OUTPUT_FILE",
+            type=str,
+            required=False,
+            help="Output XLSX file",
+            default="output",
+        )
+        return parser.parse_args()
+
+    @classmethod
+    def in_loop_probabilities(
+        cls,
+        fasta_in,
+        json_in,
+        probabs_in,
+        start_idx,
+        end_idx,
+        seq_len,
+        width,
+        output_file="output",
+    ):
+        track = symbol_track.SymbolTrack.from_files(
+            fasta_in, json_in, start_idx, end_idx, width
+        )
+
+        with open(probabs_in, "r", encoding="utf-8") as file_handle:
+            probabilities = json.load(
+                file_handle, object_hook=probabilistic_language.from_gmpy
+            )
+
+        (
+            S_to_S_symbol_probability_map,
+            S_to_R_symbol_probability_map,
+            R_to_R_symbol_probability_map,
+            R_to_Q_symbol_probability_map,
+            Q_to_Q_symbol_probability_map,
+            Q_to_end_symbol_probability_map,
+        ) = probabilistic_language.transition_probability_maps(probabilities)
+
+        gene_len = len(track.gene_seq)
+        length = gene_len + width
+
+        region1_letters = track.letters["region1"]
+        region2_3_letters = track.letters["region2_3"]
+        region4_letters = track.letters["region4"]
+
+        q_to_q = cls.__log_track(region1_letters, Q_to_Q_symbol_probability_map, length)
+        q_to_end = cls.__log_track(region1_letters, Q_to_end_symbol_probability_map, length)
+        r_to_r = cls.__log_track(region2_3_letters, R_to_R_symbol_probability_map, length)
+        r_to_q = cls.__log_track(region2_3_letters, R_to_Q_symbol_probability_map, length)
+        s_to_s = cls.__log_track(region4_letters, S_to_S_symbol_probability_map, length)
+        s_to_r = cls.__log_track(region4_letters, S_to_R_symbol_probability_map, length)
+
+        positions = np.arange(length)
+
+        # Q-symbols are the blocks of [0, x) aligned to the gene start, the one at 0 ends the word
+        q_blocks = np.cumsum(q_to_q[0:gene_len:width])
+        q_count = np.maximum(positions // width, 1)
+        log_q = q_to_end[0] + q_blocks[np.minimum(q_count, len(q_blocks)) - 1] - q_to_q[0]
+
+        # S-symbols are the blocks of [y, L) aligned to the gene end, the one next to y reads alpha
+        s_blocks = np.concatenate(([0.0], np.cumsum(s_to_s[gene_len - width :: -width])))
+        s_count = np.clip((gene_len - positions) // width, 1, len(s_blocks) - 1)
+        log_s = s_blocks[s_count - 1] + s_to_r[np.maximum(gene_len - s_count * width, 0)]
+
+        # R-symbols are the blocks of [x, y), the one at x reads omega
+        r_prefix = cls.__frame_cumsum(r_to_r, width)
+
+        log_start = np.full(length, -np.inf)
+        log_end = np.full(length, -np.inf)
+
+        starts_range = positions[width : max(gene_len - 2 * width, width)]
+        ends_range = positions[2 * width : max(gene_len - width, 2 * width)]
+
+        log_start[starts_range] = (
+            log_q[starts_range]
+            + r_to_q[starts_range]
+            - r_prefix[starts_range + width]
+        )
+        log_end[ends_range] = r_prefix[ends_range] + log_s[ends_range]
+
+        start_acc = cls.__frame_logsumexp(log_start, width)
+        end_acc = cls.__frame_logsumexp(log_end, width, reverse=True)
+
+        start_terms = log_start[: length - width] + end_acc[width:]
+        end_terms = log_end[width:] + start_acc[: length - width]
+
+        log_partition_function = np.logaddexp.reduce(start_terms)
+        assert np.isfinite(log_partition_function), "Partition function is 0"
+
+        print("#probabilities:", np.count_nonzero(np.isfinite(start_terms)))
+        print("The log partition function is: ", log_partition_function)
+
+        start_probs = np.exp(start_terms - log_partition_function)
+        end_probs = np.exp(end_terms - log_partition_function)
+
+        # A base t is in the R-loop (x, y) when x <= t < y, with x and y in the same frame
+        in_loop = np.zeros(gene_len)
+
+        for d in range(width):
+            in_loop[d:] += np.exp(
+                start_acc[: gene_len - d]
+                + end_acc[width : width + gene_len - d]
+                - log_partition_function
+            )
+
+        starts = start_idx + positions[: length - width]
+        ends = start_idx + positions[width:]
+
+        json_dict = {
+            "expected_length": float(
+                np.dot(end_probs, ends) - np.dot(start_probs, starts)
+            ),
+            "expected_start": float(np.dot(start_probs, seq_len - starts)),
+            "expected_end": float(np.dot(end_probs, seq_len - ends)),
+        }
+
+        # Bases are plotted with alpha on the left and omega on the right
+        summary = np.zeros(seq_len)
+        plasmid_positions = start_idx + np.arange(gene_len)
+        indexes = seq_len - 1 - plasmid_positions
+        mask = (indexes >= 0) & (indexes < seq_len)
+        summary[indexes[mask]] = in_loop[mask]
+
+        return Loop_probabilities.write_base_in_loop(
+            summary, json_dict, start_idx, end_idx, output_file
+        )
+
+
+if __name__ == "__main__":
+    args = vars(DynamicPrediction.get_args())
+    DynamicPrediction.in_loop_probabilities(
+        args.get("input_fasta", None),
+        args.get("input_json", None),
+        args.get("input_probabilities", None),
+        args.get("start_index", 0),
+        args.get("end_index", 0),
+        args.get("seq_length", None),
+        args["width"],
+        args.get("output_file", "output"),
+    )
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import pathlib
+
+import numpy as np
+
+"""
+Mean and standard error of the predictions of the runs of a collection.
+
+
+The in-loop probability of every base and the expected length, start and end of the R-loops are
+accumulated one run at a time with Welford's algorithm, which keeps the number of runs, the
+running mean and the running sum of squared deviations from the mean (M2) of every value, so the
+runs never have to be held together. The summary is stored as one compressed .npz file, written
+by rloop-grammar-predict next to the runs of a prediction, and graphing and statistics read it
+instead of the workbook of every run.
+
+The standard error of the mean is sqrt(M2 / (n - 1) / n) as scipy.stats.sem computes it, and is
+NaN for a single run.
+
+"""
+
+PROBABILITIES = "probabilities"
+STATS_KEYS = ("expected_length", "expected_start", "expected_end")
+
+
+class EnsembleSummary:
+    def __init__(self):
+        self.count = 0
+        self.means = dict()
+        self.m2s = dict()
+
+    def add(self, probabilities, stats=None):
+        # One run: its in-loop probabilities and optionally its expected length, start and end
+        values = {PROBABILITIES: np.asarray(probabilities, dtype=np.float64)}
+
+        if stats is not None:
+            values.update({k: np.float64(stats[k]) for k in STATS_KEYS})
+
+        if self.count and set(values) != set(self.means):
+            raise AssertionError("Every run must give the same values")
+
+        self.count += 1
+
+        for name, value in values.items():
+            if self.count == 1:
+                self.means[name] = np.array(value, dtype=np.float64)
+                self.m2s[name] = np.zeros_like(self.means[name])
+                continue
+
+            if np.shape(value) != np.shape(self.means[name]):
+                raise AssertionError(f"Runs with different lengths of {name}")
+
+            delta = value - self.means[name]
+            self.means[name] = self.means[name] + delta / self.count
+            self.m2s[name] = self.m2s[name] + delta * (value - self.means[name])
+
+    def mean(self, name=PROBABILITIES):
+        return self.means[name]
+
+    def variance(self, name=PROBABILITIES):
+        # Sample variance over the runs
+        if self.count < 2:
+            return np.full_like(self.m2s[name], np.nan)
+
+        return self.m2s[name] / (self.count - 1)
+
+    def sem(self, name=PROBABILITIES):
+        return np.sqrt(self.variance(name) / self.count)
+
+    @classmethod
+    def by_position(cls, values):
+        # Values of the bases 1 to n - 1 followed by a 0, as the lists of the workbooks of the
+        # runs and of the experimental data are built, so item i is plotted at position i + 1
+        return np.asarray(values)[1:].tolist() + [0.0]
+
+    def write(self, out_file):
+        arrays = {"count": np.int64(self.count)}
+
+        for name in self.means:
+            arrays[f"{name}_mean"] = self.means[name]
+            arrays[f"{name}_m2"] = self.m2s[name]
+
+        np.savez_compressed(out_file, **arrays)
+
+    @classmethod
+    def read(cls, summary_in):
+        ensemble = cls()
+
+        with np.load(summary_in) as data:
+            ensemble.count = int(data["count"])
+
+            for key in data.files:
+                if key.endswith("_mean"):
+                    name = key[: -len("_mean")]
+                    ensemble.means[name] = data[key]
+                    ensemble.m2s[name] = data[f"{name}_m2"]
+
+        return ensemble
+
+    @classmethod
+    def read_base_in_loop(cls, workbook_in):
+        # In-loop probabilities of a run, as written by Loop_probabilities.write_base_in_loop
+        import openpyxl
+
+        wb = openpyxl.load_workbook(workbook_in, read_only=True)
+        rows = wb.active.iter_rows(min_row=2, max_col=2, values_only=True)
+        probabilities = [float(probability) for _, probability in rows]
+        wb.close()
+
+        return probabilities
+
+    @classmethod
+    def from_workbooks(cls, workbooks):
+        # Summary of runs written before the summary was, their stats JSON files are used when
+        # every run has one
+        ensemble = cls()
+        workbooks = sorted(workbooks)
+        stats_files = [
+            str(workbook)[: -len(".XLSX")] + "_stats.json" for workbook in workbooks
+        ]
+        with_stats = all(pathlib.Path(f).exists() for f in stats_files)
+
+        for workbook, stats_file in zip(workbooks, stats_files):
+            stats = None
+
+            if with_stats:
+                with open(stats_file, "r") as fin:
+                    stats = json.load(fin)
+
+            ensemble.add(cls.read_base_in_loop(workbook), stats)
+
+        return ensemble
+
+    @classmethod
+    def from_prediction_folder(cls, prediction_folder):
+        # The summary written by rloop-grammar-predict, or the summary of the workbooks of the
+        # runs of an older prediction
+        summaries = glob.glob(f"{prediction_folder}/*_ensemble.npz")
+
+        if len(summaries) == 1:
+            return cls.read(summaries[0])
+
+        return cls.from_workbooks(
+            glob.glob(f"{prediction_folder}/*/*base_in_loop*.XLSX")
+        )
+
+    @classmethod
+    def get_args(cls):
+        parser = argparse.ArgumentParser(
+            description="Summarize the runs of a prediction"
+        )
+        parser.add_argument(
+            "-i",
+            "--input-folder",
+            metavar="PREDICTION_FOLDER",
+            type=str,
+            required=True,
+            help="Prediction folder, with one subfolder per run",
+        )
+        parser.add_argument(
+            "-o",
+            "--output-file",
+            metavar="OUTPUT_FILE",
+            type=str,
+            required=True,
+            help="Output NPZ file",
+        )
+        return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = vars(EnsembleSummary.get_args())
+    EnsembleSummary.from_workbooks(
+        glob.glob(f"{args['input_folder']}/*/*base_in_loop*.XLSX")
+    ).write(args["output_file"])
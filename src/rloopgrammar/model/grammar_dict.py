@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
 import argparse
-import json
+import collections
+import logging
 import random
 
-import openpyxl
-from openpyxl import Workbook
-from openpyxl.cell import WriteOnlyCell
-from openpyxl.styles import Font
+import rloopgrammar.model.grammar_dictionary as grammar_dictionary
+import rloopgrammar.model.regions_extractor as regions_extractor
 
 """
 Script to generate an R-loop dictionary from a BED file.
@@ -98,6 +97,9 @@ class GrammarDict:
 
     COLS_PER_RLOOP = 9
 
+    # R-loops shown in the XLSX file, whose columns are limited
+    MAX_XLSX_RLOOPS = 1800
+
     @classmethod
     def __get_order_key(cls, x):
         if not x:
@@ -161,18 +163,14 @@ class GrammarDict:
 
     # For computing N1, N2, N3
     @classmethod
-    def __count_occurrences(cls, val, data, ret):
+    def __count_occurrences(cls, val, occurrences, ret):
+        # occurrences: Counters of the parsing blocks of r1, r2_rev and r3_rev over all R-loops
         if val in ret.keys():
             return ret.get(val, list())
 
-        r1_count = 0
-        r2_count = 0
-        r3_count = 0
-
-        for v in data.values():
-            r1_count += v.get("r1", list()).count(val)
-            r2_count += v.get("r2_rev", list()).count(val)
-            r3_count += v.get("r3_rev", list()).count(val)
+        r1_count = occurrences[0][val]
+        r2_count = occurrences[1][val]
+        r3_count = occurrences[2][val]
 
         tmp = dict()
         tmp[r1_count] = list()
@@ -272,203 +270,231 @@ class GrammarDict:
             help="Output XLSX file",
             default="output.xlsx",
         )
+        parser.add_argument(
+            "-l",
+            "--blocks-output",
+            metavar="BLOCKS_OUTPUT_FILE",
+            type=str,
+            required=False,
+            help="Output TSV file of the parsing blocks of every R-loop",
+            default=None,
+        )
         return parser.parse_args()
 
     @classmethod
-    def extract_regions(
+    def __region_values(cls, tables):
+        # Weight of every window of each region, keyed by region number
+        values = [dict(), dict(), dict(), dict()]
+
+        for title, rows in tables.items():
+            for n in range(4):
+                if title.endswith(str(n + 1)):
+                    values[n] = {x[0]: x[7] for x in rows}
+                    break
+
+        return values
+
+    @classmethod
+    def __block_letters(
+        cls, val, region, values, extra_values, locations, occurrences, counts
+    ):
+        # Locations and grammar letters of the parsing block val in region r1, r2 or r3
+        if region == "r1":
+            mapping, force_key = cls.GREEK_MAPPING_R1, "FORCE_GAMMA"
+            pair, pair_letter = (cls.__sigma, cls.__sigma_hat), cls.__delta
+        elif region == "r2":
+            mapping, force_key = cls.GREEK_MAPPING_R2, "FORCE_RHO"
+            pair, pair_letter = (cls.__tau, cls.__tau_hat), cls.__beta
+        else:
+            mapping, force_key = cls.GREEK_MAPPING_R3, "FORCE_GAMMA"
+            pair, pair_letter = (cls.__sigma, cls.__sigma_hat), cls.__delta
+
+        val_locations = cls.__find_locations(val, *values, locations)
+
+        # If val not in "most relevant list"
+        if len(val_locations) < 1:
+            val_locations = cls.__count_occurrences(val, occurrences, counts)
+
+        funny_letters = None
+        if val_locations and len(val_locations) > 0:
+            tmp_val = val_locations[0].split("_")[1]  # take maximum weight/count
+            # Collect N/W whose value is the same as the maximum one
+            tmp_keys = [
+                i.split("_")[0].upper()
+                for i in val_locations
+                if i.split("_")[1] == tmp_val
+            ]
+
+            # If max is achieved in more than one N-value
+            if (
+                len(tmp_keys) > 1
+                and len([i for i in tmp_keys if i.startswith("N")]) > 0
+            ):
+                tmp_locs = cls.__find_locations(val, *extra_values, dict())
+                if len(tmp_locs) == 0:
+                    tmp_keys = [force_key]
+                else:
+                    tmp_val = tmp_locs[0].split("_")[1]
+                    tmp_keys = [
+                        i.split("_")[0].upper()
+                        for i in tmp_locs
+                        if i.split("_")[1] == tmp_val
+                    ]
+
+            if (
+                "N2" in tmp_keys
+            ):  # This can only happen if tmp_keys has length 1 bc we update it if length > 1
+                tmp_locs = cls.__find_locations(
+                    val, dict(), extra_values[1], extra_values[2], dict(), dict()
+                )
+                if len(tmp_locs) > 0:
+                    while "N2" in tmp_keys:
+                        tmp_keys.remove("N2")
+
+                    tmp_val = tmp_locs[0].split("_")[1]
+                    tmp_keys = [
+                        i.split("_")[0].upper()
+                        for i in tmp_locs
+                        if i.split("_")[1] == tmp_val
+                    ]
+
+            funny_letters = list(set([mapping.get(i, "?") for i in set(tmp_keys)]))
+
+            if pair[0] in funny_letters and pair[1] in funny_letters:
+                funny_letters.remove(pair[0])
+                funny_letters.remove(pair[1])
+                funny_letters.append(pair_letter)
+
+        return val_locations, funny_letters
+
+    @classmethod
+    def build(
         cls,
-        fasta_in,
-        bed_in,
-        xlsx_in,
+        gene_seq,
+        lines,
         start_idx,
         end_idx,
-        window_length=5,
-        xlsx_threshold_in=None,
-        out_file="output.xlsx",
+        window_length,
+        weights,
+        weights_threshold=None,
+        out_file=None,
+        blocks_out=None,
     ):
-        max_rloops = 1800
+        # Grammar dictionary of the R-loops in the BED lines, the XLSX file is only written if out_file is given
+        # and the long format of its parsing blocks if blocks_out is given
         res = dict()
-        with open(fasta_in, "r") as fin:
-            fin.readline()
-            gene_seq = fin.readline().strip().upper()
-
-        gene_seq = gene_seq[start_idx:end_idx]
-
-        with open(bed_in, "r") as fin:
-            line = fin.readline()
+        # Occurrences of every parsing block in r1, r2_rev and r3_rev, counted as res is filled
+        occurrences = (
+            collections.Counter(),
+            collections.Counter(),
+            collections.Counter(),
+        )
 
-            i = 1  # We keep track of the row we are reading in the BED file
-            while line:
-                parts = line.strip().split("\t")
-                idx_1 = int(parts[1])
-                idx_2 = int(parts[2])
+        i = 1  # We keep track of the row we are reading in the BED file
+        for line in lines:
+            parts = line.strip().split("\t")
+            idx_1 = int(parts[1])
+            idx_2 = int(parts[2])
 
-                r1, r2, r3 = cls.__get_regions(
-                    gene_seq, idx_1 - start_idx, idx_2 - start_idx
-                )
-                r1_rev = r1[::-1]
-                r2_rev = r2[::-1]
-                r3_rev = r3[::-1]
-
-                r1_pblocks = [
-                    r1[i : i + window_length] for i in range(0, len(r1), window_length)
-                ]
-                r1_rev_pblocks = [
+            r1, r2, r3 = cls.__get_regions(
+                gene_seq, idx_1 - start_idx, idx_2 - start_idx
+            )
+            r1_rev = r1[::-1]
+            r2_rev = r2[::-1]
+            r3_rev = r3[::-1]
+
+            r1_pblocks = [
+                r1[i : i + window_length] for i in range(0, len(r1), window_length)
+            ]
+            r1_rev_pblocks = [
+                r1_rev[i : i + window_length][::-1]
+                for i in range(0, len(r1), window_length)
+            ]
+
+            r2_pblocks = [
+                r2[i : i + window_length] for i in range(0, len(r2), window_length)
+            ]
+            r2_rev_pblocks = [
+                r2_rev[i : i + window_length][::-1]
+                for i in range(0, len(r2), window_length)
+            ]
+
+            # res contains info from all the R-loops in BED file
+            rloop_key = str(idx_1) + "_" + str(idx_2) + "_" + str(i)
+            res[rloop_key] = {
+                "r1": [
+                    r1[i : i + window_length]
+                    for i in range(0, len(r1), window_length)
+                ],
+                "r1_rev": [
                     r1_rev[i : i + window_length][::-1]
                     for i in range(0, len(r1), window_length)
-                ]
-
-                r2_pblocks = [
-                    r2[i : i + window_length] for i in range(0, len(r2), window_length)
-                ]
-                r2_rev_pblocks = [
+                ],
+                "r2": [
+                    r2[i : i + window_length]
+                    for i in range(0, len(r2), window_length)
+                ],
+                "r2_rev": [
                     r2_rev[i : i + window_length][::-1]
                     for i in range(0, len(r2), window_length)
-                ]
-
-                # res contains info from all the R-loops in BED file
-                res[str(idx_1) + "_" + str(idx_2) + "_" + str(i)] = {
-                    "r1": [
-                        r1[i : i + window_length]
-                        for i in range(0, len(r1), window_length)
-                    ],
-                    "r1_rev": [
-                        r1_rev[i : i + window_length][::-1]
-                        for i in range(0, len(r1), window_length)
-                    ],
-                    "r2": [
-                        r2[i : i + window_length]
-                        for i in range(0, len(r2), window_length)
-                    ],
-                    "r2_rev": [
-                        r2_rev[i : i + window_length][::-1]
-                        for i in range(0, len(r2), window_length)
-                    ],
-                    "r3": [
-                        r3[i : i + window_length]
-                        for i in range(0, len(r3), window_length)
-                    ],
-                    "r3_rev": [
-                        r3_rev[i : i + window_length][::-1]
-                        for i in range(0, len(r3), window_length)
-                    ],
-                }
-
-                line = fin.readline()
-                i += 1
+                ],
+                "r3": [
+                    r3[i : i + window_length]
+                    for i in range(0, len(r3), window_length)
+                ],
+                "r3_rev": [
+                    r3_rev[i : i + window_length][::-1]
+                    for i in range(0, len(r3), window_length)
+                ],
+            }
+
+            occurrences[0].update(res[rloop_key]["r1"])
+            occurrences[1].update(res[rloop_key]["r2_rev"])
+            occurrences[2].update(res[rloop_key]["r3_rev"])
 
-        wb = Workbook(write_only=True)
-        ws = wb.create_sheet("Grammar Symbols")
-        ws.append(("Gene", str(start_idx) + "-" + str(end_idx), gene_seq))
-        ws.append(())
-        ws.append(("Note: R-loop coordinates are given wrt full plasmid",))
-        ws.append(())
+            i += 1
 
-        max_cols = max_rloops * cls.COLS_PER_RLOOP  # max_cols: to print only n R-loops
         sorted_keys = list(
             res.keys()
         )  # Need sorted keys bc we iterate on them (if not ordered, result not consistent)
         sorted_keys.sort(key=cls.__get_order_key)
-        header = list()
-
-        for k in sorted_keys:
-            header.extend(
-                (
-                    k + "_r1",
-                    k + "_r1_extra",
-                    k + "_r1_funny_letters",
-                    k + "_r2_3",
-                    k + "_r2_3_extra",
-                    k + "_r2_3_funny_letters",
-                    k + "_r4",
-                    k + "_r4_extra",
-                    k + "_r4_funny_letters",
-                )
-            )
-
-            if (
-                len(header) >= max_cols
-            ):  # Check we do not have more than max cols allowed by Excel
-                break
-
-        ws.append(header)
 
-        wb_region1_values = dict()
-        wb_region2_values = dict()
-        wb_region3_values = dict()
-        wb_region4_values = dict()
-        wb_region1_extra_values = dict()
-        wb_region2_extra_values = dict()
-        wb_region3_extra_values = dict()
-        wb_region4_extra_values = dict()
-
-        if xlsx_threshold_in:
-            wb_regions = openpyxl.load_workbook(xlsx_threshold_in, read_only=True)
-            for ws_region in wb_regions.worksheets:
-                if ws_region.title.endswith("1"):
-                    wb_region1_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("2"):
-                    wb_region2_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("3"):
-                    wb_region3_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("4"):
-                    wb_region4_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-            wb_regions.close()
-
-            wb_regions = openpyxl.load_workbook(xlsx_in, read_only=True)
-            for ws_region in wb_regions.worksheets:
-                if ws_region.title.endswith("1"):
-                    wb_region1_extra_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("2"):
-                    wb_region2_extra_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("3"):
-                    wb_region3_extra_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("4"):
-                    wb_region4_extra_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-            wb_regions.close()
+        if weights_threshold is not None:
+            values = cls.__region_values(weights_threshold)
+            extra_values = cls.__region_values(weights)
         else:
-            wb_regions = openpyxl.load_workbook(xlsx_in, read_only=True)
-            for ws_region in wb_regions.worksheets:
-                if ws_region.title.endswith("1"):
-                    wb_region1_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("2"):
-                    wb_region2_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("3"):
-                    wb_region3_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-                elif ws_region.title.endswith("4"):
-                    wb_region4_values = {
-                        x[0].value: x[7].value for x in list(ws_region.rows)
-                    }
-            wb_regions.close()
+            values = cls.__region_values(weights)
+            extra_values = [dict(), dict(), dict(), dict()]
 
-        i = 0
-        word_dict = dict()
-        last_cells = dict()
-        row = list()
         locations = dict()
         counts = dict()
+        letters = dict()
+
+        # Locations and letters of the parsing blocks, one R-loop at a time: the letters of a block
+        # only depend on its sequence and region, so each is found once
+        blocks = dict()
+
+        for k in sorted_keys:
+            blocks[k] = dict()
+
+            for region, res_key in (("r1", "r1"), ("r2", "r2_rev"), ("r3", "r3_rev")):
+                region_blocks = list()
+
+                for val in res[k][res_key]:
+                    if (region, val) not in letters:
+                        letters[(region, val)] = cls.__block_letters(
+                            val,
+                            region,
+                            values,
+                            extra_values,
+                            locations,
+                            occurrences,
+                            counts,
+                        )
+
+                    region_blocks.append((val,) + letters[(region, val)])
+
+                blocks[k][region] = region_blocks
 
         grammar_dict = {
             "rloops": list(res.keys()),
@@ -486,445 +512,241 @@ class GrammarDict:
             },
         }
 
-        while len(row) > 0 or i == 0:
-            j = 3
-            row = list()
-            use_red_text = False
-
-            # We read one value from r1, r2 and r3 at the same time, but they have different lengths
-            for k in sorted_keys:  # This "for" generates a row in the output XLSX file
-                if not word_dict.get(k, None):
-                    word_dict[k] = {
-                        "r1_funny_letters": list(),
-                        "r2_funny_letters": list(),
-                        "r3_funny_letters": list(),
-                    }
-
-                use_red_text = not use_red_text
-                cell_font = (
-                    Font(color="FF0000") if use_red_text else Font(color="000000")
-                )
-
-                r1_val = res[k]["r1"][i] if len(res[k]["r1"]) > i else None
-
-                r1_val_locations = (
-                    cls.__find_locations(
-                        r1_val,
-                        wb_region1_values,
-                        wb_region2_values,
-                        wb_region3_values,
-                        wb_region4_values,
-                        locations,
-                    )
-                    if r1_val
-                    else None
-                )
-                # If r1_val not in "most relevant list"
-                if (r1_val_locations is None or len(r1_val_locations) < 1) and r1_val:
-                    r1_val_locations = cls.__count_occurrences(r1_val, res, counts)
-
-                r2_val = res[k]["r2_rev"][i] if len(res[k]["r2_rev"]) > i else None
-                r2_val_locations = (
-                    cls.__find_locations(
-                        r2_val,
-                        wb_region1_values,
-                        wb_region2_values,
-                        wb_region3_values,
-                        wb_region4_values,
-                        locations,
-                    )
-                    if r2_val
-                    else None
-                )
-
-                if (r2_val_locations is None or len(r2_val_locations) < 1) and r2_val:
-                    r2_val_locations = cls.__count_occurrences(r2_val, res, counts)
-
-                r3_val = res[k]["r3_rev"][i] if len(res[k]["r3_rev"]) > i else None
-                r3_val_locations = (
-                    cls.__find_locations(
-                        r3_val,
-                        wb_region1_values,
-                        wb_region2_values,
-                        wb_region3_values,
-                        wb_region4_values,
-                        locations,
-                    )
-                    if r3_val
-                    else None
-                )
-
-                if (r3_val_locations is None or len(r3_val_locations) < 1) and r3_val:
-                    r3_val_locations = cls.__count_occurrences(r3_val, res, counts)
-
-                r1_funny_letters = None
-                if r1_val_locations and len(r1_val_locations) > 0:
-                    tmp_val = r1_val_locations[0].split("_")[
-                        1
-                    ]  # take maximum weight/count
-                    # Collect N/W whose value is the same as the maximum one
-                    tmp_keys = [
-                        i.split("_")[0].upper()
-                        for i in r1_val_locations
-                        if i.split("_")[1] == tmp_val
-                    ]
-
-                    # If max is achieved in more than one N-value
-                    if (
-                        len(tmp_keys) > 1
-                        and len([i for i in tmp_keys if i.startswith("N")]) > 0
-                    ):
-                        tmp_locs = cls.__find_locations(
-                            r1_val,
-                            wb_region1_extra_values,
-                            wb_region2_extra_values,
-                            wb_region3_extra_values,
-                            wb_region4_extra_values,
-                            dict(),
-                        )
-                        if len(tmp_locs) == 0:
-                            tmp_keys = ["FORCE_GAMMA"]
-                        else:
-                            tmp_val = tmp_locs[0].split("_")[1]
-                            tmp_keys = [
-                                i.split("_")[0].upper()
-                                for i in tmp_locs
-                                if i.split("_")[1] == tmp_val
-                            ]
-
-                    if (
-                        "N2" in tmp_keys
-                    ):  # This can only happen if tmp_keys has length 1 bc we update it if length > 1
-                        tmp_locs = cls.__find_locations(
-                            r1_val,
-                            dict(),
-                            wb_region2_extra_values,
-                            wb_region3_extra_values,
-                            dict(),
-                            dict(),
-                        )
-                        if len(tmp_locs) > 0:
-                            while "N2" in tmp_keys:
-                                tmp_keys.remove("N2")
-
-                            tmp_val = tmp_locs[0].split("_")[1]
-                            tmp_keys = [
-                                i.split("_")[0].upper()
-                                for i in tmp_locs
-                                if i.split("_")[1] == tmp_val
-                            ]
-
-                    r1_funny_letters = list(
-                        set([cls.GREEK_MAPPING_R1.get(i, "?") for i in set(tmp_keys)])
-                    )
-
-                    if (
-                        cls.__sigma in r1_funny_letters
-                        and cls.__sigma_hat in r1_funny_letters
-                    ):
-                        r1_funny_letters.remove(cls.__sigma)
-                        r1_funny_letters.remove(cls.__sigma_hat)
-                        r1_funny_letters.append(cls.__delta)
-
-                    if len(r1_funny_letters) == 1:
-                        word_dict[k]["r1_funny_letters"].append(r1_funny_letters[0])
-                    else:
-                        word_dict[k]["r1_funny_letters"].append(
-                            "(" + ",".join(r1_funny_letters) + ")"
-                        )
+        # Symbols get their blocks in the order of the rows of the XLSX file (the i-th block of
+        # every R-loop, then the next ones), which fixes the order of the lists in the dictionary
+        longest = max(
+            [len(v) for k in sorted_keys for v in blocks[k].values()], default=0
+        )
 
-                    x = last_cells.get(k, dict())
-                    x["r1"] = str(j) + "_" + str(i + 6)
-                    last_cells[k] = x
+        for i in range(longest):
+            for k in sorted_keys:
+                for region, dict_region in (
+                    ("r1", "region1"),
+                    ("r2", "region2_3"),
+                    ("r3", "region4"),
+                ):
+                    if len(blocks[k][region]) <= i:
+                        continue
+
+                    val, _, funny_letters = blocks[k][region][i]
+
+                    if len(val) == window_length and funny_letters:
+                        for letter in funny_letters:
+                            ascii_letter = cls.GREEK_TO_ASCII.get(letter, "?")
+                            items = set(
+                                grammar_dict[dict_region].get(ascii_letter, list())
+                            )
+                            items.add(val)
+                            grammar_dict[dict_region][ascii_letter] = list(items)
+
+        if out_file:
+            cls.__write_xlsx(
+                gene_seq, start_idx, end_idx, window_length, sorted_keys, blocks, out_file
+            )
 
-                r2_funny_letters = None
-                if r2_val_locations and len(r2_val_locations) > 0:
-                    tmp_val = r2_val_locations[0].split("_")[1]
-                    tmp_keys = [
-                        i.split("_")[0].upper()
-                        for i in r2_val_locations
-                        if i.split("_")[1] == tmp_val
-                    ]
+        if blocks_out:
+            cls.__write_blocks(sorted_keys, blocks, blocks_out)
 
-                    if (
-                        len(tmp_keys) > 1
-                        and len([i for i in tmp_keys if i.startswith("N")]) > 0
-                    ):
-                        tmp_locs = cls.__find_locations(
-                            r2_val,
-                            wb_region1_extra_values,
-                            wb_region2_extra_values,
-                            wb_region3_extra_values,
-                            wb_region4_extra_values,
-                            dict(),
-                        )
-                        if len(tmp_locs) == 0:
-                            tmp_keys = ["FORCE_RHO"]
-                        else:
-                            tmp_val = tmp_locs[0].split("_")[1]
-                            tmp_keys = [
-                                i.split("_")[0].upper()
-                                for i in tmp_locs
-                                if i.split("_")[1] == tmp_val
-                            ]
-
-                    if "N2" in tmp_keys:
-                        tmp_locs = cls.__find_locations(
-                            r2_val,
-                            dict(),
-                            wb_region2_extra_values,
-                            wb_region3_extra_values,
-                            dict(),
-                            dict(),
-                        )
-                        if len(tmp_locs) > 0:
-                            while "N2" in tmp_keys:
-                                tmp_keys.remove("N2")
-
-                            tmp_val = tmp_locs[0].split("_")[1]
-                            tmp_keys = [
-                                i.split("_")[0].upper()
-                                for i in tmp_locs
-                                if i.split("_")[1] == tmp_val
-                            ]
-
-                    r2_funny_letters = list(
-                        set([cls.GREEK_MAPPING_R2.get(i, "?") for i in set(tmp_keys)])
-                    )
+        return grammar_dict
 
-                    if (
-                        cls.__tau in r2_funny_letters
-                        and cls.__tau_hat in r2_funny_letters
+    @classmethod
+    def __write_blocks(cls, sorted_keys, blocks, out_file):
+        # Long format of the XLSX file: one line per parsing block, for every R-loop
+        with open(out_file, "w", encoding="utf-8") as fout:
+            fout.write("rloop\tregion\tblock\tsequence\tlocations\tfunny_letters\n")
+
+            for k in sorted_keys:
+                for region, name in (("r1", "r1"), ("r2", "r2_3"), ("r3", "r4")):
+                    for n, (val, val_locations, funny_letters) in enumerate(
+                        blocks[k][region]
                     ):
-                        r2_funny_letters.remove(cls.__tau)
-                        r2_funny_letters.remove(cls.__tau_hat)
-                        r2_funny_letters.append(cls.__beta)
-
-                    if len(r2_funny_letters) == 1:
-                        word_dict[k]["r2_funny_letters"].append(r2_funny_letters[0])
-                    else:
-                        word_dict[k]["r2_funny_letters"].append(
-                            "(" + ",".join(r2_funny_letters) + ")"
+                        fout.write(
+                            "\t".join(
+                                (
+                                    k,
+                                    name,
+                                    str(n),
+                                    val,
+                                    ", ".join(val_locations or ()),
+                                    ", ".join(funny_letters or ()),
+                                )
+                            )
+                            + "\n"
                         )
 
-                r3_funny_letters = None
-                if r3_val_locations and len(r3_val_locations) > 0:
-                    tmp_val = r3_val_locations[0].split("_")[1]
-                    tmp_keys = [
-                        i.split("_")[0].upper()
-                        for i in r3_val_locations
-                        if i.split("_")[1] == tmp_val
-                    ]
-
-                    if (
-                        len(tmp_keys) > 1
-                        and len([i for i in tmp_keys if i.startswith("N")]) > 0
-                    ):
-                        tmp_locs = cls.__find_locations(
-                            r3_val,
-                            wb_region1_extra_values,
-                            wb_region2_extra_values,
-                            wb_region3_extra_values,
-                            wb_region4_extra_values,
-                            dict(),
-                        )
-                        if len(tmp_locs) == 0:
-                            tmp_keys = ["FORCE_GAMMA"]
-                        else:
-                            tmp_val = tmp_locs[0].split("_")[1]
-                            tmp_keys = [
-                                i.split("_")[0].upper()
-                                for i in tmp_locs
-                                if i.split("_")[1] == tmp_val
-                            ]
-
-                    if "N2" in tmp_keys:
-                        tmp_locs = cls.__find_locations(
-                            r3_val,
-                            dict(),
-                            wb_region2_extra_values,
-                            wb_region3_extra_values,
-                            dict(),
-                            dict(),
-                        )
-                        if len(tmp_locs) > 0:
-                            while "N2" in tmp_keys:
-                                tmp_keys.remove("N2")
-
-                            tmp_val = tmp_locs[0].split("_")[1]
-                            tmp_keys = [
-                                i.split("_")[0].upper()
-                                for i in tmp_locs
-                                if i.split("_")[1] == tmp_val
-                            ]
-
-                    r3_funny_letters = list(
-                        set([cls.GREEK_MAPPING_R3.get(i, "?") for i in set(tmp_keys)])
-                    )
+    @classmethod
+    def __write_xlsx(
+        cls,
+        gene_seq,
+        start_idx,
+        end_idx,
+        window_length,
+        sorted_keys,
+        blocks,
+        out_file,
+    ):
+        # One group of columns per R-loop, so only the first MAX_XLSX_RLOOPS fit in a worksheet
+        if len(sorted_keys) > cls.MAX_XLSX_RLOOPS:
+            logging.getLogger("r-loop_grammar").warning(
+                f"{out_file} only shows the first {cls.MAX_XLSX_RLOOPS} of "
+                f"{len(sorted_keys)} R-loops, the dictionary is built from all of them."
+            )
 
-                    if (
-                        cls.__sigma in r3_funny_letters
-                        and cls.__sigma_hat in r3_funny_letters
-                    ):
-                        r3_funny_letters.remove(cls.__sigma)
-                        r3_funny_letters.remove(cls.__sigma_hat)
-                        r3_funny_letters.append(cls.__delta)
-
-                    if len(r3_funny_letters) == 1:
-                        word_dict[k]["r3_funny_letters"].append(r3_funny_letters[0])
-                    else:
-                        word_dict[k]["r3_funny_letters"].append(
-                            "(" + ",".join(r3_funny_letters) + ")"
-                        )
+        # openpyxl is only loaded when a workbook is written
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
 
-                    x = last_cells.get(k, dict())
-                    x["r3"] = str(j + 6) + "_" + str(i + 6)
-                    last_cells[k] = x
-
-                if r1_val and len(r1_val) == window_length and r1_funny_letters:
-                    for letter in r1_funny_letters:
-                        ascii_letter = cls.GREEK_TO_ASCII.get(letter, "?")
-                        items = set(grammar_dict["region1"].get(ascii_letter, list()))
-                        items.add(r1_val)
-                        grammar_dict["region1"][ascii_letter] = list(items)
-
-                if r2_val and len(r2_val) == window_length and r2_funny_letters:
-                    for letter in r2_funny_letters:
-                        ascii_letter = cls.GREEK_TO_ASCII.get(letter, "?")
-                        items = set(grammar_dict["region2_3"].get(ascii_letter, list()))
-                        items.add(r2_val)
-                        grammar_dict["region2_3"][ascii_letter] = list(items)
-
-                if r3_val and len(r3_val) == window_length and r3_funny_letters:
-                    for letter in r3_funny_letters:
-                        ascii_letter = cls.GREEK_TO_ASCII.get(letter, "?")
-                        items = set(grammar_dict["region4"].get(ascii_letter, list()))
-                        items.add(r3_val)
-                        grammar_dict["region4"][ascii_letter] = list(items)
-
-                if r1_val:
-                    r1_val = WriteOnlyCell(ws, value=r1_val)
-                    r1_val.font = cell_font
-
-                if r1_val_locations:
-                    r1_val_location = WriteOnlyCell(
-                        ws, value=", ".join(r1_val_locations)
-                    )
-                    r1_val_location.font = cell_font
-                else:
-                    r1_val_location = None
+        sorted_keys = sorted_keys[: cls.MAX_XLSX_RLOOPS]
+        header = list()
 
-                if r1_funny_letters:
-                    r1_funny_letter = WriteOnlyCell(
-                        ws, value=", ".join(r1_funny_letters)
-                    )
-                    r1_funny_letter.font = cell_font
-                else:
-                    r1_funny_letter = None
+        for k in sorted_keys:
+            header.extend(
+                (
+                    k + "_r1",
+                    k + "_r1_extra",
+                    k + "_r1_funny_letters",
+                    k + "_r2_3",
+                    k + "_r2_3_extra",
+                    k + "_r2_3_funny_letters",
+                    k + "_r4",
+                    k + "_r4_extra",
+                    k + "_r4_funny_letters",
+                )
+            )
 
-                if r2_val:
-                    r2_val = WriteOnlyCell(ws, value=r2_val)
-                    r2_val.font = cell_font
+        i = 0
+        last_cells = dict()
+        row = list()
+        rows = list()
 
-                if r2_val_locations:
-                    r2_val_location = WriteOnlyCell(
-                        ws, value=", ".join(r2_val_locations)
-                    )
-                    r2_val_location.font = cell_font
-                else:
-                    r2_val_location = None
+        while len(row) > 0 or i == 0:
+            j = 3
+            row = list()
 
-                if r2_funny_letters:
-                    r2_funny_letter = WriteOnlyCell(
-                        ws, value=", ".join(r2_funny_letters)
+            # We read one value from r1, r2 and r3 at the same time, but they have different lengths
+            for k in sorted_keys:  # This "for" generates a row in the output XLSX file
+                for region, last_col in (("r1", j - 1), ("r2", None), ("r3", j + 5)):
+                    val, val_locations, funny_letters = (
+                        blocks[k][region][i]
+                        if len(blocks[k][region]) > i
+                        else (None, None, None)
                     )
-                    r2_funny_letter.font = cell_font
-                else:
-                    r2_funny_letter = None
 
-                if r3_val:
-                    r3_val = WriteOnlyCell(ws, value=r3_val)
-                    r3_val.font = cell_font
+                    if last_col is not None and val_locations:
+                        x = last_cells.get(k, dict())
+                        x[region] = (i, last_col)
+                        last_cells[k] = x
 
-                if r3_val_locations:
-                    r3_val_location = WriteOnlyCell(
-                        ws, value=", ".join(r3_val_locations)
-                    )
-                    r3_val_location.font = cell_font
-                else:
-                    r3_val_location = None
-
-                if r3_funny_letters:
-                    r3_funny_letter = WriteOnlyCell(
-                        ws, value=", ".join(r3_funny_letters)
-                    )
-                    r3_funny_letter.font = cell_font
-                else:
-                    r3_funny_letter = None
-
-                row.extend(
-                    (
-                        r1_val,
-                        r1_val_location,
-                        r1_funny_letter,
-                        r2_val,
-                        r2_val_location,
-                        r2_funny_letter,
-                        r3_val,
-                        r3_val_location,
-                        r3_funny_letter,
+                    row.extend(
+                        (
+                            val,
+                            ", ".join(val_locations) if val_locations else None,
+                            ", ".join(funny_letters) if funny_letters else None,
+                        )
                     )
-                )
 
                 j += cls.COLS_PER_RLOOP
 
-                if (
-                    len(row) >= max_cols
-                ):  # Check we do not have more than max cols allowed by Excel
-                    break
-
             # If we have reached the end of r1, r2, r3 in res, we have None everywhere in row and we have to clear it
             if len([i for i in row if i is not None]) < 1:
                 row.clear()
 
-            ws.append(row)
+            rows.append(row)
             i += 1
 
-        ws.close()
-        wb.save(out_file)
-
-        wb = openpyxl.load_workbook(out_file)
-        ws = wb["Grammar Symbols"]
-
+        # Cells next to the R-loop get the omega (resp. alpha) letter before the rows are written
         for k, x, y in [
             (i, j.get("r1", None), j.get("r3", None)) for i, j in last_cells.items()
         ]:
-            x_col = int(x.split("_")[0])
-            x_row = int(x.split("_")[1])
-            v = ws.cell(row=x_row, column=x_col - 2).value
+            x_row, x_col = x
+            v = rows[x_row][x_col - 2]
             cell_value = cls.__omega + str(len(v))
 
             if len(v) == window_length:
-                cell_value = ws.cell(row=x_row, column=x_col).value + cls.__omega + "0"
+                cell_value = rows[x_row][x_col] + cls.__omega + "0"
 
-            ws.cell(row=x_row, column=x_col).value = cell_value
+            rows[x_row][x_col] = cell_value
             last_cells[k]["r1"] = cell_value
 
-            y_col = int(y.split("_")[0])
-            y_row = int(y.split("_")[1])
-            v = ws.cell(row=y_row, column=y_col - 2).value
+            y_row, y_col = y
+            v = rows[y_row][y_col - 2]
             cell_value = cls.__alpha + str(len(v))
 
             if len(v) == window_length:
-                cell_value = cls.__alpha + "0" + ws.cell(row=y_row, column=y_col).value
+                cell_value = cls.__alpha + "0" + rows[y_row][y_col]
 
-            ws.cell(row=y_row, column=y_col).value = cell_value
+            rows[y_row][y_col] = cell_value
             last_cells[k]["r3"] = cell_value
 
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Grammar Symbols")
+        ws.append(("Gene", str(start_idx) + "-" + str(end_idx), gene_seq))
+        ws.append(())
+        ws.append(("Note: R-loop coordinates are given wrt full plasmid",))
+        ws.append(())
+        ws.append(header)
+
+        # Columns of consecutive R-loops alternate between red and black text
+        fonts = (Font(color="FF0000"), Font(color="000000"))
+
+        for row in rows:
+            cells = list()
+
+            for n, value in enumerate(row):
+                if value is None:
+                    cells.append(None)
+                    continue
+
+                cell = WriteOnlyCell(ws, value=value)
+                cell.font = fonts[(n // cls.COLS_PER_RLOOP) % 2]
+                cells.append(cell)
+
+            ws.append(cells)
+
+        ws.close()
         wb.save(out_file)
 
-        with open(out_file + ".json", "w") as fout:
-            json.dump(grammar_dict, fout)
+    @classmethod
+    def extract_regions(
+        cls,
+        fasta_in,
+        bed_in,
+        xlsx_in,
+        start_idx,
+        end_idx,
+        window_length=5,
+        xlsx_threshold_in=None,
+        out_file="output.xlsx",
+        blocks_out=None,
+    ):
+        with open(fasta_in, "r") as fin:
+            fin.readline()
+            gene_seq = fin.readline().strip().upper()
+
+        with open(bed_in, "r") as fin:
+            lines = fin.readlines()
+
+        weights = regions_extractor.RegionsExtractor.read_weights(xlsx_in)
+        weights_threshold = (
+            regions_extractor.RegionsExtractor.read_weights(xlsx_threshold_in)
+            if xlsx_threshold_in
+            else None
+        )
+
+        grammar_dict = cls.build(
+            gene_seq[start_idx:end_idx],
+            lines,
+            start_idx,
+            end_idx,
+            window_length,
+            weights,
+            weights_threshold,
+            out_file,
+            blocks_out,
+        )
+
+        grammar_dictionary.GrammarDictionary(grammar_dict).dump(out_file + ".json")
 
 
 if __name__ == "__main__":
@@ -938,4 +760,5 @@ if __name__ == "__main__":
         args.get("window_length", 5),
         args.get("input_xlsx_threshold", None),
         args.get("output_file", "output.xlsx"),
+        args.get("blocks_output", None),
     )
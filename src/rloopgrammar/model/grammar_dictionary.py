@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+
+import numpy as np
+
+"""
+Grammar dictionary with an inverted index from w-mers to grammar symbols.
+
+
+A dictionary produced by GrammarDict maps every region to its grammar symbols and every symbol
+to the list of w-mers it parses. A w-mer is parsed by the first symbol, in dictionary order,
+whose list contains it. The inverted index answers the same question with one hash lookup, or
+with one array lookup on the 2-bit code of the w-mer.
+
+"""
+
+NUCLEOTIDE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+
+# Dense tables have 4^w entries, wider windows only use the hash index
+DENSE_MAX_WIDTH = 12
+
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+BASE_CODES[[ord(base) for base in NUCLEOTIDE_CODES]] = list(NUCLEOTIDE_CODES.values())
+
+
+def encode_kmers(seq, window_length):
+    # 2-bit code of the w-mer starting at every position, -1 if it contains a base other than ACGT
+    if len(seq) < window_length:
+        return np.empty(0, dtype=np.int64)
+
+    bases = BASE_CODES[np.frombuffer(seq.encode("ascii", "replace"), dtype=np.uint8)]
+    windows = np.lib.stride_tricks.sliding_window_view(bases, window_length)
+    powers = 4 ** np.arange(window_length - 1, -1, -1, dtype=np.int64)
+
+    codes = windows.astype(np.int64) @ powers
+    codes[(windows == 255).any(axis=1)] = -1
+
+    return codes
+
+
+class GrammarDictionary:
+    REGIONS = ("region1", "region2_3", "region4")
+
+    # Symbol used for w-mers missing from each region of the dictionary
+    REGION_DEFAULTS = {
+        "region1": "GAMMA",
+        "region2_3": "RHO",
+        "region4": "GAMMA",
+    }
+
+    def __init__(self, grammar_dict):
+        self.rloops = grammar_dict.get("rloops", None)
+
+        # symbols[region][symbol] is the list of w-mers of symbol, in the order of the JSON file
+        self.symbols = {
+            region: grammar_dict.get(region, dict()) for region in self.REGIONS
+        }
+
+        self.__index = dict()
+        self.__members = dict()
+
+        for region, region_dict in self.symbols.items():
+            index = dict()
+
+            for symbol, kmers in region_dict.items():
+                for kmer in kmers:
+                    index.setdefault(kmer, symbol)
+
+            self.__index[region] = index
+            self.__members[region] = {
+                symbol: set(kmers) for symbol, kmers in region_dict.items()
+            }
+
+    @classmethod
+    def load(cls, json_in):
+        with open(json_in, "r") as fin:
+            return cls(json.load(fin))
+
+    @classmethod
+    def read(cls, dictionary_in):
+        # A dictionary already loaded, or the one of a JSON file
+        if isinstance(dictionary_in, cls):
+            return dictionary_in
+
+        return cls.load(dictionary_in)
+
+    def to_json(self):
+        grammar_dict = dict()
+
+        if self.rloops is not None:
+            grammar_dict["rloops"] = self.rloops
+
+        grammar_dict.update(self.symbols)
+        return grammar_dict
+
+    def digest(self):
+        # Version of the parsing, symbol order included: models counted under equal digests merge
+        return hashlib.sha256(
+            json.dumps(self.symbols, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def size(self):
+        # Number of w-mers with a symbol, over all regions
+        return sum(len(index) for index in self.__index.values())
+
+    def dump(self, out_file):
+        with open(out_file, "w") as fout:
+            json.dump(self.to_json(), fout)
+
+    def symbol(self, region, kmer):
+        # First symbol whose list contains kmer, or the default symbol of the region
+        return self.__index[region].get(kmer, self.REGION_DEFAULTS[region])
+
+    def has_symbol(self, region, symbol, kmer):
+        return kmer in self.__members[region].get(symbol, ())
+
+    def contains(self, region, kmer):
+        return kmer in self.__index[region]
+
+    def dense_index(self, region, window_length):
+        # table[code] indexes letters, code being the 2-bit code of a w-mer and 0 the default
+        letters = [self.REGION_DEFAULTS[region]] + list(self.symbols[region].keys())
+        letter_numbers = {letter: n for n, letter in enumerate(letters) if n > 0}
+        table = np.zeros(4**window_length, dtype=np.uint8)
+
+        kmers = [k for k in self.__index[region].keys() if len(k) == window_length]
+        codes = encode_kmers("".join(kmers), window_length)[::window_length]
+        numbers = [letter_numbers[self.__index[region][k]] for k in kmers]
+
+        valid = codes >= 0
+        table[codes[valid]] = np.asarray(numbers, dtype=np.uint8)[valid]
+
+        return letters, table
+
+    def letters(self, region, seq, window_length):
+        # Symbol of the w-mer starting at every position of seq
+        if window_length > DENSE_MAX_WIDTH:
+            return [
+                self.symbol(region, seq[i : i + window_length])
+                for i in range(len(seq) - window_length + 1)
+            ]
+
+        codes = encode_kmers(seq, window_length)
+        letters, table = self.dense_index(region, window_length)
+        track = [letters[n] for n in table[np.maximum(codes, 0)].tolist()]
+
+        for i in np.flatnonzero(codes < 0).tolist():
+            track[i] = self.symbol(region, seq[i : i + window_length])
+
+        return track
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import argparse
-import enum
-import json
 import collections
+import json
 import gmpy2
 
+import numpy as np
+
+import rloopgrammar.model.grammar_word as grammar_word
+import rloopgrammar.model.probabilistic_language as probabilistic_language
+import rloopgrammar.model.symbol_codes as symbol_codes
+
 """
 Script to train a grammar based on a set of  words for R-loops.
 
@@ -15,6 +20,58 @@ Copyright 2021 Svetlana Poznanovic
 
 smoothing_parameter = 1
 
+# Transitions counted in every part of a word, in the order of the probability tables
+TRANSITION_COUNT_KEYS = {
+    "S": (
+        "S_sigma_S",
+        "S_sigma_hat_S",
+        "S_gamma_S",
+        "S_delta_S",
+        "S_sigma_alpha_R",
+        "S_sigma_hat_alpha_R",
+        "S_gamma_alpha_R",
+        "S_delta_alpha_R",
+    ),
+    "R": (
+        "R_tau_R",
+        "R_tau_hat_R",
+        "R_rho_R",
+        "R_beta_R",
+        "R_tau_omega_Q",
+        "R_tau_hat_omega_Q",
+        "R_rho_omega_Q",
+        "R_beta_omega_Q",
+    ),
+    "Q": (
+        "Q_sigma_Q",
+        "Q_sigma_hat_Q",
+        "Q_gamma_Q",
+        "Q_delta_Q",
+        "Q_sigma_end",
+        "Q_sigma_hat_end",
+        "Q_gamma_end",
+        "Q_delta_end",
+    ),
+}
+
+# Transitions (in the order of probabilistic_language.TRANSITIONS) and symbol codes counted in
+# every part of a word, in the order of TRANSITION_COUNT_KEYS
+TRANSITION_COUNT_COLUMNS = {
+    "S": ((0, 1), range(0, 4)),
+    "R": ((2, 3), range(4, 8)),
+    "Q": ((4, 5), range(0, 4)),
+}
+
+# Region of the dictionary every transition reads its symbols in, in the order of the word
+TRANSITION_REGIONS = {
+    "S_to_S": "region4",
+    "S_to_R": "region4",
+    "R_to_R": "region2_3",
+    "R_to_Q": "region2_3",
+    "Q_to_Q": "region1",
+    "Q_to_end": "region1",
+}
+
 
 class GMPYEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -22,77 +79,6 @@ class GMPYEncoder(json.JSONEncoder):
             return str(obj)
 
 
-class GrammarSymbol(str, enum.Enum):
-    SIGMA = "s"
-    SIGMA_HAT = "h"
-    TAU = "t"
-    TAU_HAT = "T"
-    DELTA = "d"
-    BETA = "B"
-    RHO = "R"
-    GAMMA = "g"
-    ALPHA = "O"
-    OMEGA = "o"
-
-
-def up_to_alpha(word):
-    alpha_index = word.index(GrammarSymbol.ALPHA)
-    return word[: alpha_index + 1]
-
-
-def after_alpha_to_omega(word):
-    alpha_index = word.index(GrammarSymbol.ALPHA)
-    omega_index = word.index(GrammarSymbol.OMEGA)
-    assert alpha_index < omega_index
-
-    return word[alpha_index + 1 : omega_index + 1]
-
-
-def after_omega(word):
-    omega_index = word.index(GrammarSymbol.OMEGA)
-    return word[omega_index + 1 :]
-
-
-def sigma_count(word):
-    return word.count("s")
-
-
-def sigma_hat_count(word):
-    return word.count("h")
-
-
-def gamma_count(word):
-    return word.count("g")
-
-
-def delta_count(word):
-    return word.count("d")
-
-
-def tau_count(word):
-    return word.count("T")
-
-
-def tau_hat_count(word):
-    return word.count("H")
-
-
-def rho_count(word):
-    return word.count("R")
-
-
-def beta_count(word):
-    return word.count("B")
-
-
-def omega_count(word):
-    return word.count("o")
-
-
-def alpha_count(word):
-    return word.count("O")
-
-
 class GrammarTraining:
     @classmethod
     def get_args(cls):
@@ -126,112 +112,140 @@ class GrammarTraining:
         return parser.parse_args()
 
     @classmethod
-    def find_probabilities(cls, words_in, width, out_file="output"):
-        with open(words_in, "r", encoding="utf-8") as fin:
-            lines = fin.readlines()
-
-        training_words_greek = []
-        for line in lines:
-            parsing = line.split(":")[1].strip()
-            training_words_greek.append(parsing)
-
-        training_words = []
-
-        omega_counts = collections.defaultdict(int)
-        alpha_counts = collections.defaultdict(int)
-
-        for word in training_words_greek:
-            word = word.replace("σ^", "h")
-            word = word.replace("σ", "s")
-            word = word.replace("δ", "d")
-            word = word.replace("γ", "g")
-            word = word.replace("τ^", "H")
-            word = word.replace("τ", "T")
-            word = word.replace("ρ", "R")
-            word = word.replace("β", "B")
-
-            for i in range(width):
-                omega_counts[i] += word.count(f"ω{i}")
-                alpha_counts[i] += word.count(f"α{i}")
-
-                word = word.replace(f"ω{i}", "o")
-                word = word.replace(f"\xcf\x89{i}", "o")
-                word = word.replace(f"α{i}", "O")
-                word = word.replace(f"\xce\xb1{i}", "O")
-
-            word = word.replace("\xcf\x83^", "h")
-            word = word.replace("\xcf\x83", "s")
-            word = word.replace("\xce\xb4", "d")
-            word = word.replace("\xce\xb3", "g")
-            word = word.replace("\xcf\x84^", "H")
-            word = word.replace("\xcf\x84", "T")
-            word = word.replace("\xcf\x81", "R")
-            word = word.replace("\xce\xb2", "B")
-            word = word.replace("\xcf\x890", "o")
-            word = word.replace("\xcf\x891", "p")
-            word = word.replace("\xcf\x892", "q")
-            word = word.replace("\xcf\x893", "u")
-            word = word.replace("\xcf\x894", "v")
-            word = word.replace("\xce\xb10", "O")
-            word = word.replace("\xce\xb11", "P")
-            word = word.replace("\xce\xb12", "Q")
-            word = word.replace("\xce\xb13", "U")
-            word = word.replace("\xce\xb14", "V")
-            training_words.append(word)
-
-        sigma_ct = smoothing_parameter
-        sigma_hat_ct = smoothing_parameter
-        gamma_ct = smoothing_parameter
-        delta_ct = smoothing_parameter
-
-        sigma_alpha_ct = smoothing_parameter
-        sigma_hat_alpha_ct = smoothing_parameter
-        gamma_alpha_ct = smoothing_parameter
-        delta_alpha_ct = smoothing_parameter
-
-        # reverse each so we read from left to right
-        for word in map(lambda x: x[::-1], training_words):
-            up_to_alpha_part = up_to_alpha(word)
-            S_to_S_transitions = up_to_alpha_part[:-2]
-            S_to_R_transitions = up_to_alpha_part[-2:]
-
-            sigma_ct += sigma_count(S_to_S_transitions)
-            sigma_hat_ct += sigma_hat_count(S_to_S_transitions)
-            gamma_ct += gamma_count(S_to_S_transitions)
-            delta_ct += delta_count(S_to_S_transitions)
-
-            sigma_alpha_ct += sigma_count(S_to_R_transitions)
-            sigma_hat_alpha_ct += sigma_hat_count(S_to_R_transitions)
-            gamma_alpha_ct += gamma_count(S_to_R_transitions)
-            delta_alpha_ct += delta_count(S_to_R_transitions)
-
-        total_len = (
-            sigma_ct
-            + sigma_hat_ct
-            + delta_ct
-            + gamma_ct
-            + sigma_alpha_ct
-            + sigma_hat_alpha_ct
-            + gamma_alpha_ct
-            + delta_alpha_ct
+    def counts(cls, training_words, width):
+        # Sufficient statistics of training: transition counts of the words, without smoothing.
+        # Words are encoded (see symbol_codes) or Greek, symbols a transition cannot read are not
+        # counted
+        totals = np.zeros(
+            len(probabilistic_language.TRANSITIONS) * len(symbol_codes.LETTERS),
+            dtype=np.int64,
         )
+        words = 0
+
+        for batch in probabilistic_language.WordBatch.batches(
+            training_words, strict=False
+        ):
+            totals += batch.transition_counts(strict=False).sum(axis=0)
+            words += len(batch)
+
+        return cls.__counts_of_totals(totals, width, words)
+
+    @classmethod
+    def __counts_of_totals(cls, totals, width, words):
+        # Counts of a vector of symbol counts per transition, as WordBatch.transition_counts
+        # sums them
+        counts = dict(width=width, words=words)
 
-        S_probabilities_counts = {
-            "S_sigma_S": sigma_ct,
-            "S_sigma_hat_S": sigma_hat_ct,
-            "S_gamma_S": gamma_ct,
-            "S_delta_S": delta_ct,
-            "S_sigma_alpha_R": sigma_alpha_ct,
-            "S_sigma_hat_alpha_R": sigma_hat_alpha_ct,
-            "S_gamma_alpha_R": gamma_alpha_ct,
-            "S_delta_alpha_R": delta_alpha_ct,
+        for part, keys in TRANSITION_COUNT_KEYS.items():
+            columns = [
+                t * len(symbol_codes.LETTERS) + code
+                for t in TRANSITION_COUNT_COLUMNS[part][0]
+                for code in TRANSITION_COUNT_COLUMNS[part][1]
+            ]
+
+            counts[f"{part}_transition_counts"] = {
+                k: int(totals[column]) for k, column in zip(keys, columns)
+            }
+
+        return counts
+
+    @classmethod
+    def kmer_counts(cls, transition_kmers):
+        # How often every transition reads the symbol of every w-mer, from (transition, w-mer)
+        # pairs such as GrammarWord.transition_kmers yields. These do not depend on the
+        # dictionary, which only maps the w-mers to symbols (see project_counts)
+        counters = [collections.Counter() for _ in probabilistic_language.TRANSITIONS]
+
+        for transition, kmer in transition_kmers:
+            counters[transition][kmer] += 1
+
+        return {
+            name: dict(sorted(counter.items()))
+            for name, counter in zip(probabilistic_language.TRANSITIONS, counters)
         }
 
+    @classmethod
+    def project_counts(cls, counts, model_dict):
+        # Counts of the same training words under another dictionary, from their w-mer counts
+        if "kmer_transition_counts" not in counts:
+            raise AssertionError("Counts without w-mer counts cannot be projected")
+
+        totals = np.zeros(
+            len(probabilistic_language.TRANSITIONS) * len(symbol_codes.LETTERS),
+            dtype=np.int64,
+        )
+
+        for t, name in enumerate(probabilistic_language.TRANSITIONS):
+            region = TRANSITION_REGIONS[name]
+
+            for kmer, count in counts["kmer_transition_counts"][name].items():
+                code = symbol_codes.LETTER_CODES.get(model_dict.symbol(region, kmer), None)
+
+                if code is not None:
+                    totals[t * len(symbol_codes.LETTERS) + code] += count
+
+        return dict(
+            dictionary=model_dict.digest(),
+            **cls.__counts_of_totals(totals, counts["width"], counts["words"]),
+            kmer_transition_counts=counts["kmer_transition_counts"],
+        )
+
+    @classmethod
+    def merge_counts(cls, counts_list):
+        # Counts of the union of the training sets, which must be counted under the same dictionary
+        counts_list = list(counts_list)
+
+        if not counts_list:
+            raise AssertionError("No counts to merge")
+
+        for field in ("width", "dictionary"):
+            if len({counts.get(field, None) for counts in counts_list}) != 1:
+                raise AssertionError(f"Counts with different {field} cannot be merged")
+
+        merged = dict(
+            dictionary=counts_list[0].get("dictionary", None),
+            width=counts_list[0]["width"],
+            words=sum(counts["words"] for counts in counts_list),
+        )
+
+        for part, keys in TRANSITION_COUNT_KEYS.items():
+            merged[f"{part}_transition_counts"] = {
+                k: sum(counts[f"{part}_transition_counts"][k] for counts in counts_list)
+                for k in keys
+            }
+
+        # The w-mer counts add up as well, so merged counts can still be projected
+        if all("kmer_transition_counts" in counts for counts in counts_list):
+            merged["kmer_transition_counts"] = dict()
+
+            for name in probabilistic_language.TRANSITIONS:
+                counter = collections.Counter()
+
+                for counts in counts_list:
+                    counter.update(counts["kmer_transition_counts"][name])
+
+                merged["kmer_transition_counts"][name] = dict(sorted(counter.items()))
+
+        return merged
+
+    @classmethod
+    def probabilities_from_counts(cls, counts):
+        width = counts["width"]
+
+        def smoothed(part):
+            return {
+                k: v + smoothing_parameter
+                for k, v in counts[f"{part}_transition_counts"].items()
+            }
+
         def alter_key_name(key):
             segments = key.split("_")
             new_segments = segments[:3] + ["i"] + segments[3:]
             return "_".join(new_segments)
 
+        S_probabilities_counts = smoothed("S")
+        total_len = sum(S_probabilities_counts.values())
+
         S_probabilities = {
             k
             if "alpha" not in k
@@ -241,52 +255,8 @@ class GrammarTraining:
             for k, v in S_probabilities_counts.items()
         }
 
-        tau_ct = smoothing_parameter
-        tau_hat_ct = smoothing_parameter
-        rho_ct = smoothing_parameter
-        beta_ct = smoothing_parameter
-
-        tau_omega_ct = smoothing_parameter
-        tau_hat_omega_ct = smoothing_parameter
-        rho_omega_ct = smoothing_parameter
-        beta_omega_ct = smoothing_parameter
-
-        for word in map(lambda x: x[::-1], training_words):
-            after_alpha_to_omega_part = after_alpha_to_omega(word)
-            R_to_R_transitions = after_alpha_to_omega_part[:-2]
-            R_to_Q_transitions = after_alpha_to_omega_part[-2:]
-
-            tau_ct += tau_count(R_to_R_transitions)
-            tau_hat_ct += tau_hat_count(R_to_R_transitions)
-            rho_ct += rho_count(R_to_R_transitions)
-            beta_ct += beta_count(R_to_R_transitions)
-
-            tau_omega_ct += tau_count(R_to_Q_transitions)
-            tau_hat_omega_ct += tau_hat_count(R_to_Q_transitions)
-            rho_omega_ct += rho_count(R_to_Q_transitions)
-            beta_omega_ct += beta_count(R_to_Q_transitions)
-
-        total_len = (
-            tau_ct
-            + tau_hat_ct
-            + rho_ct
-            + beta_ct
-            + tau_omega_ct
-            + tau_hat_omega_ct
-            + rho_omega_ct
-            + beta_omega_ct
-        )
-
-        R_probabilities_counts = {
-            "R_tau_R": tau_ct,
-            "R_tau_hat_R": tau_hat_ct,
-            "R_rho_R": rho_ct,
-            "R_beta_R": beta_ct,
-            "R_tau_omega_Q": tau_omega_ct,
-            "R_tau_hat_omega_Q": tau_hat_omega_ct,
-            "R_rho_omega_Q": rho_omega_ct,
-            "R_beta_omega_Q": beta_omega_ct,
-        }
+        R_probabilities_counts = smoothed("R")
+        total_len = sum(R_probabilities_counts.values())
 
         R_probabilities = {
             k
@@ -297,70 +267,49 @@ class GrammarTraining:
             for k, v in R_probabilities_counts.items()
         }
 
-        sigma_ct = smoothing_parameter
-        sigma_hat_ct = smoothing_parameter
-        gamma_ct = smoothing_parameter
-        delta_ct = smoothing_parameter
-
-        sigma_end_ct = smoothing_parameter
-        sigma_hat_end_ct = smoothing_parameter
-        gamma_end_ct = smoothing_parameter
-        delta_end_ct = smoothing_parameter
-
-        # reverse each so we read from left to right
-        for word in map(lambda x: x[::-1], training_words):
-            after_omega_part = after_omega(word)
-            Q_to_Q_transitions = after_omega_part[:-1]
-            Q_to_end_transitions = after_omega_part[-1:]
-
-            sigma_ct += sigma_count(Q_to_Q_transitions)
-            sigma_hat_ct += sigma_hat_count(Q_to_Q_transitions)
-            gamma_ct += gamma_count(Q_to_Q_transitions)
-            delta_ct += delta_count(Q_to_Q_transitions)
-
-            sigma_end_ct += sigma_count(Q_to_end_transitions)
-            sigma_hat_end_ct += sigma_hat_count(Q_to_end_transitions)
-            gamma_end_ct += gamma_count(Q_to_end_transitions)
-            delta_end_ct += delta_count(Q_to_end_transitions)
-
-        total_len = (
-            sigma_ct
-            + sigma_hat_ct
-            + delta_ct
-            + gamma_ct
-            + sigma_end_ct
-            + sigma_hat_end_ct
-            + gamma_end_ct
-            + delta_end_ct
-        )
-
-        Q_probabilities_counts = {
-            "Q_sigma_Q": sigma_ct,
-            "Q_sigma_hat_Q": sigma_hat_ct,
-            "Q_gamma_Q": gamma_ct,
-            "Q_delta_Q": delta_ct,
-            "Q_sigma_end": sigma_end_ct,
-            "Q_sigma_hat_end": sigma_hat_end_ct,
-            "Q_gamma_end": gamma_end_ct,
-            "Q_delta_end": delta_end_ct,
-        }
+        Q_probabilities_counts = smoothed("Q")
+        total_len = sum(Q_probabilities_counts.values())
 
         Q_probabilities = {
             k: gmpy2.mpq(v, total_len) for k, v in Q_probabilities_counts.items()
         }
 
+        return dict(
+            S_probabilities_counts=S_probabilities_counts,
+            R_probabilities_counts=R_probabilities_counts,
+            Q_probabilities_counts=Q_probabilities_counts,
+            S_probabilities=S_probabilities,
+            R_probabilities=R_probabilities,
+            Q_probabilities=Q_probabilities,
+        )
+
+    @classmethod
+    def probabilities(cls, training_words_greek, width):
+        return cls.probabilities_from_counts(cls.counts(training_words_greek, width))
+
+    @classmethod
+    def read_counts(cls, counts_in):
+        with open(counts_in, "r", encoding="utf-8") as file_handle:
+            return json.load(file_handle)
+
+    @classmethod
+    def write_counts(cls, counts, out_file):
         with open(out_file, "w", encoding="utf-8") as file_handle:
-            data = dict(
-                S_probabilities_counts=S_probabilities_counts,
-                R_probabilities_counts=R_probabilities_counts,
-                Q_probabilities_counts=Q_probabilities_counts,
-                S_probabilities=S_probabilities,
-                R_probabilities=R_probabilities,
-                Q_probabilities=Q_probabilities,
-            )
+            json.dump(counts, file_handle, ensure_ascii=False, indent=4)
 
+    @classmethod
+    def write_probabilities(cls, data, out_file):
+        with open(out_file, "w", encoding="utf-8") as file_handle:
             json.dump(data, file_handle, ensure_ascii=False, indent=4, cls=GMPYEncoder)
 
+    @classmethod
+    def find_probabilities(cls, words_in, width, out_file="output"):
+        training_words_greek = (
+            word for _, _, word in grammar_word.GrammarWord.read_words(words_in)
+        )
+
+        cls.write_probabilities(cls.probabilities(training_words_greek, width), out_file)
+
 
 if __name__ == "__main__":
     args = vars(GrammarTraining.get_args())
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import argparse
-import json
+
+import rloopgrammar.model.candidate_index as candidate_index
+import rloopgrammar.model.grammar_dictionary as grammar_dictionary
+import rloopgrammar.model.symbol_track as symbol_track
 
 """
 Script to generated words for R-loops in a BED file using a dictionary.
@@ -62,17 +65,6 @@ class GrammarWord:
 
         return int(x.split("_")[2])
 
-    @classmethod
-    def __get_regions(cls, gene_seq, bed_start, bed_end):
-        if not gene_seq:
-            raise AssertionError("Specify a gene sequence")
-        if bed_start > bed_end:
-            raise AssertionError("Start index must be lower or equal than end index")
-        if len(gene_seq) < bed_end:
-            raise AssertionError("End index too large")
-
-        return gene_seq[:bed_start], gene_seq[bed_start:bed_end], gene_seq[bed_end:]
-
     @classmethod
     def get_args(cls):
         parser = argparse.ArgumentParser(description="Grammar word")
@@ -91,7 +83,7 @@ class GrammarWord:
             metavar="BED_IN_FILE",
             type=str,
             required=True,
-            help="BED input file",
+            help="BED input file or NPY candidate index",
             default=None,
         )
         parser.add_argument(
@@ -142,7 +134,87 @@ class GrammarWord:
         return parser.parse_args()
 
     @classmethod
-    def extract_word(
+    def words(cls, gene_seq, lines, grammar_dict, start_idx, window_length=5):
+        # (idx_1, idx_2, word) of every R-loop in the BED lines, words are encoded
+        rloops = list()
+
+        for line in lines:
+            parts = line.strip().split("\t")
+            rloops.append((int(parts[1]), int(parts[2])))
+
+        return cls.rloop_words(gene_seq, rloops, grammar_dict, start_idx, window_length)
+
+    @classmethod
+    def iter_rloop_words(
+        cls, gene_seq, rloops, grammar_dict, start_idx, window_length=5
+    ):
+        # (idx_1, idx_2, word) of every (idx_1, idx_2) R-loop, one at a time, words are encoded
+        # as SymbolTrack.encoded returns them
+        # Symbols of every w-mer are looked up once, words are then slices of the track
+        track = symbol_track.SymbolTrack(gene_seq, grammar_dict, window_length)
+
+        for idx_1, idx_2 in rloops:
+            idx_1 = int(idx_1)
+            idx_2 = int(idx_2)
+
+            yield idx_1, idx_2, track.encoded(idx_1 - start_idx, idx_2 - start_idx)
+
+    @classmethod
+    def transition_kmers(cls, gene_seq, lines, grammar_dict, start_idx, window_length=5):
+        # (transition, w-mer) pairs read by the words of the R-loops in the BED lines, see
+        # SymbolTrack.transition_kmers
+        track = symbol_track.SymbolTrack(gene_seq, grammar_dict, window_length)
+
+        for line in lines:
+            parts = line.strip().split("\t")
+
+            yield from track.transition_kmers(
+                int(parts[1]) - start_idx, int(parts[2]) - start_idx
+            )
+
+    @classmethod
+    def rloop_words(cls, gene_seq, rloops, grammar_dict, start_idx, window_length=5):
+        # (idx_1, idx_2, word) of every (idx_1, idx_2) R-loop
+        return list(
+            cls.iter_rloop_words(
+                gene_seq, rloops, grammar_dict, start_idx, window_length
+            )
+        )
+
+    @classmethod
+    def greek(cls, idx_1, idx_2, word, gene_len, start_idx, window_length=5):
+        # Greek word of an encoded word, as written to words files
+        return symbol_track.SymbolTrack.greek(
+            word, idx_1 - start_idx, idx_2 - start_idx, gene_len, window_length
+        )
+
+    @classmethod
+    def keyed_words(cls, words, gene_len, start_idx, window_length=5):
+        # (key, Greek word) of (idx_1, idx_2, word) triples, keys are idx_1_idx_2_row with rows
+        # counted from 1 as in a BED file
+        for i, (idx_1, idx_2, word) in enumerate(words, 1):
+            yield str(idx_1) + "_" + str(idx_2) + "_" + str(i), cls.greek(
+                idx_1, idx_2, word, gene_len, start_idx, window_length
+            )
+
+    @classmethod
+    def write_words(cls, words, out_file):
+        with open(out_file, "w", encoding="utf-8") as fout:
+            for k, word in words:
+                fout.write(k + ": " + word + "\n")
+
+    @classmethod
+    def read_words(cls, words_in):
+        # (idx_1, idx_2, Greek word) of every line of a words file, one at a time
+        with open(words_in, "r", encoding="utf-8") as fin:
+            for line in fin:
+                key, word = line.split(":", 1)
+                idx_1, idx_2 = key.split("_")[:2]
+
+                yield int(idx_1), int(idx_2), word.strip()
+
+    @classmethod
+    def iter_words(
         cls,
         fasta_in,
         bed_in,
@@ -150,146 +222,52 @@ class GrammarWord:
         start_idx,
         end_idx,
         window_length=5,
-        out_file="output.txt",
+        out_file=None,
     ):
-        res = dict()
+        # (idx_1, idx_2, word) of every R-loop of the BED file or .npy candidate index, the
+        # words are also written to out_file with their Greek letters as they are consumed when
+        # it is given; json_in is a dictionary JSON file or a loaded GrammarDictionary
         with open(fasta_in, "r") as fin:
             fin.readline()
             gene_seq = fin.readline().strip().upper()
 
         gene_seq = gene_seq[start_idx:end_idx]
 
-        word_dict = dict()
+        grammar_dict = grammar_dictionary.GrammarDictionary.read(json_in)
+        rloops = candidate_index.CandidateIndex.read(bed_in)
 
-        with open(json_in, "r") as fin:
-            grammar_dict = json.load(fin)
+        words = cls.iter_rloop_words(
+            gene_seq, rloops, grammar_dict, start_idx, window_length
+        )
+
+        if not out_file:
+            yield from words
+            return
 
         with open(out_file, "w", encoding="utf-8") as fout:
-            with open(bed_in, "r") as fin:
-                line = fin.readline()
-
-                i = 1  # We keep track of the row we are reading in the BED file
-                while line:
-                    parts = line.strip().split("\t")
-                    idx_1 = int(parts[1])
-                    idx_2 = int(parts[2])
-
-                    r1, r2, r3 = cls.__get_regions(
-                        gene_seq, idx_1 - start_idx, idx_2 - start_idx
-                    )
-                    r1_rev = r1[::-1]
-                    r2_rev = r2[::-1]
-                    r3_rev = r3[::-1]
-
-                    res_r1 = [
-                        r1[i : i + window_length]
-                        for i in range(0, len(r1), window_length)
-                    ]
-                    res_r1_rev = [
-                        r1_rev[i : i + window_length][::-1]
-                        for i in range(0, len(r1), window_length)
-                    ]
-                    res_r2 = [
-                        r2[i : i + window_length]
-                        for i in range(0, len(r2), window_length)
-                    ]
-                    res_r2_rev = [
-                        r2_rev[i : i + window_length][::-1]
-                        for i in range(0, len(r2), window_length)
-                    ]
-                    res_r3 = [
-                        r3[i : i + window_length]
-                        for i in range(0, len(r3), window_length)
-                    ]
-                    res_r3_rev = [
-                        r3_rev[i : i + window_length][::-1]
-                        for i in range(0, len(r3), window_length)
-                    ]
-
-                    k = str(idx_1) + "_" + str(idx_2) + "_" + str(i)
-
-                    if not word_dict.get(k, None):
-                        word_dict[k] = {
-                            "r1_funny_letters": list(),
-                            "r2_funny_letters": list(),
-                            "r3_funny_letters": list(),
-                        }
-
-                    last_val = None
-                    for val in res_r1:
-                        last_val = val
-
-                        if len(val) != window_length:
-                            funny_letter = cls.__omega + str(len(val))
-                        else:
-                            funny_letter = cls.__gamma
-
-                            for letter, v in grammar_dict.get(
-                                "region1", dict()
-                            ).items():
-                                if val in v:
-                                    funny_letter = cls.ASCII_TO_GREEK.get(letter, "?")
-                                    break
-
-                        word_dict[k]["r1_funny_letters"].append(funny_letter)
-
-                    if last_val and len(last_val) == window_length:
-                        word_dict[k]["r1_funny_letters"][-1] = (
-                            word_dict[k]["r1_funny_letters"][-1] + cls.__omega + "0"
-                        )
-
-                    for val in res_r2_rev:
-                        if len(val) != window_length:
-                            funny_letter = "?" + str(len(val))
-                        else:
-                            funny_letter = cls.__rho
-
-                            for letter, v in grammar_dict.get(
-                                "region2_3", dict()
-                            ).items():
-                                if val in v:
-                                    funny_letter = cls.ASCII_TO_GREEK.get(letter, "?")
-                                    break
-
-                        word_dict[k]["r2_funny_letters"].append(funny_letter)
-
-                    last_val = None
-                    for val in res_r3_rev:
-                        last_val = val
-
-                        if len(val) != window_length:
-                            funny_letter = cls.__alpha + str(len(val))
-                        else:
-                            funny_letter = cls.__gamma
-
-                            for letter, v in grammar_dict.get(
-                                "region4", dict()
-                            ).items():
-                                if val in v:
-                                    funny_letter = cls.ASCII_TO_GREEK.get(letter, "?")
-                                    break
-
-                        word_dict[k]["r3_funny_letters"].append(funny_letter)
-
-                    if last_val and len(last_val) == window_length:
-                        word_dict[k]["r3_funny_letters"][-1] = (
-                            cls.__alpha + "0" + word_dict[k]["r3_funny_letters"][-1]
-                        )
-
-                    v = word_dict[k]
-                    write_line = (
-                        k
-                        + ": "
-                        + "".join(v["r1_funny_letters"])
-                        + "".join(reversed(v["r2_funny_letters"]))
-                        + "".join(reversed(v["r3_funny_letters"]))
-                    )
-
-                    fout.write(write_line + "\n")
-                    del word_dict[k]
-
-                    line = fin.readline()
-                    i += 1
+            for i, (idx_1, idx_2, word) in enumerate(words, 1):
+                greek = cls.greek(
+                    idx_1, idx_2, word, len(gene_seq), start_idx, window_length
+                )
+
+                fout.write(f"{idx_1}_{idx_2}_{i}: {greek}\n")
+                yield idx_1, idx_2, word
+
+    @classmethod
+    def extract_word(
+        cls,
+        fasta_in,
+        bed_in,
+        json_in,
+        start_idx,
+        end_idx,
+        window_length=5,
+        out_file="output.txt",
+    ):
+        for _ in cls.iter_words(
+            fasta_in, bed_in, json_in, start_idx, end_idx, window_length, out_file
+        ):
+            pass
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import argparse
 import numpy as np
-import xlsxwriter
 import json
 
+import rloopgrammar.model.candidate_index as candidate_index
+
 """
 Script to find probability of a base being in an R-loop based on an input probabilistic language. Probabilities are plotted with alpha on the left and omega on the right.
 
@@ -33,7 +34,7 @@ class Loop_probabilities:
             metavar="BED_FILE",
             type=str,
             required=True,
-            help="BED file which input file is based on",
+            help="BED file or NPY candidate index which input file is based on",
             default=None,
         )
         parser.add_argument(
@@ -89,6 +90,14 @@ class Loop_probabilities:
             required=True,
             help="N-Tuple size",
         )
+        parser.add_argument(
+            "-m",
+            "--mode",
+            choices=["difference", "dense"],
+            required=False,
+            help="Accumulate R-loops with a difference array or one dense vector per R-loop",
+            default="difference",
+        )
         return parser.parse_args()
 
     @classmethod
@@ -102,11 +111,10 @@ class Loop_probabilities:
         probabs_in,
         width,
         output_file="output",
+        mode="difference",
     ):
-        with open(bed_in, "r", encoding="utf-8") as file:
-            bed_all_rloops = [
-                list(map(int, line.split("\t")[1:3])) for line in file.readlines()
-            ]
+        # A BED file or a .npy candidate index
+        bed_all_rloops = candidate_index.CandidateIndex.read(bed_in)
 
         with open(probabs_in, "r") as file:
             lines = file.readlines()
@@ -117,6 +125,21 @@ class Loop_probabilities:
             prb = line.strip()
             probs.append(float(prb))
 
+        if mode == "dense":
+            summary, json_dict = cls.__dense_summary(
+                bed_all_rloops.tolist(), probs, seq_len
+            )
+        elif mode == "difference":
+            summary, json_dict = cls.difference_summary(bed_all_rloops, probs, seq_len)
+        else:
+            raise Exception(f"Unsupported mode: {mode}")
+
+        return cls.write_base_in_loop(
+            summary, json_dict, plot_start, plot_end, output_file
+        )
+
+    @classmethod
+    def __dense_summary(cls, bed_all_rloops, probs, seq_len):
         def convert_coords(s, e):
             initial = seq_len - e
             final = seq_len - s
@@ -160,6 +183,94 @@ class Loop_probabilities:
             "expected_end": expected_end
         }
 
+        return summary, json_dict
+
+    @classmethod
+    def difference_partial(cls, bed_all_rloops, probs, seq_len):
+        # An R-loop (x, y) covers [seq_len - y, seq_len - x), so it adds p at its first
+        # index and -p after its last one; the moments are the sums of the length, start
+        # and end of the R-loops weighted by p
+        rloops = np.array(bed_all_rloops, dtype=np.int64).reshape(-1, 2)
+        probs = np.array(probs, dtype=np.float64)
+
+        initial = seq_len - rloops[:, 0]
+        final = seq_len - rloops[:, 1]
+
+        first = np.clip(final, 0, seq_len)
+        last = np.clip(initial, 0, seq_len)
+        covering = first < last
+
+        difference = np.bincount(
+            first[covering], weights=probs[covering], minlength=seq_len + 1
+        ) - np.bincount(last[covering], weights=probs[covering], minlength=seq_len + 1)
+
+        moments = np.array(
+            [
+                np.dot(np.abs(final - initial), probs),
+                np.dot(initial, probs),
+                np.dot(final, probs),
+            ]
+        )
+
+        return difference, moments
+
+    @classmethod
+    def summary_from_partial(cls, difference, moments, seq_len):
+        # A cumulative sum of the difference array gives every base at once
+        summary = np.cumsum(difference[:seq_len])
+
+        json_dict = {
+            "expected_length": float(moments[0]),
+            "expected_start": float(moments[1]),
+            "expected_end": float(moments[2]),
+        }
+
+        return summary, json_dict
+
+    @classmethod
+    def difference_blocks(cls, bed_all_rloops, probs, seq_len, bounds):
+        # Difference arrays and moments of the blocks of R-loops between consecutive bounds,
+        # one row per block
+        differences = np.zeros((len(bounds) - 1, seq_len + 1))
+        moments = np.zeros((len(bounds) - 1, 3))
+
+        for k, (a, b) in enumerate(zip(bounds, bounds[1:])):
+            differences[k], moments[k] = cls.difference_partial(
+                bed_all_rloops[a:b], probs[a:b], seq_len
+            )
+
+        return differences, moments
+
+    @classmethod
+    def add_blocks(cls, difference, moments, differences, block_moments):
+        # Adds the rows of blocks to the sums in place, one block after the other, so the
+        # rounding does not depend on how the blocks were grouped
+        for block_difference, block_moment in zip(differences, block_moments):
+            difference += block_difference
+            moments += block_moment
+
+    @classmethod
+    def difference_summary(cls, bed_all_rloops, probs, seq_len):
+        # Summed in the blocks of candidate_index, as the shards of sharded_prediction are
+        difference = np.zeros(seq_len + 1)
+        moments = np.zeros(3)
+
+        cls.add_blocks(
+            difference,
+            moments,
+            *cls.difference_blocks(
+                bed_all_rloops,
+                probs,
+                seq_len,
+                candidate_index.CandidateIndex.blocks(len(probs)),
+            ),
+        )
+
+        return cls.summary_from_partial(difference, moments, seq_len)
+
+    @classmethod
+    def write_base_in_loop(cls, summary, json_dict, plot_start, plot_end, output_file):
+        # The plotted probabilities and the stats are returned, for the ensemble summary
         with open(f"{output_file}_stats.json", "w") as outfile:
             outfile.write(json.dumps(json_dict))
 
@@ -168,6 +279,8 @@ class Loop_probabilities:
             summary[plot_start:plot_end].tolist(),
         ]
 
+        import xlsxwriter
+
         headings = ["Base position", "Probability"]
         workbook = xlsxwriter.Workbook(output_file + ".XLSX")
         worksheet = workbook.add_worksheet()
@@ -195,6 +308,8 @@ class Loop_probabilities:
         worksheet.insert_chart("D2", chart1, {"x_offset": 25, "y_offset": 10})
         workbook.close()
 
+        return summary[plot_start:plot_end], json_dict
+
 
 if __name__ == "__main__":
     args = vars(Loop_probabilities.get_args())
@@ -208,4 +323,5 @@ if __name__ == "__main__":
         args.get("input_probabilities", None),
         args["width"],
         args.get("output_file", "output"),
+        args.get("mode", "difference"),
     )
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import collections
+import functools
+
+"""
+Occurrence index of the k-mers of one or more sequences.
+
+
+Counts overlapping occurrences, as a regex lookahead would, summed over the sequences with an
+optional weight per sequence. The table of a length k is built on its first lookup with one pass
+over the sequences, after which every count is a dictionary lookup.
+
+"""
+
+
+class KmerIndex:
+    def __init__(self, sequences, weights=None):
+        self.sequences = list(sequences)
+        self.weights = [1] * len(self.sequences) if weights is None else list(weights)
+        self.tables = dict()
+
+    @classmethod
+    @functools.lru_cache(maxsize=16)
+    def for_gene(cls, seq, start_idx, end_idx):
+        # Shared by every run and padding that works on the same gene
+        return cls([seq[start_idx:end_idx]])
+
+    def table(self, k):
+        if k not in self.tables:
+            table = collections.Counter()
+
+            for seq, weight in zip(self.sequences, self.weights):
+                for i in range(len(seq) - k + 1):
+                    table[seq[i : i + k]] += weight
+
+            self.tables[k] = table
+
+        return self.tables[k]
+
+    def count(self, kmer):
+        return self.table(len(kmer)).get(kmer, 0)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+import logging
+
+import rloopgrammar.instrumentation as instrumentation
+import rloopgrammar.model.grammar_dict as grammar_dict
+import rloopgrammar.model.grammar_dictionary as grammar_dictionary
+import rloopgrammar.model.grammar_training as grammar_training
+import rloopgrammar.model.grammar_word as grammar_word
+import rloopgrammar.model.regions_extractor as regions_extractor
+import rloopgrammar.model.regions_threshold as regions_threshold
+import rloopgrammar.model.weight_table as weight_table
+
+"""
+In-memory model build pipeline.
+
+
+Every stage hands its result to the next one as Python objects: weight tables are lists of rows,
+the dictionary is a GrammarDictionary and the training words are (key, word) pairs. Files are
+only written for the requested level of artifacts:
+
+    none: the model only, i.e. the dictionary JSON, the transition counts JSON and the
+          probabilities JSON
+    json: also the training set words and the weight tables (.npz columns, see WeightTable)
+    xlsx: also the weight tables and the dictionary as XLSX workbooks, and the parsing blocks
+          of the dictionary in long format (one line per block of every R-loop)
+
+The seed and the training set BED file are written by the build scripts at every level, and
+the window aligned BED file once per collection.
+
+The probabilities are computed from the transition counts of the training words, which are
+sufficient statistics of the model: summing the counts of models that share a dictionary gives
+the counts of the model trained on all their training sets (see GrammarTraining.merge_counts).
+The counts also keep how often every transition reads every w-mer, which does not depend on the
+dictionary, so the counts of the same training words under another dictionary, e.g. the one of
+a union, are computed without the sequence or the training set (see
+GrammarTraining.project_counts).
+
+Given a StageCache, the weights, thresholded weights, dictionary, training words and
+transition counts are looked up by their inputs before being computed. Given StageMetrics,
+every stage records its time, memory, inputs and output bytes (see instrumentation).
+
+"""
+
+ARTIFACTS = ("none", "json", "xlsx")
+
+
+class ModelPipeline:
+    @classmethod
+    def read_sequence(cls, fasta_in):
+        with open(fasta_in, "r") as fin:
+            fin.readline()
+            return fin.readline().strip().upper()
+
+    @classmethod
+    def write_bed_extra(cls, bed_in, window_length, out_file):
+        with open(bed_in, "r") as fin:
+            lines = regions_extractor.RegionsExtractor.extra_lines(
+                fin.readlines(), window_length
+            )
+
+        with open(out_file, "w") as fout:
+            fout.writelines(lines)
+
+    @classmethod
+    def read_bed_extra(cls, bed_in, window_length, bed_extra_in=None):
+        # Window aligned BED lines, from the collection file when there is one
+        if bed_extra_in:
+            with open(bed_extra_in, "r") as fin:
+                return fin.readlines()
+
+        with open(bed_in, "r") as fin:
+            return regions_extractor.RegionsExtractor.extra_lines(
+                fin.readlines(), window_length
+            )
+
+    @classmethod
+    def __cached(cls, cache, stage, inputs, compute):
+        return cache.stage(stage, inputs, compute) if cache else compute()
+
+    @classmethod
+    def build(
+        cls,
+        seq,
+        lines,
+        start_idx,
+        end_idx,
+        window_length,
+        padding,
+        artifacts="xlsx",
+        weight_xlsx=None,
+        weight_shannon_xlsx=None,
+        dict_xlsx=None,
+        dict_json=None,
+        dict_blocks=None,
+        words_out=None,
+        probabilities_out=None,
+        cache=None,
+        counts_out=None,
+        weight_npz=None,
+        weight_shannon_npz=None,
+        metrics=None,
+    ):
+        # Model of the R-loops in the BED lines, lines already have their adjusted first index
+        if artifacts not in ARTIFACTS:
+            raise AssertionError(f"Unsupported artifacts: {artifacts}")
+
+        logger = logging.getLogger("r-loop_grammar")
+        write_xlsx = artifacts == "xlsx"
+        write_text = artifacts in ("json", "xlsx")
+
+        with instrumentation.stage(
+            metrics,
+            "weights",
+            [
+                weight_npz if write_text else None,
+                weight_xlsx if write_xlsx else None,
+            ],
+            rloops=len(lines),
+        ):
+            weights = cls.__cached(
+                cache,
+                "weights",
+                (seq, lines, start_idx, end_idx, window_length, padding),
+                lambda: regions_extractor.RegionsExtractor.weights(
+                    seq,
+                    lines,
+                    start_idx,
+                    end_idx,
+                    window_length=window_length,
+                    num_regions=4,
+                    padding=padding,
+                ),
+            )
+
+            if write_text and weight_npz:
+                weight_table.WeightTable.write(weights, weight_npz)
+
+            if write_xlsx and weight_xlsx:
+                regions_extractor.RegionsExtractor.write_weights(weights, weight_xlsx)
+
+        logger.info("Thresholding critical regions.")
+
+        with instrumentation.stage(
+            metrics,
+            "weights_shannon",
+            [
+                weight_shannon_npz if write_text else None,
+                weight_shannon_xlsx if write_xlsx else None,
+            ],
+            windows=sum(len(rows) for rows in weights.values()),
+        ):
+            weights_shannon = cls.__cached(
+                cache,
+                "weights_shannon",
+                (weights,),
+                lambda: regions_threshold.RegionsThreshold.threshold(
+                    weights, True  # Shannon Entropy
+                ),
+            )
+
+            if write_text and weight_shannon_npz:
+                weight_table.WeightTable.write(weights_shannon, weight_shannon_npz)
+
+            if write_xlsx and weight_shannon_xlsx:
+                regions_extractor.RegionsExtractor.write_weights(
+                    weights_shannon, weight_shannon_xlsx
+                )
+
+        logger.info("Creating dictionary.")
+
+        gene_seq = seq[start_idx:end_idx]
+
+        with instrumentation.stage(
+            metrics,
+            "dictionary",
+            [
+                dict_json,
+                dict_xlsx if write_xlsx else None,
+                dict_blocks if write_xlsx else None,
+            ],
+            rloops=len(lines),
+        ) as inputs:
+            model_dict = grammar_dictionary.GrammarDictionary(
+                cls.__dictionary(
+                    gene_seq,
+                    lines,
+                    start_idx,
+                    end_idx,
+                    window_length,
+                    weights,
+                    weights_shannon,
+                    dict_xlsx if write_xlsx else None,
+                    cache,
+                    dict_blocks if write_xlsx else None,
+                )
+            )
+            inputs["dictionary_size"] = model_dict.size()
+
+            if dict_json:
+                model_dict.dump(dict_json)
+
+        _, probabilities = cls.train(
+            gene_seq,
+            lines,
+            model_dict,
+            start_idx,
+            window_length,
+            words_out if write_text else None,
+            probabilities_out,
+            cache,
+            counts_out,
+            metrics,
+        )
+
+        return model_dict, probabilities
+
+    @classmethod
+    def __dictionary(
+        cls,
+        gene_seq,
+        lines,
+        start_idx,
+        end_idx,
+        window_length,
+        weights,
+        weights_shannon,
+        dict_xlsx=None,
+        cache=None,
+        dict_blocks=None,
+    ):
+        # The XLSX workbook and the blocks file are cached along with the dictionary, they are only
+        # built from the rows computed on the way
+        def build():
+            return grammar_dict.GrammarDict.build(
+                gene_seq,
+                lines,
+                start_idx,
+                end_idx,
+                window_length,
+                weights,
+                weights_shannon,
+                dict_xlsx,
+                dict_blocks,
+            )
+
+        if not cache:
+            return build()
+
+        key = cache.key(
+            "dictionary",
+            gene_seq,
+            lines,
+            start_idx,
+            end_idx,
+            window_length,
+            weights,
+            weights_shannon,
+        )
+        hit, entry = cache.get(key)
+        files = {"xlsx": dict_xlsx, "blocks": dict_blocks}
+
+        if hit and all(
+            not out_file or entry.get(name) is not None
+            for name, out_file in files.items()
+        ):
+            for name, out_file in files.items():
+                if out_file:
+                    with open(out_file, "wb") as fout:
+                        fout.write(entry[name])
+
+            return entry["dictionary"]
+
+        entry = {"dictionary": build(), "xlsx": None, "blocks": None}
+
+        for name, out_file in files.items():
+            if out_file:
+                with open(out_file, "rb") as fin:
+                    entry[name] = fin.read()
+
+        cache.put(key, entry)
+
+        return entry["dictionary"]
+
+    @classmethod
+    def train(
+        cls,
+        gene_seq,
+        lines,
+        model_dict,
+        start_idx,
+        window_length,
+        words_out=None,
+        probabilities_out=None,
+        cache=None,
+        counts_out=None,
+        metrics=None,
+    ):
+        # Transition counts and probabilities of the words of the R-loops in the BED lines under
+        # the dictionary, the counts carry the digest of the dictionary they were counted under
+        logger = logging.getLogger("r-loop_grammar")
+        logger.info("Extracting training set words.")
+
+        with instrumentation.stage(
+            metrics,
+            "words",
+            [words_out],
+            rloops=len(lines),
+            dictionary_size=model_dict.size(),
+        ):
+            words = cls.__cached(
+                cache,
+                "words",
+                (gene_seq, lines, model_dict.digest(), start_idx, window_length),
+                lambda: grammar_word.GrammarWord.words(
+                    gene_seq, lines, model_dict, start_idx, window_length
+                ),
+            )
+
+            if words_out:
+                grammar_word.GrammarWord.write_words(
+                    grammar_word.GrammarWord.keyed_words(
+                        words, len(gene_seq), start_idx, window_length
+                    ),
+                    words_out,
+                )
+
+        logger.info("Finding probabilities.")
+
+        training_words = [word for _, _, word in words]
+
+        with instrumentation.stage(
+            metrics,
+            "training",
+            [counts_out, probabilities_out],
+            words=len(training_words),
+        ):
+            counts = cls.__cached(
+                cache,
+                "counts",
+                (gene_seq, lines, model_dict.digest(), start_idx, window_length),
+                lambda: dict(
+                    dictionary=model_dict.digest(),
+                    **grammar_training.GrammarTraining.counts(
+                        training_words, window_length
+                    ),
+                    kmer_transition_counts=grammar_training.GrammarTraining.kmer_counts(
+                        grammar_word.GrammarWord.transition_kmers(
+                            gene_seq, lines, model_dict, start_idx, window_length
+                        )
+                    ),
+                ),
+            )
+
+            if counts_out:
+                grammar_training.GrammarTraining.write_counts(counts, counts_out)
+
+            probabilities = grammar_training.GrammarTraining.probabilities_from_counts(
+                counts
+            )
+
+            if probabilities_out:
+                grammar_training.GrammarTraining.write_probabilities(
+                    probabilities, probabilities_out
+                )
+
+        return counts, probabilities
@@ -3,8 +3,16 @@
 import argparse
 import json
 import enum
+import math
+import os
 import gmpy2
 
+import numpy as np
+
+import rloopgrammar.model.candidate_index as candidate_index
+import rloopgrammar.model.grammar_word as grammar_word
+import rloopgrammar.model.symbol_codes as symbol_codes
+
 """
 Script to train a grammar based on a set of  words for R-loops.
 
@@ -73,22 +81,9 @@ def translate_greek(language_greek, width):
     return language
 
 
-def probability(probabilities, word):
-    product = 1
-
-    up_to_alpha_part = up_to_alpha(word)
-    S_to_S_transitions = up_to_alpha_part[:-2]
-    S_to_R_transitions = up_to_alpha_part[-2:]
+def transition_probability_maps(probabilities):
     S_probabilities = probabilities["S_probabilities"]
-
-    after_alpha_to_omega_part = after_alpha_to_omega(word)
-    R_to_R_transitions = after_alpha_to_omega_part[:-2]
-    R_to_Q_transitions = after_alpha_to_omega_part[-2:]
     R_probabilities = probabilities["R_probabilities"]
-
-    after_omega_part = after_omega(word)
-    Q_to_Q_transitions = after_omega_part[:-1]
-    Q_to_end_transitions = after_omega_part[-1:]
     Q_probabilities = probabilities["Q_probabilities"]
 
     S_to_S_symbol_probability_map = {
@@ -133,6 +128,40 @@ def probability(probabilities, word):
         GrammarSymbol.DELTA: Q_probabilities["Q_delta_end"],
     }
 
+    return (
+        S_to_S_symbol_probability_map,
+        S_to_R_symbol_probability_map,
+        R_to_R_symbol_probability_map,
+        R_to_Q_symbol_probability_map,
+        Q_to_Q_symbol_probability_map,
+        Q_to_end_symbol_probability_map,
+    )
+
+
+def probability(probabilities, word):
+    product = 1
+
+    up_to_alpha_part = up_to_alpha(word)
+    S_to_S_transitions = up_to_alpha_part[:-2]
+    S_to_R_transitions = up_to_alpha_part[-2:]
+
+    after_alpha_to_omega_part = after_alpha_to_omega(word)
+    R_to_R_transitions = after_alpha_to_omega_part[:-2]
+    R_to_Q_transitions = after_alpha_to_omega_part[-2:]
+
+    after_omega_part = after_omega(word)
+    Q_to_Q_transitions = after_omega_part[:-1]
+    Q_to_end_transitions = after_omega_part[-1:]
+
+    (
+        S_to_S_symbol_probability_map,
+        S_to_R_symbol_probability_map,
+        R_to_R_symbol_probability_map,
+        R_to_Q_symbol_probability_map,
+        Q_to_Q_symbol_probability_map,
+        Q_to_end_symbol_probability_map,
+    ) = transition_probability_maps(probabilities)
+
     for transition in S_to_S_transitions:
         product *= S_to_S_symbol_probability_map[transition]
 
@@ -151,6 +180,272 @@ def probability(probabilities, word):
     return product
 
 
+# Grammar symbols of the codes of an encoded word (see symbol_codes), ALPHA and OMEGA split it
+# into its S, R and Q parts
+SYMBOL_CODES = (
+    GrammarSymbol.SIGMA,
+    GrammarSymbol.SIGMA_HAT,
+    GrammarSymbol.GAMMA,
+    GrammarSymbol.DELTA,
+    GrammarSymbol.TAU,
+    GrammarSymbol.TAU_HAT,
+    GrammarSymbol.RHO,
+    GrammarSymbol.BETA,
+)
+ALPHA_CODE = symbol_codes.ALPHA_CODE
+OMEGA_CODE = symbol_codes.OMEGA_CODE
+INVALID_CODE = symbol_codes.INVALID_CODE
+
+# Transitions in the order of transition_probability_maps
+TRANSITIONS = ("S_to_S", "S_to_R", "R_to_R", "R_to_Q", "Q_to_Q", "Q_to_end")
+
+# Words are scored by blocks of this many words to bound the size of the count matrix
+BATCH_WORDS = 1 << 16
+
+
+GREEK_CODES = symbol_codes.GREEK_CODES
+
+
+def transition_weights(probabilities):
+    # weights[t * len(SYMBOL_CODES) + code] is the probability of transition t reading code
+    weights = [None] * (len(TRANSITIONS) * len(SYMBOL_CODES))
+
+    for t, symbol_probability_map in enumerate(transition_probability_maps(probabilities)):
+        for symbol, value in symbol_probability_map.items():
+            weights[t * len(SYMBOL_CODES) + SYMBOL_CODES.index(symbol)] = value
+
+    return weights
+
+
+class WordBatch:
+    """
+    Words of a language as one ragged uint8 array.
+
+    symbols[offsets[i] : offsets[i + 1]] are the codes of word i, in the order read by
+    probability(), and alpha[i], omega[i] are the positions of its ALPHA and OMEGA codes.
+    The probability of a word is the product over its S, R and Q transitions of the transition
+    probabilities raised to the number of times the word reads them, so a whole batch is scored
+    from a matrix of symbol counts per transition.
+    """
+
+    def __init__(self, symbols, offsets, strict=True):
+        # Words that are not strict may have empty S, R or Q parts, as training allows
+        self.symbols = symbols
+        self.offsets = offsets
+
+        word_ids = self.__word_ids()
+
+        alpha = np.flatnonzero(symbols == ALPHA_CODE)
+        omega = np.flatnonzero(symbols == OMEGA_CODE)
+
+        if not np.array_equal(word_ids[alpha], np.arange(len(self))):
+            raise AssertionError("Every word must have exactly one alpha")
+        if not np.array_equal(word_ids[omega], np.arange(len(self))):
+            raise AssertionError("Every word must have exactly one omega")
+
+        self.alpha = alpha
+        self.omega = omega
+
+        if np.any(self.omega < self.alpha):
+            raise AssertionError("Word has omega before alpha")
+
+        if not strict:
+            return
+
+        if np.any(self.alpha == self.offsets[:-1]):
+            raise AssertionError("Word has no S-symbol before alpha")
+        if np.any(self.omega <= self.alpha + 1):
+            raise AssertionError("Word has no R-symbol between alpha and omega")
+        if np.any(self.offsets[1:] <= self.omega + 1):
+            raise AssertionError("Word has no Q-symbol after omega")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def scorable(self):
+        # Mask of the words with S, R and Q symbols, the ones the grammar can score
+        return (
+            (self.alpha > self.offsets[:-1])
+            & (self.omega > self.alpha + 1)
+            & (self.offsets[1:] > self.omega + 1)
+        )
+
+    def select(self, keep):
+        # Batch of the words of the mask keep, in the same order
+        lengths = np.diff(self.offsets)
+        offsets = np.zeros(np.count_nonzero(keep) + 1, dtype=np.int64)
+        np.cumsum(lengths[keep], out=offsets[1:])
+
+        return WordBatch(
+            self.symbols[np.repeat(keep, lengths)], offsets, strict=True
+        )
+
+    def __word_ids(self, first=0, last=None):
+        last = len(self) if last is None else last
+        lengths = np.diff(self.offsets[first : last + 1])
+
+        return np.repeat(np.arange(first, last), lengths)
+
+    @classmethod
+    def __from_codes(cls, codes, word_ids, n, reverse, strict=True):
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(word_ids, minlength=n), out=offsets[1:])
+
+        if reverse:
+            reversed_codes = np.empty_like(codes)
+            reversed_codes[
+                offsets[word_ids] + offsets[word_ids + 1] - 1 - np.arange(len(codes))
+            ] = codes
+            codes = reversed_codes
+
+        return cls(codes, offsets, strict)
+
+    @classmethod
+    def from_codes(cls, words, strict=True):
+        # Encoded words as returned by SymbolTrack.encoded
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in words], out=offsets[1:])
+
+        return cls(np.frombuffer(b"".join(words), dtype=np.uint8), offsets, strict)
+
+    @classmethod
+    def from_greek(cls, language_greek, strict=True):
+        # Words as written by GrammarWord, read in reverse as translate_greek does
+        text = "".join(language_greek).encode("utf-32-le")
+        chars = np.frombuffer(text, dtype=np.uint32)
+        word_ids = np.repeat(
+            np.arange(len(language_greek)), [len(word) for word in language_greek]
+        )
+
+        codes = GREEK_CODES[np.minimum(chars, len(GREEK_CODES) - 1)]
+
+        # σ^ and τ^ are the codes following σ and τ
+        hats = np.flatnonzero(chars == ord("^"))
+        hatted = codes[hats - 1]
+        codes[hats - 1] = np.where(
+            (hatted == symbol_codes.LETTER_CODES["SIGMA"])
+            | (hatted == symbol_codes.LETTER_CODES["TAU"]),
+            hatted + 1,
+            INVALID_CODE,
+        )
+
+        # The digit following alpha or omega is the length of a short block
+        digits = (chars >= ord("0")) & (chars <= ord("9"))
+        markers = np.concatenate(
+            ([False], (codes[:-1] == ALPHA_CODE) | (codes[:-1] == OMEGA_CODE))
+        )
+
+        keep = np.ones(len(chars), dtype=bool)
+        keep[hats] = False
+        keep[digits & markers] = False
+
+        return cls.__from_codes(
+            codes[keep], word_ids[keep], len(language_greek), True, strict
+        )
+
+    @classmethod
+    def batches(cls, words, strict=True):
+        # Batches of BATCH_WORDS words of an iterable of encoded or Greek words
+        batch = []
+
+        for word in words:
+            batch.append(word)
+
+            if len(batch) == BATCH_WORDS:
+                yield cls.__from_language(batch, strict)
+                batch = []
+
+        if batch:
+            yield cls.__from_language(batch, strict)
+
+    @classmethod
+    def __from_language(cls, words, strict):
+        if isinstance(words[0], bytes):
+            return cls.from_codes(words, strict)
+
+        return cls.from_greek(words, strict)
+
+    def transition_counts(self, first=0, last=None, strict=True):
+        # counts[i, t * len(SYMBOL_CODES) + code] is how often word first + i reads code in transition t,
+        # symbols outside the grammar are an error in strict mode and are not counted otherwise
+        last = len(self) if last is None else last
+        start, end = self.offsets[first], self.offsets[last]
+
+        word_ids = self.__word_ids(first, last)
+        codes = self.symbols[start:end].astype(np.int64)
+        positions = np.arange(start, end)
+
+        from_alpha = positions - self.alpha[word_ids]
+        from_omega = positions - self.omega[word_ids]
+        from_end = positions - self.offsets[word_ids + 1]
+
+        transitions = np.select(
+            [
+                from_alpha < -1,
+                from_alpha == -1,
+                (from_alpha > 0) & (from_omega < -1),
+                from_omega == -1,
+                (from_omega > 0) & (from_end < -1),
+                from_end == -1,
+            ],
+            np.arange(len(TRANSITIONS)),
+            -1,
+        )
+
+        read = transitions >= 0
+        if not strict:
+            read &= codes < len(SYMBOL_CODES)
+        elif np.any(codes[read] >= len(SYMBOL_CODES)):
+            raise AssertionError("Word has a symbol outside the grammar")
+
+        bins = (
+            (word_ids[read] - first) * len(TRANSITIONS) + transitions[read]
+        ) * len(SYMBOL_CODES) + codes[read]
+
+        return np.bincount(
+            bins, minlength=(last - first) * len(TRANSITIONS) * len(SYMBOL_CODES)
+        ).reshape(last - first, len(TRANSITIONS) * len(SYMBOL_CODES))
+
+    def __batches(self, weights):
+        missing = np.array([w is None for w in weights])
+
+        for first in range(0, len(self), BATCH_WORDS):
+            counts = self.transition_counts(first, min(first + BATCH_WORDS, len(self)))
+
+            if np.any(counts[:, missing]):
+                raise AssertionError("Word reads a symbol its transition has no probability for")
+
+            yield counts
+
+    def log_scores(self, probabilities):
+        weights = transition_weights(probabilities)
+        log_weights = np.array(
+            [0.0 if w is None else math.log(float(w)) for w in weights]
+        )
+
+        # A sum per row rather than a matrix product, whose rounding depends on the shape of
+        # the batch, so a word has the same score in any batch
+        return np.concatenate(
+            [(counts * log_weights).sum(axis=1) for counts in self.__batches(weights)]
+            or [np.empty(0)]
+        )
+
+    def exact_scores(self, probabilities):
+        weights = transition_weights(probabilities)
+        scores = []
+
+        for counts in self.__batches(weights):
+            for row in counts:
+                product = 1
+
+                for k in np.flatnonzero(row).tolist():
+                    product *= weights[k] ** int(row[k])
+
+                scores.append(product)
+
+        return scores
+
+
 class Probabilistic_Language:
     @classmethod
     def get_args(cls):
@@ -190,26 +485,44 @@ class Probabilistic_Language:
             required=True,
             help="N-Tuple size",
         )
+        parser.add_argument(
+            "-n",
+            "--numeric",
+            choices=["exact", "log"],
+            required=False,
+            help="Score words with exact rationals or with float64 log-probabilities",
+            default="exact",
+        )
+        parser.add_argument(
+            "--validate",
+            required=False,
+            action="store_true",
+            help="Print the max relative deviation of the log mode from the exact mode",
+        )
         return parser.parse_args()
 
     @classmethod
-    def word_probabilities(cls, words_in, probabs_in, width, out_file="output"):
-        with open(probabs_in, "r", encoding="utf-8") as file_handle:
-            probabilities = json.load(file_handle, object_hook=from_gmpy)
-
-        with open(words_in, "r", encoding="utf-8") as file:
-            lines = file.readlines()
+    def __read_language(cls, words_in, strict=True):
+        # Batches of the words of a words file or of (idx_1, idx_2, word) triples such as
+        # GrammarWord.iter_words yields, so the words are never all held at once
+        if isinstance(words_in, (str, os.PathLike)):
+            words_in = grammar_word.GrammarWord.read_words(words_in)
 
-        language_greek = []
+        return WordBatch.batches((word for _, _, word in words_in), strict)
 
-        for line in lines:
-            parsing = line.split(":")[1].strip()
-            language_greek.append(parsing)
-
-        language = translate_greek(language_greek, width)
-
-        probabilities = [probability(probabilities, word) for word in language]
+    @classmethod
+    def __exact_probabilities(cls, probabilities, languages):
+        return cls.normalize_exact(
+            [
+                score
+                for language in languages
+                for score in language.exact_scores(probabilities)
+            ]
+        )
 
+    @classmethod
+    def normalize_exact(cls, probabilities):
+        # Probabilities of the words of exact scores, in the order of the scores
         """
         filtered_probabilities = list(filter(lambda x: x > 0, probabilities))
 
@@ -224,8 +537,112 @@ class Probabilistic_Language:
         print("#probabilities:", len(probabilities))
         print("The partition function is: ", partition_function)
 
-        probs = [float(term / partition_function) for term in probabilities]
+        return [float(term / partition_function) for term in probabilities]
 
+    @classmethod
+    def __log_probabilities(cls, probabilities, languages):
+        return cls.normalize_log(
+            np.concatenate(
+                [language.log_scores(probabilities) for language in languages]
+                or [np.empty(0)]
+            )
+        )
+
+    @classmethod
+    def block_log_sums(cls, log_probabilities, bounds):
+        # Max of the log scores of every block between consecutive bounds and sum of their
+        # exps shifted by it
+        sums = []
+
+        for a, b in zip(bounds, bounds[1:]):
+            block = np.asarray(log_probabilities[a:b], dtype=np.float64)
+            shift = float(np.max(block))
+            sums.append((shift, float(np.sum(np.exp(block - shift)))))
+
+        return sums
+
+    @classmethod
+    def log_partition_function(cls, block_sums):
+        # Log partition function from the sums of the blocks, added in block order
+        assert block_sums, "Partition function is 0"
+
+        shift = max(block_shift for block_shift, _ in block_sums)
+        total = 0.0
+
+        for block_shift, scaled in block_sums:
+            total += scaled * math.exp(block_shift - shift)
+
+        log_partition_function = shift + math.log(total) if total > 0 else -math.inf
+        assert math.isfinite(log_partition_function), "Partition function is 0"
+
+        return log_partition_function
+
+    @classmethod
+    def normalize_log(cls, log_probabilities):
+        # Probabilities of the words of log scores, in the order of the scores; the partition
+        # function is summed in the blocks of candidate_index, as the shards of
+        # sharded_prediction sum it
+        log_partition_function = cls.log_partition_function(
+            cls.block_log_sums(
+                log_probabilities,
+                candidate_index.CandidateIndex.blocks(len(log_probabilities)),
+            )
+        )
+
+        print("#probabilities:", len(log_probabilities))
+        print("The log partition function is: ", log_partition_function)
+
+        return np.exp(log_probabilities - log_partition_function).tolist()
+
+    @classmethod
+    def numeric_deviation(cls, words_in, probabs_in, width):
+        # Max relative deviation of the log mode from the exact mode on the words in words_in
+        # and the number of words it was checked on. Training words are read as training
+        # reads them, and the ones without S, R or Q symbols, of R-loops within a window of
+        # the gene ends, are left out as the grammar cannot score them
+        with open(probabs_in, "r", encoding="utf-8") as file_handle:
+            probabilities = json.load(file_handle, object_hook=from_gmpy)
+
+        languages = [
+            language.select(language.scorable())
+            for language in cls.__read_language(words_in, strict=False)
+        ]
+        languages = [language for language in languages if len(language)]
+
+        if not languages:
+            raise AssertionError("No word can be scored")
+
+        exact = cls.__exact_probabilities(probabilities, languages)
+        log = cls.__log_probabilities(probabilities, languages)
+
+        deviation = max(
+            (abs(l - e) / e if e > 0 else abs(l) for e, l in zip(exact, log)),
+            default=0.0,
+        )
+
+        return deviation, len(exact)
+
+    @classmethod
+    def word_probabilities(
+        cls, words_in, probabs_in, width, out_file="output", numeric="exact"
+    ):
+        # words_in is a words file or an iterable of (idx_1, idx_2, word) triples
+        with open(probabs_in, "r", encoding="utf-8") as file_handle:
+            probabilities = json.load(file_handle, object_hook=from_gmpy)
+
+        languages = cls.__read_language(words_in)
+
+        if numeric == "exact":
+            probs = cls.__exact_probabilities(probabilities, languages)
+        elif numeric == "log":
+            probs = cls.__log_probabilities(probabilities, languages)
+        else:
+            raise Exception(f"Unsupported numeric mode: {numeric}")
+
+        cls.write_probabilities(probs, out_file)
+
+    @classmethod
+    def write_probabilities(cls, probs, out_file):
         with open(out_file, "a") as file_handle:
             for i in probs:
                 file_handle.write(str(i) + "\n")
@@ -233,9 +650,19 @@ class Probabilistic_Language:
 
 if __name__ == "__main__":
     args = vars(Probabilistic_Language.get_args())
-    Probabilistic_Language.word_probabilities(
-        args.get("input_words", None),
-        args.get("input_probabilities", None),
-        args["width"],
-        args.get("output_file", "output"),
-    )
+
+    if args.get("validate", False):
+        deviation, words = Probabilistic_Language.numeric_deviation(
+            args.get("input_words", None),
+            args.get("input_probabilities", None),
+            args["width"],
+        )
+        print(f"Max relative deviation on {words} words:", deviation)
+    else:
+        Probabilistic_Language.word_probabilities(
+            args.get("input_words", None),
+            args.get("input_probabilities", None),
+            args["width"],
+            args.get("output_file", "output"),
+            args.get("numeric", "exact"),
+        )
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 import argparse
-import re
 
-from openpyxl import Workbook, load_workbook
+import numpy as np
+
+import rloopgrammar.model.kmer_index as kmer_index
+import rloopgrammar.model.weight_table as weight_table
 
 """
 Script to extract strings around two given indexes of a sequence.
@@ -34,6 +36,12 @@ class RegionsExtractor:
         # return x[1].get('count', 0)
         return x[1].get('weight', 0)
 
+    @classmethod
+    def __cell_number(cls, value):
+        # Number as read back from an XLSX file, which stores it with 16 significant digits
+        text = '%.16g' % value
+        return float(text) if '.' in text or 'e' in text else int(text)
+
     @classmethod
     def __get_regions(cls, seq, idx, window_length, max_padding=0):
         if max_padding < 0:
@@ -53,10 +61,10 @@ class RegionsExtractor:
         return r1, r2
 
     @classmethod
-    def __add_region_info(cls, regions, key_name, region, seq, start_idx, end_idx):
+    def __add_region_info(cls, regions, key_name, region, gene_kmers):
         if region not in regions[key_name].keys():
             item = {'count': 1,
-                    'gene': len(re.findall(r'(?=' + region + r')', seq[start_idx:end_idx]))
+                    'gene': gene_kmers.count(region)  # overlapping occurrences in the gene
                     }
             for i in ['A', 'C', 'G', 'T']:
                 item['count_' + i.lower()] = region.count(i)
@@ -99,79 +107,75 @@ class RegionsExtractor:
         return parser.parse_args()
 
     @classmethod
-    def extract_regions(cls, fasta_in, bed_in, start_idx, end_idx, window_length=5, out_pref='output',
-                        num_regions=4, padding=0, bed_extra=False, bed_extra_output=None, create_weights=True):
-        regions = {}
-        out_file = out_pref
+    def adjust_start(cls, idx_1, idx_2, window_length):
+        if idx_1 > idx_2:
+            raise AssertionError('First index must be less or equal to second index')
 
-        for i in range(num_regions):
-            regions['Region ' + str(i + 1)] = dict()
+        return int(cls.adjust_starts(np.array([idx_1]), np.array([idx_2]), window_length)[0])
 
-        with open(fasta_in, 'r') as fin:
-            fin.readline()
-            seq = fin.readline().strip().upper()
-
-        with open(bed_in, 'r') as fin:
-            line = fin.readline()
-            rloops_count = 0
+    @classmethod
+    def adjust_starts(cls, starts, ends, window_length):
+        # Nearest first index making the R-loop length a multiple of window_length, moving left
+        # on ties unless that goes below 0
+        short = (ends - starts) % window_length
+        left = starts - (window_length - short)
 
-            if bed_extra:
-                if not bed_extra_output:
-                    fout = open(bed_in + '_extra.bed', 'w')
-                else:
-                    fout = open(bed_extra_output, 'w')
+        return np.where((short > 0) & (window_length - short <= short) & (left >= 0), left, starts + short)
 
-            while line:
-                parts = line.strip().split('\t')
-                idx_1 = int(parts[1])
-                idx_2 = int(parts[2])
+    @classmethod
+    def extra_lines(cls, lines, window_length):
+        # BED lines with the first index moved so that every R-loop length is a multiple of window_length
+        rows = [line.strip().split('\t') for line in lines]
+        starts = np.array([int(parts[1]) for parts in rows], dtype=np.int64)
+        ends = np.array([int(parts[2]) for parts in rows], dtype=np.int64)
 
-                if idx_1 > idx_2:
-                    raise AssertionError('First index must be less or equal to second index')
+        if np.any(starts > ends):
+            raise AssertionError('First index must be less or equal to second index')
 
-                i = 0
-                while ((idx_2 - (idx_1 + i)) % window_length) != 0:  # modify first index in R-loop
-                    if i >= 0:
-                        i += 1
+        extra = list()
 
-                        if (idx_1 - i) < 0:
-                            continue
+        for parts, start in zip(rows, cls.adjust_starts(starts, ends, window_length).tolist()):
+            parts[1] = str(start)
+            extra.append('\t'.join(parts) + '\n')
 
-                    i *= -1
+        return extra
 
-                idx_1 += i
+    @classmethod
+    def weights(cls, seq, lines, start_idx, end_idx, window_length=5, num_regions=4, padding=0):
+        # Weight table of every region, rows are sorted by decreasing weight
+        regions = {}
 
-                if bed_extra:
-                    parts[1] = str(idx_1)
-                    fout.write('\t'.join(parts) + '\n')
+        for i in range(num_regions):
+            regions['Region ' + str(i + 1)] = dict()
 
-                regions_1, regions_2 = cls.__get_regions(seq, idx_1, window_length, padding)
-                regions_3, regions_4 = cls.__get_regions(seq, idx_2, window_length, padding)
+        rloops_count = 0
+        gene_kmers = kmer_index.KmerIndex.for_gene(seq, start_idx, end_idx)
 
-                if num_regions == 2:
-                    cls.__add_region_info(regions, 'Region 1', regions_1[0] + regions_2[0], seq, start_idx, end_idx)
-                    cls.__add_region_info(regions, 'Region 2', regions_3[0] + regions_4[0], seq, start_idx, end_idx)
-                else:
-                    for r in regions_1:
-                        cls.__add_region_info(regions, 'Region 1', r, seq, start_idx, end_idx)
+        for line in lines:
+            parts = line.strip().split('\t')
+            idx_2 = int(parts[2])
+            idx_1 = cls.adjust_start(int(parts[1]), idx_2, window_length)
 
-                    for r in regions_2:
-                        cls.__add_region_info(regions, 'Region 2', r, seq, start_idx, end_idx)
+            regions_1, regions_2 = cls.__get_regions(seq, idx_1, window_length, padding)
+            regions_3, regions_4 = cls.__get_regions(seq, idx_2, window_length, padding)
 
-                    for r in regions_3:
-                        cls.__add_region_info(regions, 'Region 3', r, seq, start_idx, end_idx)
+            if num_regions == 2:
+                cls.__add_region_info(regions, 'Region 1', regions_1[0] + regions_2[0], gene_kmers)
+                cls.__add_region_info(regions, 'Region 2', regions_3[0] + regions_4[0], gene_kmers)
+            else:
+                for r in regions_1:
+                    cls.__add_region_info(regions, 'Region 1', r, gene_kmers)
 
-                    for r in regions_4:
-                        cls.__add_region_info(regions, 'Region 4', r, seq, start_idx, end_idx)
+                for r in regions_2:
+                    cls.__add_region_info(regions, 'Region 2', r, gene_kmers)
 
-                rloops_count += 1
-                line = fin.readline()
+                for r in regions_3:
+                    cls.__add_region_info(regions, 'Region 3', r, gene_kmers)
 
-            if bed_extra:
-                fout.close()
+                for r in regions_4:
+                    cls.__add_region_info(regions, 'Region 4', r, gene_kmers)
 
-        if not create_weights:
-            return
+            rloops_count += 1
 
         for r in regions.values():
             for k, v in r.items():
@@ -182,11 +186,11 @@ class RegionsExtractor:
                 else:
                     v['weight'] = v.get('count', 0) / (v.get('gene', 0) * rloops_count)
 
-        wb = Workbook(write_only=True)
+        tables = dict()
 
         for k, v in regions.items():
             count_keys = [c for c in v.keys() if 'count' in c]  # count_A, count_C, count_G, count_T for Region 1,2,3,4
-            ws = wb.create_sheet(k)
+            tables[k] = list()
 
             # i is the key in the dict v
             sorted_items = [(i, j) for i, j in v.items() if i not in count_keys and '_' not in i]
@@ -195,35 +199,90 @@ class RegionsExtractor:
                 info = [wnd, wnd_info.get('count', 0)]
                 info.extend([wnd_info.get(i, 0) for i in count_keys])
                 info.append(wnd_info.get('gene', 0))
-                info.append(wnd_info.get('weight', 0))
-                ws.append(info)
+                info.append(cls.__cell_number(wnd_info.get('weight', 0)))
+                tables[k].append(info)
+
+        return tables
+
+    @classmethod
+    def read_weights(cls, xlsx_in):
+        # A .npz weight table is read as columns, any other file as an XLSX workbook
+        if str(xlsx_in).endswith('.npz'):
+            return weight_table.WeightTable.read(xlsx_in)
+
+        from openpyxl import load_workbook
+
+        wb = load_workbook(xlsx_in, read_only=True)
+        tables = {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+        wb.close()
+
+        return tables
+
+    @classmethod
+    def write_weights(cls, tables, out_file):
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+
+        for k, rows in tables.items():
+            ws = wb.create_sheet(k)
+
+            for row in rows:
+                ws.append(row)
 
             ws.close()
 
         wb.save(out_file)
 
+    @classmethod
+    def extract_regions(cls, fasta_in, bed_in, start_idx, end_idx, window_length=5, out_pref='output',
+                        num_regions=4, padding=0, bed_extra=False, bed_extra_output=None, create_weights=True):
+        out_file = out_pref
+
+        with open(fasta_in, 'r') as fin:
+            fin.readline()
+            seq = fin.readline().strip().upper()
+
+        with open(bed_in, 'r') as fin:
+            lines = fin.readlines()
+
+        if bed_extra:
+            with open(bed_extra_output if bed_extra_output else bed_in + '_extra.bed', 'w') as fout:
+                fout.writelines(cls.extra_lines(lines, window_length))
+
+        if not create_weights:
+            return
+
+        tables = cls.weights(seq, lines, start_idx, end_idx, window_length, num_regions, padding)
+        cls.write_weights(tables, out_file)
+
         return out_file
 
     @classmethod
-    def __get_counts(cls, wb, sub_word):
-        counts = [0] * len(wb.sheetnames)
+    def __get_counts(cls, wb):
+        # Per worksheet, occurrences of a sub word in the windows weighted by the window counts
+        counts = list()
 
-        for n, ws_name in enumerate(wb.sheetnames):
+        for ws_name in wb.sheetnames:
             ws = wb[ws_name]
+            windows = list()
+            window_counts = list()
 
-            for row in ws.iter_rows(min_row=5, max_col=1):
-                for cell in row:
-                    seq = str(cell.value)
-                    counts[n] += int(ws['B' + str(cell.row)].value) * len(re.findall(r'(?=' + sub_word + r')', seq))
-                    # counts[n-1] += int(ws['B' + str(cell.row)].value) * word.count(seq)
-                    # word.count(seq) counts with multiplicity
+            for row in ws.iter_rows(min_row=5, max_col=2, values_only=True):
+                windows.append(str(row[0]))
+                window_counts.append(int(row[1]))
+
+            counts.append(kmer_index.KmerIndex(windows, window_counts))
 
         return counts
 
     @classmethod
     def compare_windows(cls, in_file_small, in_file_large, threshold, window_large):
+        from openpyxl import load_workbook
+
         wb_small = load_workbook(in_file_small)
         wb_large = load_workbook(in_file_large, read_only=True)
+        large_counts = cls.__get_counts(wb_large)
 
         for ws_name in wb_small.sheetnames:
             ws = wb_small[ws_name]
@@ -244,7 +303,7 @@ class RegionsExtractor:
                     if not word or int(ws['B' + str(cell.row)].value) < threshold:
                         continue
 
-                    counts_region = cls.__get_counts(wb_large, word)
+                    counts_region = [c.count(word) for c in large_counts]
 
                     for i in range(len(counts_region)):
                         if i == 0:
@@ -3,8 +3,7 @@ import argparse
 import dataclasses
 import math
 
-import openpyxl
-from openpyxl import Workbook, load_workbook
+import rloopgrammar.model.regions_extractor as regions_extractor
 
 """
 Script to select most important tuples in each region.
@@ -32,40 +31,37 @@ along with RegionsThreshold.  If not, see <http://www.gnu.org/licenses/>.
 
 class RegionsThreshold:
     @classmethod
-    def __threshold_weight(cls, xlsx_in, out_file):
-        wb = openpyxl.load_workbook(xlsx_in, read_only=True)
-        wb_out = Workbook(write_only=True)
+    def __threshold_weight(cls, tables):
+        tables_out = dict()
 
-        for i, ws_name in enumerate(wb.sheetnames):
-            ws_out = wb_out.create_sheet(ws_name)
+        for ws_name, rows in tables.items():
+            ws_out = tables_out[ws_name] = list()
             prev_weight = -math.inf
 
-            for row in wb.worksheets[i].iter_rows(values_only=True):
+            for row in rows:
                 weight = float(row[len(row) - 1])
 
                 if weight >= 0.01 or abs(prev_weight - weight) <= 0.001:
                     ws_out.append(row)
                     prev_weight = weight
                 else:
-                    ws_out.close()
                     break
 
-        wb_out.save(out_file)
+        return tables_out
 
     @classmethod
-    def __threshold_shannon(cls, xlsx_in, out_file):
-        wb = openpyxl.load_workbook(xlsx_in, read_only=True)
-        wb_out = Workbook(write_only=True)
+    def __threshold_shannon(cls, tables):
+        tables_out = dict()
 
-        for i, ws_name in enumerate(wb.sheetnames):
+        for ws_name, rows in tables.items():
             count = 1
             entropy_sum = 0
             max_weight = 0
-            ws_out = wb_out.create_sheet(ws_name)
+            ws_out = tables_out[ws_name] = list()
             prev_average_entropy = -math.inf
             group_same_entropies: dict[float, list[str]] = {}
 
-            for row in wb.worksheets[i].iter_rows(values_only=True):
+            for row in rows:
                 weight = float(row[len(row) - 1])
                 if count == 1 or max_weight == 0:
                     max_weight = weight
@@ -107,12 +103,11 @@ class RegionsThreshold:
                     ws_out.append(new_row)
                     prev_average_entropy = average_entropy
                 else:
-                    ws_out.close()
                     break
 
                 count += 1
 
-        wb_out.save(out_file)
+        return tables_out
 
     @classmethod
     def get_args(cls):
@@ -145,11 +140,20 @@ class RegionsThreshold:
         return parser.parse_args()
 
     @classmethod
-    def extract_regions(cls, xlsx_in, out_file="output.xlsx", shannon_entropy=False):
+    def threshold(cls, tables, shannon_entropy=False):
+        # Rows of the weight tables of RegionsExtractor that are kept in every region
         if shannon_entropy:
-            cls.__threshold_shannon(xlsx_in, out_file)
+            return cls.__threshold_shannon(tables)
         else:
-            cls.__threshold_weight(xlsx_in, out_file)
+            return cls.__threshold_weight(tables)
+
+    @classmethod
+    def extract_regions(cls, xlsx_in, out_file="output.xlsx", shannon_entropy=False):
+        tables = regions_extractor.RegionsExtractor.read_weights(xlsx_in)
+
+        regions_extractor.RegionsExtractor.write_weights(
+            cls.threshold(tables, shannon_entropy), out_file
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+import argparse
+import functools
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+import rloopgrammar.model.candidate_index as candidate_index
+import rloopgrammar.model.grammar_word as grammar_word
+import rloopgrammar.model.probabilistic_language as probabilistic_language
+import rloopgrammar.model.symbol_track as symbol_track
+from rloopgrammar.model.in_loop_probs import Loop_probabilities
+
+"""
+Script to find probability of a base being in an R-loop by scoring the candidate R-loops in shards.
+
+The candidate R-loops are split into shards of whole blocks of consecutive candidates (see
+candidate_index), and every shard is scored once, in two passes. First it scores its words,
+keeps their scores in a file and returns its part of the partition function: their exact sum,
+or the max and the shifted sum of the exps of the log scores of each of its blocks. The parts
+of all shards give the partition function Z. Then, given Z, the shard reads its scores back,
+writes its word probabilities to a part of the _prob_lang.py file and returns the difference
+array and the expected start, end and length of each of its blocks. A ShardReducer adds the
+blocks of the shards of a run in block order, whatever order the shards arrive in. The serial
+path sums the same blocks in the same order, so the output is the same, to the bit, whatever
+the number of shards. --compare-serial runs both and checks it.
+
+"""
+
+# Runs whose track and probabilities a worker keeps, the shards of a run are queued together
+SHARD_INPUTS_CACHE_SIZE = 4
+
+
+@functools.lru_cache(maxsize=SHARD_INPUTS_CACHE_SIZE)
+def shard_inputs(fasta_in, json_in, probabs_in, start_idx, end_idx, width):
+    # Symbol track of the gene and transition probabilities of a run, read once per worker
+    # for all the shards of the run it scores
+    track = symbol_track.SymbolTrack.from_files(
+        fasta_in, json_in, start_idx, end_idx, width
+    )
+
+    with open(probabs_in, "r", encoding="utf-8") as file_handle:
+        probabilities = json.load(
+            file_handle, object_hook=probabilistic_language.from_gmpy
+        )
+
+    return track, probabilities
+
+
+class ShardReducer:
+    # Adds the blocks of the shards of one run in shard order as they arrive, appending
+    # their word probabilities to the _prob_lang.py file of the run in the same order
+    def __init__(self, shard_count, seq_len, prob_lang_file=None):
+        self.shard_count = shard_count
+        self.seq_len = seq_len
+        self.prob_lang_file = prob_lang_file
+        self.difference = np.zeros(seq_len + 1)
+        self.moments = np.zeros(3)
+        self.added = 0
+        self.pending = dict()
+
+    def add(self, index, partial):
+        self.pending[index] = partial
+
+        while self.added in self.pending:
+            partial = self.pending.pop(self.added)
+
+            if partial is not None:
+                Loop_probabilities.add_blocks(self.difference, self.moments, *partial)
+
+            if self.prob_lang_file is not None:
+                part_file = ShardedPrediction.part_file(self.prob_lang_file, self.added)
+
+                if os.path.exists(part_file):
+                    with open(part_file, "rb") as fin, open(
+                        self.prob_lang_file, "ab"
+                    ) as fout:
+                        shutil.copyfileobj(fin, fout)
+                    os.remove(part_file)
+
+            self.added += 1
+
+    def done(self):
+        return self.added == self.shard_count
+
+    def summary(self):
+        # Per-base probabilities and expected length, start and end of the run
+        if not self.done():
+            raise AssertionError(
+                f"Only {self.added} of {self.shard_count} shards were added"
+            )
+
+        return Loop_probabilities.summary_from_partial(
+            self.difference, self.moments, self.seq_len
+        )
+
+
+class ShardedPrediction:
+    @classmethod
+    def shards(cls, start_idx, end_idx, width, shard_count):
+        # Ranges [first, last) of candidates made of about the same number of whole blocks
+        bounds = candidate_index.CandidateIndex.blocks(
+            candidate_index.CandidateIndex.total(start_idx, end_idx, width)
+        )
+        blocks = len(bounds) - 1
+        cuts = sorted({blocks * k // max(shard_count, 1) for k in range(shard_count + 1)})
+
+        return [(bounds[a], bounds[b]) for a, b in zip(cuts, cuts[1:])]
+
+    @classmethod
+    def shard_blocks(cls, start_idx, end_idx, width, first, last):
+        # Bounds of the blocks of the shard [first, last), relative to first
+        return [
+            bound - first
+            for bound in candidate_index.CandidateIndex.blocks(
+                candidate_index.CandidateIndex.total(start_idx, end_idx, width)
+            )
+            if first <= bound <= last
+        ]
+
+    @classmethod
+    def part_file(cls, prob_lang_file, index):
+        return f"{prob_lang_file}.shard{index}"
+
+    @classmethod
+    def scores_file(cls, prob_lang_file, index):
+        return f"{prob_lang_file}.scores{index}"
+
+    @classmethod
+    def __shard_scores(
+        cls, fasta_in, json_in, probabs_in, start_idx, end_idx, width, first, last, numeric
+    ):
+        # Unnormalized scores of the candidates first <= n < last, in candidate order
+        track, probabilities = shard_inputs(
+            fasta_in, json_in, probabs_in, start_idx, end_idx, width
+        )
+
+        rloops = candidate_index.CandidateIndex.generate_range(
+            start_idx, end_idx, width, first, last
+        )
+
+        words = probabilistic_language.WordBatch.from_codes(
+            [track.encoded(x - start_idx, y - start_idx) for x, y in rloops.tolist()]
+        )
+
+        if numeric == "exact":
+            return words.exact_scores(probabilities)
+        elif numeric == "log":
+            return words.log_scores(probabilities)
+        else:
+            raise Exception(f"Unsupported numeric mode: {numeric}")
+
+    @classmethod
+    def partition_shard(
+        cls,
+        fasta_in,
+        json_in,
+        probabs_in,
+        start_idx,
+        end_idx,
+        width,
+        first,
+        last,
+        numeric="exact",
+        scores_file=None,
+    ):
+        # Part of the partition function of the candidates first <= n < last: their exact
+        # sum, or the max and the shifted sum of the exps of the log scores of every block;
+        # the scores are kept in scores_file for sum_shard
+        scores = cls.__shard_scores(
+            fasta_in, json_in, probabs_in, start_idx, end_idx, width, first, last, numeric
+        )
+
+        if scores_file is not None:
+            with open(scores_file, "wb") as fout:
+                pickle.dump(scores, fout, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if numeric == "exact":
+            return sum(scores)
+
+        return probabilistic_language.Probabilistic_Language.block_log_sums(
+            scores, cls.shard_blocks(start_idx, end_idx, width, first, last)
+        )
+
+    @classmethod
+    def partition_function(cls, partials, numeric="exact"):
+        # Partition function, or its log, from the parts of all shards, in shard order
+        if numeric == "exact":
+            partition_function = sum(partials)
+            assert partition_function > 0, "Partition function is 0"
+
+            print("The partition function is: ", partition_function)
+
+            return partition_function
+
+        log_partition_function = (
+            probabilistic_language.Probabilistic_Language.log_partition_function(
+                [block for partial in partials for block in partial]
+            )
+        )
+
+        print("The log partition function is: ", log_partition_function)
+
+        return log_partition_function
+
+    @classmethod
+    def sum_shard(
+        cls,
+        fasta_in,
+        json_in,
+        probabs_in,
+        start_idx,
+        end_idx,
+        seq_len,
+        width,
+        first,
+        last,
+        partition_function,
+        numeric="exact",
+        part_file=None,
+        scores_file=None,
+    ):
+        # Difference arrays and moments of the blocks of the candidates first <= n < last,
+        # normalized by the partition function of all shards; their word probabilities are
+        # written to part_file. The scores partition_shard kept in scores_file are read back,
+        # the words are only scored again without it
+        if scores_file is not None and os.path.exists(scores_file):
+            with open(scores_file, "rb") as fin:
+                scores = pickle.load(fin)
+            os.remove(scores_file)
+        else:
+            scores = cls.__shard_scores(
+                fasta_in,
+                json_in,
+                probabs_in,
+                start_idx,
+                end_idx,
+                width,
+                first,
+                last,
+                numeric,
+            )
+
+        if numeric == "exact":
+            probs = [float(score / partition_function) for score in scores]
+        else:
+            probs = np.exp(scores - partition_function).tolist()
+
+        if part_file is not None:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+
+            probabilistic_language.Probabilistic_Language.write_probabilities(
+                probs, part_file
+            )
+
+        return Loop_probabilities.difference_blocks(
+            candidate_index.CandidateIndex.generate_range(
+                start_idx, end_idx, width, first, last
+            ),
+            probs,
+            seq_len,
+            cls.shard_blocks(start_idx, end_idx, width, first, last),
+        )
+
+    @classmethod
+    def get_args(cls):
+        parser = argparse.ArgumentParser(description="Find in loop probabilities")
+        parser.add_argument(
+            "-f",
+            "--input-fasta",
+            metavar="FASTA_IN_FILE",
+            type=str,
+            required=True,
+            help="FASTA input file",
+            default=None,
+        )
+        parser.add_argument(
+            "-j",
+            "--input-json",
+            metavar="JSON_IN_FILE",
+            type=str,
+            required=True,
+            help="JSON dictionary input file",
+            default=None,
+        )
+        parser.add_argument(
+            "-p",
+            "--input_probabilities",
+            metavar="PROBABILITIES_IN_FILE",
+            type=str,
+            required=True,
+            help="Probabilities input file",
+            default=None,
+        )
+        parser.add_argument(
+            "-s",
+            "--start-index",
+            metavar="START_INDEX",
+            type=int,
+            required=True,
+            help="Start index of gene region",
+            default=0,
+        )
+        parser.add_argument(
+            "-e",
+            "--end-index",
+            metavar="END_INDEX",
+            type=int,
+            required=True,
+            help="End index of gene region",
+            default=0,
+        )
+        parser.add_argument(
+            "-l",
+            "--seq_length",
+            metavar="NUM_BASES",
+            type=int,
+            required=True,
+            help="Number of bases",
+            default=None,
+        )
+        parser.add_argument(
+            "-w",
+            "--width",
+            metavar="WIDTH",
+            type=int,
+            required=True,
+            help="N-Tuple size",
+        )
+        parser.add_argument(
+            "-n",
+            "--numeric",
+            choices=["exact", "log"],
+            required=False,
+            help="Score words with exact rationals or with float64 log-probabilities",
+            default="exact",
+        )
+        parser.add_argument(
+            "-k",
+            "--shards",
+            metavar="SHARDS",
+            type=int,
+            required=False,
+            help="Number of shards",
+            default=1,
+        )
+        parser.add_argument(
+            "-o",
+            "--output_file",
+            metavar="OUTPUT_FILE",
+            type=str,
+            required=False,
+            help="Output XLSX file",
+            default="output",
+        )
+        parser.add_argument(
+            "--compare-serial",
+            action="store_true",
+            help="Check that the sharded output matches the serial one instead",
+        )
+        return parser.parse_args()
+
+    @classmethod
+    def in_loop_probabilities(
+        cls,
+        fasta_in,
+        json_in,
+        probabs_in,
+        start_idx,
+        end_idx,
+        seq_len,
+        width,
+        output_file="output",
+        numeric="exact",
+        shard_count=1,
+        prob_lang_file=None,
+    ):
+        shards = cls.shards(start_idx, end_idx, width, shard_count)
+
+        with tempfile.TemporaryDirectory() as folder:
+            scores_files = [
+                os.path.join(folder, f"scores{index}") for index in range(len(shards))
+            ]
+
+            partition_function = cls.partition_function(
+                [
+                    cls.partition_shard(
+                        fasta_in,
+                        json_in,
+                        probabs_in,
+                        start_idx,
+                        end_idx,
+                        width,
+                        first,
+                        last,
+                        numeric,
+                        scores_file,
+                    )
+                    for (first, last), scores_file in zip(shards, scores_files)
+                ],
+                numeric,
+            )
+
+            reducer = ShardReducer(len(shards), seq_len, prob_lang_file)
+
+            for index, (first, last) in enumerate(shards):
+                reducer.add(
+                    index,
+                    cls.sum_shard(
+                        fasta_in,
+                        json_in,
+                        probabs_in,
+                        start_idx,
+                        end_idx,
+                        seq_len,
+                        width,
+                        first,
+                        last,
+                        partition_function,
+                        numeric,
+                        None
+                        if prob_lang_file is None
+                        else cls.part_file(prob_lang_file, index),
+                        scores_files[index],
+                    ),
+                )
+
+        summary, json_dict = reducer.summary()
+
+        return Loop_probabilities.write_base_in_loop(
+            summary, json_dict, start_idx, end_idx, output_file
+        )
+
+    @classmethod
+    def compare_serial(
+        cls,
+        fasta_in,
+        json_in,
+        probabs_in,
+        start_idx,
+        end_idx,
+        seq_len,
+        width,
+        numeric="exact",
+        shard_count=1,
+    ):
+        # Raises when the sharded output differs from the one of the serial path, to the bit
+        with tempfile.TemporaryDirectory() as folder:
+            index_file = os.path.join(folder, "all_rloops.npy")
+            candidate_index.CandidateIndex.write(
+                candidate_index.CandidateIndex.generate(start_idx, end_idx, width),
+                index_file,
+            )
+
+            outputs = dict()
+
+            for path in ("serial", "sharded"):
+                prob_lang_file = os.path.join(folder, f"{path}_prob_lang.py")
+
+                if path == "serial":
+                    probabilistic_language.Probabilistic_Language.word_probabilities(
+                        grammar_word.GrammarWord.iter_words(
+                            fasta_in, index_file, json_in, start_idx, end_idx, width
+                        ),
+                        probabs_in,
+                        width,
+                        prob_lang_file,
+                        numeric,
+                    )
+                    summary, json_dict = Loop_probabilities.in_loop_probabilities(
+                        None,
+                        index_file,
+                        seq_len,
+                        start_idx,
+                        end_idx,
+                        prob_lang_file,
+                        width,
+                        os.path.join(folder, path),
+                    )
+                else:
+                    summary, json_dict = cls.in_loop_probabilities(
+                        fasta_in,
+                        json_in,
+                        probabs_in,
+                        start_idx,
+                        end_idx,
+                        seq_len,
+                        width,
+                        os.path.join(folder, path),
+                        numeric,
+                        shard_count,
+                        prob_lang_file,
+                    )
+
+                with open(prob_lang_file, "r") as fin:
+                    outputs[path] = (summary.tobytes(), json_dict, fin.read())
+
+        for name, serial, sharded in zip(
+            ("in-loop probabilities", "stats", "word probabilities"),
+            outputs["serial"],
+            outputs["sharded"],
+        ):
+            if serial != sharded:
+                raise AssertionError(
+                    f"The {name} of {shard_count} shards differ from the serial ones"
+                )
+
+
+if __name__ == "__main__":
+    args = vars(ShardedPrediction.get_args())
+
+    if args.get("compare_serial", False):
+        ShardedPrediction.compare_serial(
+            args.get("input_fasta", None),
+            args.get("input_json", None),
+            args.get("input_probabilities", None),
+            args.get("start_index", 0),
+            args.get("end_index", 0),
+            args.get("seq_length", None),
+            args["width"],
+            args.get("numeric", "exact"),
+            args.get("shards", 1),
+        )
+        print("The sharded output matches the serial one")
+    else:
+        ShardedPrediction.in_loop_probabilities(
+            args.get("input_fasta", None),
+            args.get("input_json", None),
+            args.get("input_probabilities", None),
+            args.get("start_index", 0),
+            args.get("end_index", 0),
+            args.get("seq_length", None),
+            args["width"],
+            args.get("output_file", "output"),
+            args.get("numeric", "exact"),
+            args.get("shards", 1),
+        )
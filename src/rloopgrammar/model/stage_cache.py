@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+import tempfile
+
+"""
+Content-addressed on-disk cache of the model building stages.
+
+
+A stage result is stored under the SHA-256 of the stage name and of its inputs and parameters,
+so rebuilding a model from the same sequence, training set, window and padding (e.g. with
+--duplicate) reads the results back instead of recomputing them. Inputs are hashed by value:
+the key of a stage depends on the result of the previous one and not on the way it was obtained.
+
+Entries are pickle files. A hit refreshes the modification time of its entry, and when the
+cache grows past its size limit the least recently used entries are removed first.
+
+The directory defaults to $XDG_CACHE_HOME/rloopgrammar (or ~/.cache/rloopgrammar) and can be
+set with RLOOPGRAMMAR_CACHE_DIR, the size limit in bytes with RLOOPGRAMMAR_CACHE_SIZE.
+
+"""
+
+CACHE_DIRECTORY_VARIABLE = "RLOOPGRAMMAR_CACHE_DIR"
+CACHE_SIZE_VARIABLE = "RLOOPGRAMMAR_CACHE_SIZE"
+DEFAULT_CACHE_SIZE = 1 << 30
+
+# Bumped whenever a stage changes what it computes, which invalidates every older entry
+CACHE_VERSION = 2
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Recompute every stage instead of using the stage cache ({CACHE_DIRECTORY_VARIABLE}).",
+    )
+
+
+class StageCache:
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = pathlib.Path(
+            directory if directory is not None else self.default_directory()
+        )
+        self.max_bytes = (
+            int(max_bytes)
+            if max_bytes is not None
+            else int(os.environ.get(CACHE_SIZE_VARIABLE, DEFAULT_CACHE_SIZE))
+        )
+
+    @classmethod
+    def default_directory(cls):
+        if os.environ.get(CACHE_DIRECTORY_VARIABLE):
+            return pathlib.Path(os.environ[CACHE_DIRECTORY_VARIABLE])
+
+        cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+
+        return pathlib.Path(cache_home) / "rloopgrammar"
+
+    @classmethod
+    def from_arguments(cls, args):
+        # None when --no-cache was given
+        return None if getattr(args, "no_cache", False) else cls()
+
+    @classmethod
+    def key(cls, stage, *inputs):
+        digest = hashlib.sha256()
+        digest.update(f"{stage}\0{CACHE_VERSION}\0".encode("utf-8"))
+
+        for part in inputs:
+            # Canonical form: the keys of dicts are sorted, so inputs whose order matters, such
+            # as the symbols of a GrammarDictionary, are given in a form that keeps it (digest)
+            digest.update(
+                json.dumps(part, sort_keys=True, default=str, ensure_ascii=False).encode(
+                    "utf-8"
+                )
+            )
+            digest.update(b"\0")
+
+        return digest.hexdigest()
+
+    def __path(self, key):
+        return self.directory / key[:2] / f"{key}.pickle"
+
+    def get(self, key):
+        # (True, value) on a hit, (False, None) otherwise
+        path = self.__path(key)
+
+        try:
+            with open(path, "rb") as fin:
+                value = pickle.load(fin)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return True, value
+
+    def put(self, key, value):
+        path = self.__path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Written aside and renamed, so that concurrent runs never read a partial entry
+        fd, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+
+        with os.fdopen(fd, "wb") as fout:
+            pickle.dump(value, fout, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        entries = list()
+
+        for path in self.directory.glob("*/*.pickle"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+            total -= size
+
+    def stage(self, stage, inputs, compute):
+        # Result of compute() for these inputs, from the cache when it is there
+        key = self.key(stage, *inputs)
+        hit, value = self.get(key)
+
+        if not hit:
+            value = compute()
+            self.put(key, value)
+
+        return value
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import numpy as np
+
+"""
+Byte codes of the grammar symbols.
+
+
+Words are handled as bytes with one code per symbol, in the order the grammar reads them: the
+region after the R-loop (S), alpha, the R-loop (R), omega and the region before the R-loop (Q),
+i.e. the written word reversed. The lengths of the short blocks next to alpha and omega, which
+the written word carries as digits, are not part of the codes, they only depend on the R-loop
+coordinates and are put back when a word is rendered with its Greek letters for export.
+
+Codes 0 to 7 are the symbols of the dictionary letters, in the order of LETTERS, followed by
+ALPHA_CODE and OMEGA_CODE. A letter with no symbol (a window missing from the dictionary or the
+short block at the start of an R-loop that is not a multiple of the window) is INVALID_CODE.
+
+"""
+
+# Dictionary letters and Greek symbols of codes 0 to 7
+LETTERS = ("SIGMA", "SIGMA^", "GAMMA", "DELTA", "TAU", "TAU^", "RHO", "BETA")
+GREEK = ("σ", "σ^", "γ", "δ", "τ", "τ^", "ρ", "β")
+
+ALPHA = "α"
+OMEGA = "ω"
+
+ALPHA_CODE = len(LETTERS)
+OMEGA_CODE = ALPHA_CODE + 1
+INVALID_CODE = 255
+
+LETTER_CODES = {letter: code for code, letter in enumerate(LETTERS)}
+
+# Code of every character of a Greek word, the hats of σ^ and τ^ and the digits are not mapped
+GREEK_CODES = np.full(0x400, INVALID_CODE, dtype=np.uint8)
+for code, greek in enumerate(GREEK):
+    if len(greek) == 1:
+        GREEK_CODES[ord(greek)] = code
+GREEK_CODES[ord(ALPHA)] = ALPHA_CODE
+GREEK_CODES[ord(OMEGA)] = OMEGA_CODE
+
+
+class SymbolCodes:
+    @classmethod
+    def encode_letters(cls, letters):
+        # Codes of dictionary letters as bytes
+        return bytes(LETTER_CODES.get(letter, INVALID_CODE) for letter in letters)
+
+    @classmethod
+    def greek(cls, codes):
+        # Greek symbols of the codes, alpha and omega without the length of their short block
+        symbols = GREEK + (ALPHA, OMEGA)
+
+        return [symbols[code] if code < len(symbols) else "?" for code in codes]
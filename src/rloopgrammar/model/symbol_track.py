@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import rloopgrammar.model.grammar_dictionary as grammar_dictionary
+import rloopgrammar.model.symbol_codes as symbol_codes
+
+"""
+Symbol tracks of a gene for a grammar dictionary.
+
+
+For a fixed dictionary and gene, the grammar symbol of the w-mer starting at a given position
+only depends on the position and on the region the w-mer is read in. A track stores these
+symbols once for every region and every frame (position mod w), so the word of an R-loop is a
+concatenation of track slices and the alpha/omega letters at its boundaries. The same slices of
+the tracks of byte codes give the encoded word (see symbol_codes), which is what the grammar
+reads, the Greek word is only rendered for export.
+
+"""
+
+
+class SymbolTrack:
+    __alpha = "\u03B1"
+    __beta = "\u03B2"
+    __gamma = "\u03B3"
+    __delta = "\u03B4"
+    __rho = "\u03C1"
+    __rho_hat = __rho + "^"
+    __sigma = "\u03C3"
+    __sigma_hat = __sigma + "^"
+    __tau = "\u03C4"
+    __tau_hat = __tau + "^"
+    __omega = "\u03C9"
+
+    GREEK_TO_ASCII = {
+        __alpha: "ALPHA",
+        __beta: "BETA",
+        __gamma: "GAMMA",
+        __delta: "DELTA",
+        __rho: "RHO",
+        __rho_hat: "RHO^",
+        __sigma: "SIGMA",
+        __sigma_hat: "SIGMA^",
+        __tau: "TAU",
+        __tau_hat: "TAU^",
+        __omega: "OMEGA",
+    }
+
+    ASCII_TO_GREEK = {v: k for k, v in GREEK_TO_ASCII.items()}
+
+    def __init__(self, gene_seq, grammar_dict, window_length):
+        self.gene_seq = gene_seq
+        self.window_length = window_length
+
+        # letters[region][p] is the dictionary letter of gene_seq[p : p + w]
+        self.letters = dict()
+        # frames[region][phase][j] is the Greek symbol of the w-mer at phase + j * w
+        self.frames = dict()
+        # code_frames[region][phase][j] is the code of the same symbol
+        self.code_frames = dict()
+        # Positions of the same w-mers, built on the first call to transition_kmers
+        self.position_frames = None
+
+        for region in grammar_dict.REGIONS:
+            letters = grammar_dict.letters(region, gene_seq, window_length)
+            greek = [self.ASCII_TO_GREEK.get(letter, "?") for letter in letters]
+
+            self.letters[region] = letters
+            self.frames[region] = [greek[phase::window_length] for phase in range(window_length)]
+
+            codes = symbol_codes.SymbolCodes.encode_letters(letters)
+            self.code_frames[region] = [
+                codes[phase::window_length] for phase in range(window_length)
+            ]
+
+    @classmethod
+    def from_files(cls, fasta_in, json_in, start_idx, end_idx, window_length):
+        # json_in is a dictionary JSON file or a loaded GrammarDictionary
+        with open(fasta_in, "r") as fin:
+            fin.readline()
+            gene_seq = fin.readline().strip().upper()
+
+        grammar_dict = grammar_dictionary.GrammarDictionary.read(json_in)
+
+        return cls(gene_seq[start_idx:end_idx], grammar_dict, window_length)
+
+    def __blocks(self, region, start, end, frames=None):
+        # Symbols of the full blocks in [start, end), blocks being aligned to start
+        frames = self.frames if frames is None else frames
+        count = (end - start) // self.window_length
+        frame = frames[region][start % self.window_length]
+        first = start // self.window_length
+
+        return frame[first : first + count]
+
+    @classmethod
+    def __bounds(cls, gene_len, bed_start, bed_end):
+        if bed_start > bed_end:
+            raise AssertionError("Start index must be lower or equal than end index")
+        if gene_len < bed_end:
+            raise AssertionError("End index too large")
+
+        # Coordinates are normalized as in gene_seq[:start], gene_seq[start:end], gene_seq[end:]
+        start = slice(bed_start).indices(gene_len)[1]
+        end = slice(bed_end).indices(gene_len)[1]
+
+        return start, end, max(start, end)
+
+    def word(self, bed_start, bed_end):
+        if not self.gene_seq:
+            raise AssertionError("Specify a gene sequence")
+
+        gene_len = len(self.gene_seq)
+        w = self.window_length
+        start, end, r2_end = self.__bounds(gene_len, bed_start, bed_end)
+
+        # Region before the R-loop: blocks aligned to the gene start, omega next to the R-loop
+        r1 = self.__blocks("region1", 0, start - start % w)
+
+        if start % w:
+            r1.append(self.__omega + str(start % w))
+        elif r1:
+            r1[-1] = r1[-1] + self.__omega + "0"
+
+        # R-loop: blocks aligned to its end
+        r2_short = (r2_end - start) % w
+        r2 = self.__blocks("region2_3", start + r2_short, r2_end)
+
+        if r2_short:
+            r2.insert(0, "?" + str(r2_short))
+
+        # Region after the R-loop: blocks aligned to the gene end, alpha next to the R-loop
+        r3_short = (gene_len - end) % w
+        r3 = self.__blocks("region4", end + r3_short, gene_len)
+
+        if r3_short:
+            r3.insert(0, self.__alpha + str(r3_short))
+        elif r3:
+            r3[0] = self.__alpha + "0" + r3[0]
+
+        return "".join(r1) + "".join(r2) + "".join(r3)
+
+    def encoded(self, bed_start, bed_end):
+        # Codes of word(bed_start, bed_end) in reading order, i.e. reversed
+        if not self.gene_seq:
+            raise AssertionError("Specify a gene sequence")
+
+        gene_len = len(self.gene_seq)
+        w = self.window_length
+        start, end, r2_end = self.__bounds(gene_len, bed_start, bed_end)
+
+        r1 = self.__blocks("region1", 0, start - start % w, self.code_frames)
+        r2_short = (r2_end - start) % w
+        r2 = self.__blocks("region2_3", start + r2_short, r2_end, self.code_frames)
+        r3_short = (gene_len - end) % w
+        r3 = self.__blocks("region4", end + r3_short, gene_len, self.code_frames)
+
+        alpha = bytes((symbol_codes.ALPHA_CODE,)) if r3_short or r3 else b""
+        short = bytes((symbol_codes.INVALID_CODE,)) if r2_short else b""
+        omega = bytes((symbol_codes.OMEGA_CODE,)) if start % w or r1 else b""
+
+        return r3[::-1] + alpha + r2[::-1] + short + omega + r1[::-1]
+
+    def transition_kmers(self, bed_start, bed_end):
+        # (transition, w-mer) of every symbol of encoded(bed_start, bed_end) that is read from
+        # a w-mer, transitions numbered as in probabilistic_language.TRANSITIONS. The symbol
+        # of a w-mer only depends on the dictionary and the region it is read in, so these are
+        # the training statistics of the word under any dictionary
+        if not self.gene_seq:
+            raise AssertionError("Specify a gene sequence")
+
+        gene_len = len(self.gene_seq)
+        w = self.window_length
+        start, end, r2_end = self.__bounds(gene_len, bed_start, bed_end)
+
+        if self.position_frames is None:
+            positions = [list(range(phase, gene_len - w + 1, w)) for phase in range(w)]
+            self.position_frames = {region: positions for region in self.code_frames}
+
+        frames = self.position_frames
+
+        r1 = self.__blocks("region1", 0, start - start % w, frames)
+        r2_short = (r2_end - start) % w
+        r2 = self.__blocks("region2_3", start + r2_short, r2_end, frames)
+        r3_short = (gene_len - end) % w
+        r3 = self.__blocks("region4", end + r3_short, gene_len, frames)
+
+        # The last symbol of S is read by S -> R, the last of R by R -> Q unless it is the
+        # short block, and the last of Q by Q -> end
+        transitions = (
+            [0] * (len(r3) - 1) + [1] * bool(r3)
+            + [2] * (len(r2) - (not r2_short)) + [3] * (bool(r2) and not r2_short)
+            + [4] * (len(r1) - 1) + [5] * bool(r1)
+        )
+        kmers = [
+            self.gene_seq[p : p + w] for p in r3[::-1] + r2[::-1] + r1[::-1]
+        ]
+
+        return list(zip(transitions, kmers))
+
+    @classmethod
+    def greek(cls, codes, bed_start, bed_end, gene_len, window_length):
+        # word(bed_start, bed_end) of the codes returned by encoded(bed_start, bed_end)
+        w = window_length
+        start, end, r2_end = cls.__bounds(gene_len, bed_start, bed_end)
+        symbols = symbol_codes.SymbolCodes.greek(codes[::-1])
+
+        r1_short = start % w
+        r2_short = (r2_end - start) % w
+        r3_short = (gene_len - end) % w
+
+        # Lengths of the written parts, with their alpha, omega and short block letters
+        r1_len = start // w + bool(r1_short or start // w)
+        r2_len = (r2_end - start) // w + bool(r2_short)
+
+        r1 = symbols[:r1_len]
+        r2 = symbols[r1_len : r1_len + r2_len]
+        r3 = symbols[r1_len + r2_len :]
+
+        if r1:
+            r1[-1] = r1[-1] + str(r1_short)
+        if r2_short:
+            r2[0] = r2[0] + str(r2_short)
+        if r3:
+            r3[0] = r3[0] + str(r3_short)
+
+        return "".join(r1) + "".join(r2) + "".join(r3)
@@ -37,13 +37,17 @@ class TrainingSet:
                             help='Output BED file', default='training_set.bed')
         return parser.parse_args()
 
+    @classmethod
+    def sample(cls, lines, num=10):
+        return [i for i in random.sample(lines, num if num <= len(lines) else len(lines))]
+
     @classmethod
     def training_set(cls, bed_in, num=10, out_file='training_set.bed'):
         with open(bed_in, 'r') as fin:
             lines = fin.readlines()
 
         with open(out_file, 'w') as fout:
-            fout.writelines([i for i in random.sample(lines, num if num <= len(lines) else len(lines))])
+            fout.writelines(cls.sample(lines, num))
 
 
 if __name__ == '__main__':
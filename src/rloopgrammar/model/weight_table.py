@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import argparse
+
+import numpy as np
+
+"""
+Weight tables of the regions stored as columns in a compressed .npz file.
+
+
+A weight table maps every region (the worksheet title of the XLSX workbook, e.g. "Region 1") to
+its rows: the window, its count, its counts of A, C, G and T, its occurrences in the gene and
+its weight, followed by the entropy columns in thresholded tables. Each column is stored as one
+array, windows as ASCII strings, columns of integers as int64 and any other column as float64,
+along with the length of every row, so that reading the file back gives the rows that were
+written. Reading a table is one np.load instead of parsing a workbook, and the weights of a
+region come back as a dictionary without building the rows.
+
+"""
+
+WEIGHT_COLUMN = 7
+
+
+class WeightTable:
+    @classmethod
+    def write(cls, tables, out_file):
+        arrays = {"regions": np.array(list(tables.keys()), dtype=str)}
+
+        for n, rows in enumerate(tables.values()):
+            lengths = np.array([len(row) for row in rows], dtype=np.int64)
+            width = int(lengths.max()) if len(rows) else 0
+
+            arrays[f"{n}_lengths"] = lengths
+            arrays[f"{n}_windows"] = np.array(
+                [str(row[0]) for row in rows], dtype=np.bytes_
+            )
+
+            for j in range(1, width):
+                column = [row[j] if j < len(row) else 0 for row in rows]
+                integers = all(
+                    isinstance(value, (int, np.integer))
+                    and not isinstance(value, bool)
+                    for value in column
+                )
+
+                arrays[f"{n}_{j}"] = np.array(
+                    column, dtype=np.int64 if integers else np.float64
+                )
+
+        np.savez_compressed(out_file, **arrays)
+
+    @classmethod
+    def read(cls, table_in):
+        # Region -> rows, as RegionsExtractor.read_weights reads them from a workbook
+        tables = dict()
+
+        with np.load(table_in) as data:
+            for n, region in enumerate(data["regions"].tolist()):
+                lengths = data[f"{n}_lengths"].tolist()
+                columns = [data[f"{n}_windows"].astype(str).tolist()]
+                j = 1
+
+                while f"{n}_{j}" in data:
+                    columns.append(data[f"{n}_{j}"].tolist())
+                    j += 1
+
+                tables[region] = [
+                    tuple(column[i] for column in columns[:length])
+                    for i, length in enumerate(lengths)
+                ]
+
+        return tables
+
+    @classmethod
+    def weights(cls, table_in):
+        # Region -> {window: weight}, without building the rows
+        weights = dict()
+
+        with np.load(table_in) as data:
+            for n, region in enumerate(data["regions"].tolist()):
+                windows = data[f"{n}_windows"].astype(str).tolist()
+                column = f"{n}_{WEIGHT_COLUMN}"
+                values = data[column].tolist() if column in data else []
+
+                weights[region] = dict(zip(windows, values))
+
+        return weights
+
+    @classmethod
+    def get_args(cls):
+        parser = argparse.ArgumentParser(
+            description="Convert weight tables between XLSX and NPZ"
+        )
+        parser.add_argument(
+            "-i",
+            "--input-file",
+            metavar="INPUT_FILE",
+            type=str,
+            required=True,
+            help="XLSX or NPZ input file",
+        )
+        parser.add_argument(
+            "-o",
+            "--output-file",
+            metavar="OUTPUT_FILE",
+            type=str,
+            required=True,
+            help="NPZ or XLSX output file, depending on its extension",
+        )
+        return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import rloopgrammar.model.regions_extractor as regions_extractor
+
+    args = vars(WeightTable.get_args())
+    tables = regions_extractor.RegionsExtractor.read_weights(args["input_file"])
+
+    if args["output_file"].endswith(".npz"):
+        WeightTable.write(tables, args["output_file"])
+    else:
+        regions_extractor.RegionsExtractor.write_weights(tables, args["output_file"])
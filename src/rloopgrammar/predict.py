@@ -1,4 +1,3 @@
-import multiprocessing
 import sys
 import os
 import pathlib
@@ -9,11 +8,16 @@ import argparse
 
 from typing import *
 
-NUMBER_OF_PROCESSES = 10
-
+import rloopgrammar.execution as execution
+import rloopgrammar.instrumentation as instrumentation
+import rloopgrammar.model.candidate_index as candidate_index
+import rloopgrammar.model.grammar_dictionary as grammar_dictionary
 import rloopgrammar.model.grammar_word as grammar_word
 import rloopgrammar.model.probabilistic_language as probabilistic_language
 import rloopgrammar.model.in_loop_probs as in_loop_probs
+import rloopgrammar.model.dynamic_prediction as dynamic_prediction
+import rloopgrammar.model.sharded_prediction as sharded_prediction
+import rloopgrammar.model.ensemble_summary as ensemble_summary
 
 from rloopgrammar.config_reader import read_plasmids
 from rloopgrammar.config_reader import Plasmid
@@ -21,6 +25,9 @@ from rloopgrammar.config_reader import Plasmid
 CONFIG_MODEL_PARAMETER_NAME = "Model Parameters"
 CONFIG_PREDICT_PARAMETER_NAME = "Predict Parameters"
 
+# Profiles of the partition function pass of --shards, apart from the ones of the sum pass
+PARTITION_PROFILE_FOLDER_NAME = "partition_function"
+
 PROGRAM_NAME = pathlib.Path(sys.argv[0]).parts[-1][:-4]
 DESCRIPTION = "Form a prediction for a given collection of R-loop grammar models."
 
@@ -50,15 +57,42 @@ class PredictionParameters:
     plasmid: Plasmid
     window_length: int
     padding_length: int
+    engine: str = "enumerate"
+    numeric: str = "exact"
+    write_words: bool = False
+
+
+def prediction_run_folder(pp: PredictionParameters) -> pathlib.Path:
+    return pp.prediction_collection_folder / str(pp.model_folder.parts[-1]).replace(
+        "Model", "Prediction"
+    )
+
+
+def model_file(model_folder: pathlib.Path, name: str) -> str:
+    model_files = next(os.walk(model_folder))[2]
 
+    return str(model_folder / list(filter(lambda x: name in x, model_files))[0])
 
-def do_prediction(pp: PredictionParameters) -> None:
+
+def prediction_metrics(pp: PredictionParameters) -> instrumentation.StageMetrics:
+    return instrumentation.StageMetrics(
+        pp.prediction_collection_folder / instrumentation.METRICS_FILE_NAME,
+        tool="predict",
+        run=prediction_run_folder(pp).name,
+        plasmid=pp.plasmid.name,
+        window_length=pp.window_length,
+        padding=pp.padding_length,
+        engine=pp.engine,
+        numeric=pp.numeric,
+    )
+
+
+def do_prediction(pp: PredictionParameters) -> tuple:
+    # The in-loop probabilities of the run and their stats, for the ensemble summary
     plot_region = pp.plasmid.gene_start + pp.plasmid.gene_end
     print(pp.plasmid.gene_start, pp.plasmid.gene_end, plot_region)
 
-    run_folder = pp.prediction_collection_folder / str(
-        pp.model_folder.parts[-1]
-    ).replace("Model", "Prediction")
+    run_folder = prediction_run_folder(pp)
 
     try:
         os.mkdir(run_folder)
@@ -78,9 +112,9 @@ def do_prediction(pp: PredictionParameters) -> None:
 
     model_files_find = lambda y: list(filter(lambda x: y in x, model_files))[0]
 
-    all_rloops_bed_filename = (
+    all_rloops_index_filename = (
         pp.prediction_collection_folder
-        / f"{pp.plasmid.name}_w{pp.window_length}_all_rloops.bed"
+        / f"{pp.plasmid.name}_w{pp.window_length}_all_rloops.npy"
     )
 
     dict_shannon_json_filename = str(
@@ -103,34 +137,107 @@ def do_prediction(pp: PredictionParameters) -> None:
         run_folder
         / f"{pp.plasmid.name}_SHANNON_p{pp.padding_length}_w{pp.window_length}_base_in_loop"
     )
+    base_in_loop_outputs = [
+        base_in_loop_no_xlsx + ".XLSX",
+        base_in_loop_no_xlsx + "_stats.json",
+    ]
+
+    metrics = prediction_metrics(pp)
+
+    # Loaded once, for the scoring and for the size recorded by its stage
+    model_dict = grammar_dictionary.GrammarDictionary.load(dict_shannon_json_filename)
+    dictionary_size = model_dict.size()
+
+    if pp.engine == "dp":
+        logger.info("In loop probabilities.")
+
+        with SupressOutput(), metrics.stage(
+            "dp_in_loop_probabilities",
+            base_in_loop_outputs,
+            gene_length=pp.plasmid.gene_end - pp.plasmid.gene_start,
+            dictionary_size=dictionary_size,
+        ):
+            return dynamic_prediction.DynamicPrediction.in_loop_probabilities(
+                pp.plasmid.fasta_file,
+                model_dict,
+                probabilities_filename,
+                pp.plasmid.gene_start,
+                pp.plasmid.gene_end,
+                plot_region,
+                pp.window_length,
+                str(base_in_loop_no_xlsx),
+            )
 
     logger.info("Finding word probabilities.")
 
     logger.info("Extracting all words.")
-    grammar_word.GrammarWord.extract_word(
+
+    # Words are scored as they are generated, the words file is only written on request
+    words = grammar_word.GrammarWord.iter_words(
         pp.plasmid.fasta_file,
-        all_rloops_bed_filename,
-        dict_shannon_json_filename,
+        all_rloops_index_filename,
+        model_dict,
         pp.plasmid.gene_start,
         pp.plasmid.gene_end,
         pp.window_length,
-        str(all_rloops_filename),
+        str(all_rloops_filename) if pp.write_words else None,
     )
 
-    # with SupressOutput():
-    probabilistic_language.Probabilistic_Language.word_probabilities(
-        all_rloops_filename,
-        probabilities_filename,
-        pp.window_length,
-        str(prob_lang_filename),
+    candidate_words = len(
+        candidate_index.CandidateIndex.read(all_rloops_index_filename)
     )
 
+    # with SupressOutput():
+    with metrics.stage(
+        "word_probabilities",
+        [prob_lang_filename, all_rloops_filename if pp.write_words else None],
+        candidate_words=candidate_words,
+        dictionary_size=dictionary_size,
+    ):
+        probabilistic_language.Probabilistic_Language.word_probabilities(
+            words,
+            probabilities_filename,
+            pp.window_length,
+            str(prob_lang_filename),
+            pp.numeric,
+        )
+
+    # Models built with --artifacts none have no training set words to check against
+    if pp.numeric == "log" and any(
+        "training-set_WORDS_SHANNON" in x for x in model_files
+    ):
+        training_words_filename = str(
+            pp.model_folder / model_files_find("training-set_WORDS_SHANNON")
+        )
+
+        # The check only informs on the log mode, a model it cannot check is still predicted
+        try:
+            with SupressOutput(), metrics.stage("numeric_deviation"):
+                (
+                    deviation,
+                    checked_words,
+                ) = probabilistic_language.Probabilistic_Language.numeric_deviation(
+                    training_words_filename,
+                    probabilities_filename,
+                    pp.window_length,
+                )
+
+            logger.info(
+                f"Log scoring max relative deviation on {checked_words} training words: {deviation}"
+            )
+        except Exception as error:
+            logger.warning(f"Log scoring deviation check failed: {error!r}")
+
     logger.info("In loop probabilities.")
 
-    with SupressOutput():
-        in_loop_probs.Loop_probabilities.in_loop_probabilities(
-            all_rloops_filename,
-            all_rloops_bed_filename,
+    with SupressOutput(), metrics.stage(
+        "in_loop_probabilities",
+        base_in_loop_outputs,
+        candidate_words=candidate_words,
+    ):
+        return in_loop_probs.Loop_probabilities.in_loop_probabilities(
+            None,
+            all_rloops_index_filename,
             plot_region,
             pp.plasmid.gene_start,
             pp.plasmid.gene_end,
@@ -140,10 +247,212 @@ def do_prediction(pp: PredictionParameters) -> None:
         )
 
 
+def prediction_filenames(pp: PredictionParameters) -> Tuple[str, str]:
+    # The word probabilities file and the in-loop probabilities file, without extension
+    run_folder = prediction_run_folder(pp)
+
+    prob_lang_filename = str(
+        run_folder
+        / f"{pp.plasmid.name}_SHANNON_p{pp.padding_length}_w{pp.window_length}_prob_lang.py"
+    )
+    base_in_loop_no_xlsx = str(
+        run_folder
+        / f"{pp.plasmid.name}_SHANNON_p{pp.padding_length}_w{pp.window_length}_base_in_loop"
+    )
+
+    return prob_lang_filename, base_in_loop_no_xlsx
+
+
+def do_partition_shard(shard: Tuple[PredictionParameters, int, int, int]) -> Any:
+    pp, index, first, last = shard
+    prob_lang_filename, _ = prediction_filenames(pp)
+    scores_filename = sharded_prediction.ShardedPrediction.scores_file(
+        prob_lang_filename, index
+    )
+
+    with prediction_metrics(pp).stage(
+        "partition_shard",
+        [scores_filename],
+        first=first,
+        last=last,
+        candidate_words=last - first,
+    ):
+        return sharded_prediction.ShardedPrediction.partition_shard(
+            pp.plasmid.fasta_file,
+            model_file(pp.model_folder, "DICT_SHANNON.xlsx.json"),
+            model_file(pp.model_folder, "probabilities.json"),
+            pp.plasmid.gene_start,
+            pp.plasmid.gene_end,
+            pp.window_length,
+            first,
+            last,
+            pp.numeric,
+            scores_filename,
+        )
+
+
+def do_sum_shard(shard: Tuple[PredictionParameters, int, int, int, Any]) -> Optional[tuple]:
+    pp, index, first, last, partition_function = shard
+    prob_lang_filename, _ = prediction_filenames(pp)
+    part_filename = sharded_prediction.ShardedPrediction.part_file(
+        prob_lang_filename, index
+    )
+
+    with prediction_metrics(pp).stage(
+        "sum_shard",
+        [part_filename],
+        first=first,
+        last=last,
+        candidate_words=last - first,
+    ):
+        return sharded_prediction.ShardedPrediction.sum_shard(
+            pp.plasmid.fasta_file,
+            model_file(pp.model_folder, "DICT_SHANNON.xlsx.json"),
+            model_file(pp.model_folder, "probabilities.json"),
+            pp.plasmid.gene_start,
+            pp.plasmid.gene_end,
+            pp.plasmid.gene_start + pp.plasmid.gene_end,
+            pp.window_length,
+            first,
+            last,
+            partition_function,
+            pp.numeric,
+            part_filename,
+            sharded_prediction.ShardedPrediction.scores_file(prob_lang_filename, index),
+        )
+
+
+def start_prediction_shards(pp: PredictionParameters, shard_count: int):
+    # The reducer of the shards of a run, whose word probabilities go to its run folder
+    run_folder = prediction_run_folder(pp)
+
+    try:
+        os.mkdir(run_folder)
+    except FileExistsError:
+        pass
+
+    prob_lang_filename, _ = prediction_filenames(pp)
+
+    return sharded_prediction.ShardReducer(
+        shard_count, pp.plasmid.gene_start + pp.plasmid.gene_end, prob_lang_filename
+    )
+
+
+def merge_prediction_shards(
+    pp: PredictionParameters, reducer: "sharded_prediction.ShardReducer"
+) -> tuple:
+    logging.basicConfig(
+        filename=pp.prediction_collection_folder / "prediction_log.txt",
+        format=f"%(asctime)s [{pp.model_folder.parts[-1][-1]}] - %(message)s",
+        level=logging.DEBUG,
+    )
+
+    logger = logging.getLogger("r-loop_grammar")
+    logger.info(dataclasses.asdict(pp))
+    logger.info(f"In loop probabilities from {reducer.shard_count} shards.")
+
+    _, base_in_loop_no_xlsx = prediction_filenames(pp)
+
+    with prediction_metrics(pp).stage(
+        "merge_shards",
+        [base_in_loop_no_xlsx + ".XLSX", base_in_loop_no_xlsx + "_stats.json"],
+        shards=reducer.shard_count,
+    ):
+        summary, json_dict = reducer.summary()
+
+        return in_loop_probs.Loop_probabilities.write_base_in_loop(
+            summary,
+            json_dict,
+            pp.plasmid.gene_start,
+            pp.plasmid.gene_end,
+            base_in_loop_no_xlsx,
+        )
+
+
+def predict_in_shards(
+    runs: list, shards: list, args, prediction_folder
+) -> Iterator[Tuple[int, tuple]]:
+    # (index, result) of the runs as they are written, in any order. Every shard scores its
+    # words once and keeps the scores in its run folder for the second pass. The parts of
+    # the partition function of every run are summed first, then the blocks of its shards
+    # are added in block order as they arrive, and a run is written as soon as all its
+    # shards are in
+    reducers = [start_prediction_shards(run, len(shards)) for run in runs]
+
+    partition_partials = execution.run_tasks(
+        do_partition_shard,
+        [
+            (run, index, first, last)
+            for run in runs
+            for index, (first, last) in enumerate(shards)
+        ],
+        args.jobs,
+        args.backend,
+        lambda _, shard: f"{shard[0].model_folder.parts[-1]} shard {shard[2]}-{shard[3]}",
+        args.profile,
+        prediction_folder / PARTITION_PROFILE_FOLDER_NAME,
+    )
+
+    sum_tasks = []
+
+    for n, run in enumerate(runs):
+        partition_function = sharded_prediction.ShardedPrediction.partition_function(
+            partition_partials[n * len(shards) : (n + 1) * len(shards)], run.numeric
+        )
+
+        sum_tasks.extend(
+            (run, index, first, last, partition_function)
+            for index, (first, last) in enumerate(shards)
+        )
+
+    for index, partial in execution.iter_tasks(
+        do_sum_shard,
+        sum_tasks,
+        args.jobs,
+        args.backend,
+        lambda _, shard: f"{shard[0].model_folder.parts[-1]} shard {shard[2]}-{shard[3]}",
+        args.profile,
+        prediction_folder,
+    ):
+        n, shard = divmod(index, len(shards))
+        reducers[n].add(shard, partial)
+
+        if reducers[n].done():
+            yield n, merge_prediction_shards(runs[n], reducers[n])
+            reducers[n] = None
+
+
 parser = argparse.ArgumentParser(prog=PROGRAM_NAME, description=DESCRIPTION)
 parser.add_argument("output_folder")
 parser.add_argument("-i", "--input_folder", type=str)
 parser.add_argument("--plasmids", type=str, nargs="+")
+parser.add_argument(
+    "-e",
+    "--engine",
+    choices=["enumerate", "dp"],
+    default="enumerate",
+    help="Score every candidate R-loop word (enumerate) or use prefix sums over the gene (dp).",
+)
+parser.add_argument(
+    "-n",
+    "--numeric",
+    choices=["exact", "log"],
+    default="exact",
+    help="Score words with exact rationals or with float64 log-probabilities (enumerate engine only).",
+)
+parser.add_argument(
+    "-s",
+    "--shards",
+    type=int,
+    default=0,
+    help="Split the candidate R-loops of every model into this many shards scored in parallel, in memory (enumerate engine only).",
+)
+parser.add_argument(
+    "--write-words",
+    action="store_true",
+    help="Also write the words of all the candidate R-loops to a text file (enumerate engine without shards only).",
+)
+execution.add_arguments(parser)
 
 
 def main() -> None:
@@ -180,18 +489,18 @@ def main() -> None:
         )
         os.mkdir(prediction_folder)
 
-        all_rloops_bed_filename = (
-            prediction_folder / f"{plasmid.name}_w{window_length}_all_rloops.bed"
+        all_rloops_index_filename = (
+            prediction_folder / f"{plasmid.name}_w{window_length}_all_rloops.npy"
         )
 
-        with open(all_rloops_bed_filename, "w") as file_handle:
-            for x in range(
-                plasmid.gene_start + window_length,
-                plasmid.gene_end - 2 * window_length,
-            ):
-                for y in range(x + window_length, plasmid.gene_end - window_length):
-                    if (y - x) % window_length == 0:
-                        file_handle.write(f"{plasmid.name}\t{x}\t{y}\n")
+        # Written once and memory-mapped by the workers, the sharded path generates its own
+        if args.engine == "enumerate" and not args.shards:
+            candidate_index.CandidateIndex.write(
+                candidate_index.CandidateIndex.generate(
+                    plasmid.gene_start, plasmid.gene_end, window_length
+                ),
+                all_rloops_index_filename,
+            )
 
         for model_folder in model_folders:
             relative_path_model_folder = model_collection_folder / model_folder
@@ -203,11 +512,40 @@ def main() -> None:
                     plasmid,
                     window_length,
                     padding,
+                    args.engine,
+                    args.numeric,
+                    args.write_words,
                 )
             )
 
-        with multiprocessing.Pool(NUMBER_OF_PROCESSES) as pool:
-            pool.map(do_prediction, runs)
+        if args.engine == "enumerate" and args.shards:
+            shards = sharded_prediction.ShardedPrediction.shards(
+                plasmid.gene_start, plasmid.gene_end, window_length, args.shards
+            )
+
+            results = predict_in_shards(runs, shards, args, prediction_folder)
+        else:
+            results = execution.iter_tasks(
+                do_prediction,
+                runs,
+                args.jobs,
+                args.backend,
+                lambda _, run: str(run.model_folder.parts[-1]),
+                args.profile,
+                prediction_folder,
+            )
+
+        # Every run is added as soon as the runs before it are, in the order of the tasks,
+        # which makes the summary reproducible without holding the runs that are done
+        ensemble = ensemble_summary.EnsembleSummary()
+
+        for probabilities, stats in execution.in_order(results):
+            ensemble.add(probabilities, stats)
+
+        ensemble.write(
+            prediction_folder
+            / f"{plasmid.name}_p{padding}_w{window_length}_ensemble.npz"
+        )
 
 
 if __name__ == "__main__":
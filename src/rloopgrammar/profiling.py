@@ -0,0 +1,172 @@
+import cProfile
+import linecache
+import os
+import pathlib
+import pickle
+import pstats
+import threading
+import tracemalloc
+
+from typing import *
+
+"""
+Profiles of the tasks of the command line tools.
+
+
+With --profile cpu every task runs under cProfile and with --profile mem under tracemalloc, in
+the worker that runs it. Each task dumps its profile to the profile folder of the collection
+(PROFILE_FOLDER_NAME), and once all tasks are done their profiles are merged:
+
+    cpu     task_<n>.prof, one pstats file per task, merged into merged.prof, which pstats and
+            snakeviz read, and report.txt, the functions sorted by cumulative and by own time
+    mem     task_<n>.tracemalloc, the peak traced memory of the task and a snapshot of its
+            allocations near the peak, merged into report.txt, the peak of every task and the
+            lines holding the most memory at the peaks summed over the tasks
+
+tracemalloc only keeps the allocations that are alive, so a sampling thread takes a snapshot
+whenever the traced memory is larger than at any previous check, every MEMORY_SAMPLE_SECONDS,
+and once more at the end of the task. The snapshot is the closest one to the peak, which a
+task shorter than a sampling interval only has at its end.
+
+"""
+
+PROFILE_FOLDER_NAME = "profile"
+MEMORY_SAMPLE_SECONDS = 0.25
+REPORT_LINES = 40
+
+
+def profile_file(profile_folder, profile: str, index: int) -> pathlib.Path:
+    extension = ".prof" if profile == "cpu" else ".tracemalloc"
+
+    return (
+        pathlib.Path(profile_folder) / PROFILE_FOLDER_NAME / f"task_{index}{extension}"
+    )
+
+
+class PeakSnapshot(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+        self.size = -1
+        self.snapshot = None
+
+    def sample(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+
+        if current > self.size:
+            self.size = current
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                (
+                    tracemalloc.Filter(False, __file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                )
+            )
+
+    def run(self) -> None:
+        while not self.stopped.wait(MEMORY_SAMPLE_SECONDS):
+            self.sample()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def run_profiled(function: Callable, task, profile: str, out_file) -> Any:
+    # Result of function(task), its profile is dumped to out_file even when it fails
+    os.makedirs(pathlib.Path(out_file).parent, exist_ok=True)
+
+    if profile == "cpu":
+        profiler = cProfile.Profile()
+
+        try:
+            return profiler.runcall(function, task)
+        finally:
+            profiler.dump_stats(out_file)
+
+    if profile == "mem":
+        tracemalloc.start()
+        sampler = PeakSnapshot()
+        sampler.start()
+
+        try:
+            return function(task)
+        finally:
+            sampler.stop()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            with open(out_file, "wb") as fout:
+                pickle.dump((peak, sampler.snapshot), fout)
+
+    raise AssertionError(f"Unsupported profile: {profile}")
+
+
+def merge_cpu(profile_files: list, out_folder: pathlib.Path) -> None:
+    with open(out_folder / "report.txt", "w") as fout:
+        stats = pstats.Stats(str(profile_files[0]), stream=fout)
+
+        for profile_file in profile_files[1:]:
+            stats.add(str(profile_file))
+
+        stats.dump_stats(str(out_folder / "merged.prof"))
+
+        fout.write(f"CPU profile of {len(profile_files)} tasks\n\n")
+        stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+        stats.sort_stats("tottime").print_stats(REPORT_LINES)
+
+
+def merge_mem(profile_files: list, out_folder: pathlib.Path) -> None:
+    peaks = []
+    lines = dict()
+
+    for profile_file in profile_files:
+        with open(profile_file, "rb") as fin:
+            peak, snapshot = pickle.load(fin)
+
+        peaks.append((profile_file.stem, peak))
+
+        for stat in snapshot.statistics("lineno") if snapshot else []:
+            frame = stat.traceback[0]
+            size, count = lines.get((frame.filename, frame.lineno), (0, 0))
+            lines[(frame.filename, frame.lineno)] = (
+                size + stat.size,
+                count + stat.count,
+            )
+
+    with open(out_folder / "report.txt", "w") as fout:
+        fout.write(f"Memory profile of {len(profile_files)} tasks\n\n")
+        fout.write("Peak traced memory\n")
+
+        for name, peak in peaks:
+            fout.write(f"{peak / 2 ** 20:>12.1f} MiB  {name}\n")
+
+        fout.write("\nMemory held near the peaks, summed over the tasks\n")
+
+        top = sorted(lines.items(), key=lambda item: item[1][0], reverse=True)
+
+        for (filename, lineno), (size, count) in top[:REPORT_LINES]:
+            fout.write(
+                f"{size / 2 ** 20:>12.1f} MiB {count:>10} blocks  {filename}:{lineno}\n"
+                f"{'':>36}{linecache.getline(filename, lineno).strip()}\n"
+            )
+
+
+def merge_profiles(profile: str, profile_folder, indexes: Iterable) -> pathlib.Path:
+    # Report of the profiles of the tasks with the given indexes
+    out_folder = pathlib.Path(profile_folder) / PROFILE_FOLDER_NAME
+    profile_files = [
+        profile_file(profile_folder, profile, index)
+        for index in indexes
+        if profile_file(profile_folder, profile, index).exists()
+    ]
+
+    if not profile_files:
+        raise AssertionError(f"No {profile} profiles in {out_folder}")
+
+    if profile == "cpu":
+        merge_cpu(profile_files, out_folder)
+    else:
+        merge_mem(profile_files, out_folder)
+
+    return out_folder / "report.txt"
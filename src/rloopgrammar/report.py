@@ -0,0 +1,151 @@
+import sys
+import pathlib
+import json
+import argparse
+
+import rloopgrammar.instrumentation as instrumentation
+
+PROGRAM_NAME = pathlib.Path(sys.argv[0]).parts[-1][:-4]
+DESCRIPTION = "Summarize the stage metrics of model and prediction collections."
+
+
+def read_metrics(paths: list) -> list:
+    # Records of collection folders, or of metrics files given directly
+    records = []
+
+    for path in map(pathlib.Path, paths):
+        metrics_file = (
+            path / instrumentation.METRICS_FILE_NAME if path.is_dir() else path
+        )
+
+        if not metrics_file.exists():
+            raise AssertionError(f"No stage metrics in {path}")
+
+        with open(metrics_file, "r", encoding="utf-8") as fin:
+            for line in fin:
+                if line.strip():
+                    records.append(dict(json.loads(line), collection=str(path)))
+
+    return records
+
+
+def summarize(records: list) -> list:
+    # One summary per tool and stage, the ones taking the most time first
+    groups = dict()
+
+    for record in records:
+        groups.setdefault((record["tool"], record["stage"]), []).append(record)
+
+    tool_seconds = dict()
+
+    for (tool, _), group in groups.items():
+        tool_seconds[tool] = tool_seconds.get(tool, 0.0) + sum(
+            r["wall_seconds"] for r in group
+        )
+
+    summaries = []
+
+    for (tool, stage), group in groups.items():
+        wall = [r["wall_seconds"] for r in group]
+        cpu = sum(r["cpu_seconds"] for r in group)
+        slowest = max(group, key=lambda r: r["wall_seconds"])
+        input_names = sorted(set(k for r in group for k in r["inputs"]))
+
+        summaries.append(
+            dict(
+                tool=tool,
+                stage=stage,
+                runs=len(group),
+                failed=sum(r["failed"] for r in group),
+                total_seconds=sum(wall),
+                share=sum(wall) / tool_seconds[tool] if tool_seconds[tool] else 0.0,
+                mean_seconds=sum(wall) / len(wall),
+                max_seconds=max(wall),
+                slowest_run=slowest["run"],
+                cpu_seconds=cpu,
+                cpu_utilization=cpu / sum(wall) if sum(wall) else 0.0,
+                max_peak_rss_bytes=max(r["peak_rss_bytes"] for r in group),
+                output_bytes=sum(r["output_bytes"] for r in group),
+                mean_inputs={
+                    name: sum(r["inputs"][name] for r in group if name in r["inputs"])
+                    / sum(name in r["inputs"] for r in group)
+                    for name in input_names
+                },
+            )
+        )
+
+    summaries.sort(key=lambda s: s["total_seconds"], reverse=True)
+
+    return summaries
+
+
+def size(n_bytes: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n_bytes < 1024 or unit == "GiB":
+            return f"{n_bytes:.0f} {unit}" if unit == "B" else f"{n_bytes:.1f} {unit}"
+
+        n_bytes /= 1024
+
+
+def print_report(summaries: list, records: list, top: int) -> None:
+    header = (
+        f"{'tool':<18} {'stage':<22} {'runs':>5} {'total s':>10} {'share':>6} "
+        f"{'mean s':>9} {'max s':>9} {'cpu/wall':>8} {'peak RSS':>10} {'output':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    for s in summaries:
+        print(
+            f"{s['tool']:<18} {s['stage']:<22} {s['runs']:>5} "
+            f"{s['total_seconds']:>10.2f} {s['share']:>6.1%} {s['mean_seconds']:>9.3f} "
+            f"{s['max_seconds']:>9.3f} {s['cpu_utilization']:>8.2f} "
+            f"{size(s['max_peak_rss_bytes']):>10} {size(s['output_bytes']):>10}"
+            + (f"  ({s['failed']} failed)" if s["failed"] else "")
+        )
+
+        if s["mean_inputs"]:
+            print(
+                " " * 24
+                + "mean inputs: "
+                + ", ".join(f"{k} {v:,.0f}" for k, v in s["mean_inputs"].items())
+            )
+
+    print(f"\nSlowest {top} stages:")
+
+    for r in sorted(records, key=lambda r: r["wall_seconds"], reverse=True)[:top]:
+        print(
+            f"{r['wall_seconds']:>10.3f}s  {r['tool']} {r['stage']} {r['run']}"
+            f" ({r['collection']})"
+        )
+
+
+parser = argparse.ArgumentParser(prog=PROGRAM_NAME, description=DESCRIPTION)
+parser.add_argument(
+    "collections",
+    nargs="+",
+    help=f"Collection folders or {instrumentation.METRICS_FILE_NAME} files.",
+)
+parser.add_argument(
+    "-t", "--top", type=int, default=10, help="Number of slowest stages listed."
+)
+parser.add_argument(
+    "--json", action="store_true", help="Print the summaries as JSON instead."
+)
+
+
+def main() -> None:
+    args = parser.parse_args()
+
+    records = read_metrics(args.collections)
+    summaries = summarize(records)
+
+    if args.json:
+        json.dump(summaries, sys.stdout, indent=4)
+        print()
+    else:
+        print_report(summaries, records, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import multiprocessing
 import sys
 import os
 import pathlib
@@ -8,37 +7,27 @@ import configparser
 import logging
 import argparse
 import random
-import gmpy2
 
 from typing import *
 
 import rloopgrammar.model.union_dict as union_dict
-import rloopgrammar.model.grammar_word as grammar_word
+import rloopgrammar.model.grammar_dictionary as grammar_dictionary
 import rloopgrammar.model.grammar_training as grammar_training
+import rloopgrammar.model.model_pipeline as model_pipeline
+import rloopgrammar.model.probabilistic_language as probabilistic_language
+import rloopgrammar.model.stage_cache as stage_cache
+
+import rloopgrammar.execution as execution
 
 from rloopgrammar.config_reader import read_plasmids
 from rloopgrammar.config_reader import Plasmid
 
-NUMBER_OF_PROCESSES = 10
-
 CONFIG_UNION_PARAMETER_NAME = "Union Parameters"
 CONFIG_MODEL_PARAMETER_NAME = "Model Parameters"
 
 PROGRAM_NAME = pathlib.Path(sys.argv[0]).parts[-1][:-4]
-DESCRIPTION = "Build a hybrid model based off the union of two dictionaries."
-
-class GMPYEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, gmpy2.mpq):
-            return str(obj)
-
+DESCRIPTION = "Build a hybrid model based off the union of two or more dictionaries."
 
-def from_gmpy(dct):
-    for k, v in dct.items():
-        if isinstance(v, str):
-            n, m = tuple(map(int, v.split("/")))
-            dct[k] = gmpy2.mpq(n, m)
-    return dct
 
 class SupressOutput:
     def __init__(self):
@@ -54,20 +43,21 @@ class SupressOutput:
 @dataclasses.dataclass
 class UnionParameters:
     union_collection_folder: pathlib.Path
-    plasmid_1: Plasmid
-    plasmid_2: Plasmid
-    plasmid_1_model_folder: pathlib.Path
-    plasmid_2_model_folder: pathlib.Path
+    plasmids: List[Plasmid]
+    model_folders: List[pathlib.Path]
     window_length: int
     padding_length: int
     method: str
+    cache: Optional[stage_cache.StageCache] = None
+    average: str = "mean"
 
 
 def build_union_model(up: UnionParameters) -> None:
-    run_number = up.plasmid_1_model_folder.parts[-1].split("_")[-1]
+    run_number = up.model_folders[0].parts[-1].split("_")[-1]
+    plasmid_names = "_".join(plasmid.name for plasmid in up.plasmids)
     run_folder = (
         up.union_collection_folder
-        / f"UnionModel_{up.plasmid_1.name}_{up.plasmid_2.name}_p{up.padding_length}_w{up.window_length}_{run_number}"
+        / f"UnionModel_{plasmid_names}_p{up.padding_length}_w{up.window_length}_{run_number}"
     )
 
     print(f"Building Union Model {run_number}")
@@ -76,77 +66,71 @@ def build_union_model(up: UnionParameters) -> None:
 
     os.mkdir(run_folder)
 
-    plasmid_1_model_files = next(os.walk(up.plasmid_1_model_folder))[2]
-    plasmid_2_model_files = next(os.walk(up.plasmid_2_model_folder))[2]
-
-    plasmid_1_model_files_find = lambda y: list(
-        filter(lambda x: y in x, plasmid_1_model_files)
-    )[0]
-    plasmid_2_model_files_find = lambda y: list(
-        filter(lambda x: y in x, plasmid_2_model_files)
-    )[0]
-
     print(f"Finding files {run_number}")
 
-    bed_extra_training_set_filename_1 = (
-        up.plasmid_1_model_folder
-        / plasmid_1_model_files_find("bed_extra_training-set.bed")
-    )
-    bed_extra_training_set_filename_2 = (
-        up.plasmid_2_model_folder
-        / plasmid_2_model_files_find("bed_extra_training-set.bed")
-    )
+    def model_files_find(model_folder, *names):
+        # First of the names that matches a model file
+        model_files = next(os.walk(model_folder))[2]
 
-    dict_shannon_xlsx_filename_1 = (
-        up.plasmid_1_model_folder / plasmid_1_model_files_find("DICT_SHANNON.xlsx")
-    )
-    dict_shannon_json_filename_1 = (
-        up.plasmid_1_model_folder / plasmid_1_model_files_find("DICT_SHANNON.xlsx.json")
-    )
+        for name in names:
+            found = list(filter(lambda x: name in x, model_files))
 
-    weights_xlsx_filename_1 = up.plasmid_1_model_folder / plasmid_1_model_files_find(
-        "_weight_shannon.xlsx"
-    )
+            if found:
+                return model_folder / found[0]
 
-    weights_xlsx_filename_2 = up.plasmid_2_model_folder / plasmid_2_model_files_find(
-        "_weight_shannon.xlsx"
-    )
+        raise AssertionError(f"No {' or '.join(names)} file in {model_folder}")
 
-    dict_shannon_xlsx_filename_2 = (
-        up.plasmid_2_model_folder / plasmid_2_model_files_find("DICT_SHANNON.xlsx")
-    )
-    dict_shannon_json_filename_2 = (
-        up.plasmid_2_model_folder / plasmid_2_model_files_find("DICT_SHANNON.xlsx.json")
-    )
+    bed_extra_training_set_filenames = [
+        model_files_find(model_folder, "bed_extra_training-set.bed")
+        for model_folder in up.model_folders
+    ]
+    dict_shannon_json_filenames = [
+        model_files_find(model_folder, "DICT_SHANNON.xlsx.json")
+        for model_folder in up.model_folders
+    ]
+    # The columnar weight tables when the models have them, the workbooks otherwise
+    weights_filenames = [
+        model_files_find(model_folder, "_weight_shannon.npz", "_weight_shannon.xlsx")
+        for model_folder in up.model_folders
+    ]
 
     union_dict_name = run_folder / (
         f"out_union_w{up.window_length}_p{up.padding_length}_union.DICT_SHANNON.xlsx.json"
     )
 
-    training_set_words_filename_1 = str(
-        run_folder
-        / f"{up.plasmid_1.name}_union_p{up.padding_length}_w{up.window_length}_{run_number}_training-set_WORDS_SHANNON.txt"
-    )
-    training_set_words_filename_2 = str(
-        run_folder
-        / f"{up.plasmid_2.name}_union_p{up.padding_length}_w{up.window_length}_{run_number}_training-set_WORDS_SHANNON.txt"
-    )
-    probabilities_filename_1 = str(
-        run_folder
-        / f"{up.plasmid_1.name}_union_SHANNON_p{up.padding_length}_w{up.window_length}_{run_number}_probabilities.json"
-    )
-    probabilities_filename_2 = str(
-        run_folder
-        / f"{up.plasmid_2.name}_union_SHANNON_p{up.padding_length}_w{up.window_length}_{run_number}_probabilities.json"
-    )
+    training_set_words_filenames = [
+        str(
+            run_folder
+            / f"{plasmid.name}_union_p{up.padding_length}_w{up.window_length}_{run_number}_training-set_WORDS_SHANNON.txt"
+        )
+        for plasmid in up.plasmids
+    ]
+    probabilities_filenames = [
+        str(
+            run_folder
+            / f"{plasmid.name}_union_SHANNON_p{up.padding_length}_w{up.window_length}_{run_number}_probabilities.json"
+        )
+        for plasmid in up.plasmids
+    ]
+    counts_filenames = [
+        str(
+            run_folder
+            / f"{plasmid.name}_union_SHANNON_p{up.padding_length}_w{up.window_length}_{run_number}_counts.json"
+        )
+        for plasmid in up.plasmids
+    ]
     av_probabilities_filename = str(
         run_folder
         / f"SHANNON_p{up.padding_length}_w{up.window_length}_{run_number}_union_probabilities.json"
     )
+    union_counts_filename = str(
+        run_folder
+        / f"SHANNON_p{up.padding_length}_w{up.window_length}_{run_number}_union_counts.json"
+    )
 
     union_input_file = str(
         run_folder
-        / f"{up.plasmid_1.name}_{up.plasmid_2.name}_union_w{up.window_length}_p{up.padding_length}_{run_number}_input.txt"
+        / f"{plasmid_names}_union_w{up.window_length}_p{up.padding_length}_{run_number}_input.txt"
     )
 
     print("Unioning dictionaries.")
@@ -155,83 +139,158 @@ def build_union_model(up: UnionParameters) -> None:
         union_input_file,
         "w",
     ) as file_handle:
-        file_handle.write(f"{dict_shannon_json_filename_1}\n")
-        file_handle.write(f"{weights_xlsx_filename_1}\n")
-        file_handle.write(f"{dict_shannon_json_filename_2}\n")
-        file_handle.write(f"{weights_xlsx_filename_2}\n")
+        for dict_shannon_json_filename, weights_filename in zip(
+            dict_shannon_json_filenames, weights_filenames
+        ):
+            file_handle.write(f"{dict_shannon_json_filename}\n")
+            file_handle.write(f"{weights_filename}\n")
 
     union_dict.UnionDict.union_json(
         union_input_file, output_filename=union_dict_name, method=up.method
     )
 
-    print("Extracting training set 1 words.")
+    model_dict = grammar_dictionary.GrammarDictionary.load(union_dict_name)
+
+    def train(
+        plasmid,
+        bed_extra_training_set_filename,
+        words_filename,
+        probabilities_filename,
+        counts_filename,
+    ):
+        with open(bed_extra_training_set_filename, "r") as fin:
+            training_set_lines = fin.readlines()
+
+        seq = model_pipeline.ModelPipeline.read_sequence(plasmid.fasta_file)
+
+        model_pipeline.ModelPipeline.train(
+            seq[plasmid.gene_start : plasmid.gene_end],
+            training_set_lines,
+            model_dict,
+            plasmid.gene_start,
+            up.window_length,
+            words_filename,
+            probabilities_filename,
+            up.cache,
+            counts_filename,
+        )
 
-    grammar_word.GrammarWord.extract_word(
-        up.plasmid_1.fasta_file,
-        bed_extra_training_set_filename_1,
-        union_dict_name,
-        up.plasmid_1.gene_start,
-        up.plasmid_1.gene_end,
-        up.window_length,
-        training_set_words_filename_1,
-    )
+    if up.average == "counts":
+        # The w-mer counts of every model give its counts under the union dictionary, so the
+        # training sets are not read again, and the counts add up to those of a model trained
+        # on the union of the training sets
+        print("Merging transition counts.")
 
-    print("Extracting training set 2 words.")
+        counts = list()
 
-    grammar_word.GrammarWord.extract_word(
-        up.plasmid_2.fasta_file,
-        bed_extra_training_set_filename_2,
-        union_dict_name,
-        up.plasmid_2.gene_start,
-        up.plasmid_2.gene_end,
-        up.window_length,
-        training_set_words_filename_2,
-    )
+        for model_folder, dict_shannon_json_filename, counts_filename in zip(
+            up.model_folders, dict_shannon_json_filenames, counts_filenames
+        ):
+            model_counts = grammar_training.GrammarTraining.read_counts(
+                model_files_find(model_folder, "_counts.json")
+            )
 
-    print("Finding probabilities 1.")
+            if model_counts["width"] != up.window_length:
+                raise AssertionError(
+                    f"The counts of {model_folder} have width {model_counts['width']}, not {up.window_length}"
+                )
 
-    grammar_training.GrammarTraining.find_probabilities(
-        training_set_words_filename_1, up.window_length, probabilities_filename_1
-    )
+            if (
+                model_counts.get("dictionary", None)
+                != grammar_dictionary.GrammarDictionary.load(
+                    dict_shannon_json_filename
+                ).digest()
+            ):
+                raise AssertionError(
+                    f"The counts of {model_folder} were not counted under its dictionary"
+                )
 
-    print("Finding probabilities 2.")
+            if "kmer_transition_counts" not in model_counts:
+                raise AssertionError(
+                    f"The counts of {model_folder} have no w-mer counts, rebuild the model or use --average mean"
+                )
 
-    grammar_training.GrammarTraining.find_probabilities(
-        training_set_words_filename_2, up.window_length, probabilities_filename_2
-    )
+            union_model_counts = grammar_training.GrammarTraining.project_counts(
+                model_counts, model_dict
+            )
+            grammar_training.GrammarTraining.write_counts(
+                union_model_counts, counts_filename
+            )
+            counts.append(union_model_counts)
+
+        union_counts = grammar_training.GrammarTraining.merge_counts(counts)
+        grammar_training.GrammarTraining.write_counts(
+            union_counts, union_counts_filename
+        )
+        grammar_training.GrammarTraining.write_probabilities(
+            grammar_training.GrammarTraining.probabilities_from_counts(union_counts),
+            av_probabilities_filename,
+        )
+
+        return
+
+    for i, plasmid in enumerate(up.plasmids):
+        print(
+            f"Extracting training set {i + 1} words and finding probabilities {i + 1}."
+        )
+
+        train(
+            plasmid,
+            bed_extra_training_set_filenames[i],
+            training_set_words_filenames[i],
+            probabilities_filenames[i],
+            counts_filenames[i],
+        )
 
     # CREATE FILE WITH AVERAGE PROBABILITIES
     print(f"Finding average probabilities.")
 
-    with open(probabilities_filename_1, "r", encoding="utf-8") as file_handle:
-        probabilities_1 = json.load(file_handle, object_hook=from_gmpy)
+    probabilities = list()
+
+    for probabilities_filename in probabilities_filenames:
+        with open(probabilities_filename, "r", encoding="utf-8") as file_handle:
+            probabilities.append(
+                json.load(file_handle, object_hook=probabilistic_language.from_gmpy)
+            )
 
-    with open(probabilities_filename_2, "r", encoding="utf-8") as file_handle:
-        probabilities_2 = json.load(file_handle, object_hook=from_gmpy)
+    # The average is written over the probabilities of the last model
+    av_probabilities = probabilities[-1]
 
-    for k, v in probabilities_1.items():
+    for k, v in probabilities[0].items():
         if "probabilities" in k and "counts" not in k:
-            for l, b in v.items():
-                print(k, l, "dividing", probabilities_2[k][l], b, "result", (probabilities_2[k][l] + b) / 2)
-                probabilities_2[k][l] = (probabilities_2[k][l] + b) / 2
-                if probabilities_2[k][l] == 0:
+            for l in v:
+                values = [p[k][l] for p in probabilities]
+                av_probabilities[k][l] = sum(values) / len(values)
+                print(k, l, "averaging", *values, "result", av_probabilities[k][l])
+                if av_probabilities[k][l] == 0:
                     print(
-                        probabilities_filename_1,
-                        probabilities_filename_2,
-                        "\n",
-                        l,
-                        (probabilities_2[k][l] + b) / 2,
-                        "\n",
+                        *probabilities_filenames, "\n", l, av_probabilities[k][l], "\n"
                     )
 
-    with open(av_probabilities_filename, "w") as fout:
-        json.dump(probabilities_2, fout, cls=GMPYEncoder, ensure_ascii=False, indent=4)
+    grammar_training.GrammarTraining.write_probabilities(
+        av_probabilities, av_probabilities_filename
+    )
 
 
 parser = argparse.ArgumentParser(prog=PROGRAM_NAME, description=DESCRIPTION)
 parser.add_argument("output_folder")
 parser.add_argument("-m", "--method", type=str)
-parser.add_argument("-i", "--input_folders", type=str, nargs="+")
+parser.add_argument(
+    "-i",
+    "--input_folders",
+    type=str,
+    nargs="+",
+    help="Two or more model collections, one per plasmid.",
+)
+parser.add_argument(
+    "-a",
+    "--average",
+    choices=("mean", "counts"),
+    default="mean",
+    help="Union probabilities: mean of the probabilities of the models retrained under the union dictionary (mean), or probabilities of the sum of their persisted transition counts projected on the union dictionary (counts), which reads no FASTA or BED file.",
+)
+execution.add_arguments(parser)
+stage_cache.add_arguments(parser)
 
 
 def main() -> None:
@@ -242,46 +301,46 @@ def main() -> None:
     model_folder_name_tuples = [args.input_folders]
 
     for model_folder_tuple in model_folder_name_tuples:
-        model1_config = configparser.ConfigParser()
-        model1_config.read(pathlib.Path(model_folder_tuple[0]) / "model_settings.ini")
+        assert (
+            len(model_folder_tuple) >= 2
+        ), "At least two model collections are needed for a union."
 
-        model2_config = configparser.ConfigParser()
-        model2_config.read(pathlib.Path(model_folder_tuple[1]) / "model_settings.ini")
+        model_configs = list()
 
-        plasmid_name_tuple = (
-            model1_config[CONFIG_MODEL_PARAMETER_NAME]["PLASMID"],
-            model2_config[CONFIG_MODEL_PARAMETER_NAME]["PLASMID"],
-        )
+        for model_folder in model_folder_tuple:
+            model_config = configparser.ConfigParser()
+            model_config.read(pathlib.Path(model_folder) / "model_settings.ini")
+            model_configs.append(model_config[CONFIG_MODEL_PARAMETER_NAME])
 
-        assert (
-            model1_config[CONFIG_MODEL_PARAMETER_NAME]["WindowLength"]
-            == model2_config[CONFIG_MODEL_PARAMETER_NAME]["WindowLength"]
-        ), f"{model_folder_tuple[0]} model settings do not match {model_folder_tuple[1]}."
+        plasmid_name_tuple = [model_config["PLASMID"] for model_config in model_configs]
 
-        assert (
-            model1_config[CONFIG_MODEL_PARAMETER_NAME]["Padding"]
-            == model2_config[CONFIG_MODEL_PARAMETER_NAME]["Padding"]
-        ), f"{model_folder_tuple[0]} model settings do not match {model_folder_tuple[1]}."
+        for model_folder, model_config in zip(model_folder_tuple, model_configs):
+            assert (
+                model_config["WindowLength"] == model_configs[0]["WindowLength"]
+            ), f"{model_folder_tuple[0]} model settings do not match {model_folder}."
 
-        window_length = int(model1_config[CONFIG_MODEL_PARAMETER_NAME]["WindowLength"])
-        padding_length = int(model1_config[CONFIG_MODEL_PARAMETER_NAME]["Padding"])
+            assert (
+                model_config["Padding"] == model_configs[0]["Padding"]
+            ), f"{model_folder_tuple[0]} model settings do not match {model_folder}."
+
+        window_length = int(model_configs[0]["WindowLength"])
+        padding_length = int(model_configs[0]["Padding"])
 
         plasmid_tuple: list[Plasmid] = [
             list(filter(lambda x: x.name == k, plasmids))[0] for k in plasmid_name_tuple
         ]
 
         # sort by the run number
-        model1_folders = sorted(
-            [x[1] for x in os.walk(model_folder_tuple[0])][0],
-            key=lambda x: int(x.split("_")[-1]),
-        )
-        model2_folders = sorted(
-            [x[1] for x in os.walk(model_folder_tuple[1])][0],
-            key=lambda x: int(x.split("_")[-1]),
-        )
+        model_folders = [
+            sorted(
+                [x[1] for x in os.walk(model_folder)][0],
+                key=lambda x: int(x.split("_")[-1]),
+            )
+            for model_folder in model_folder_tuple
+        ]
 
-        assert len(model1_folders) == len(
-            model2_folders
+        assert all(
+            len(folders) == len(model_folders[0]) for folders in model_folders
         ), "Model folder lengths don't match"
 
         union_model_collection_folder = pathlib.Path(args.output_folder)
@@ -289,13 +348,13 @@ def main() -> None:
 
         run_config = configparser.ConfigParser()
         run_config[CONFIG_MODEL_PARAMETER_NAME] = {}
-        run_config[CONFIG_MODEL_PARAMETER_NAME][
-            "Plasmids"
-        ] = f"{plasmid_name_tuple[0]} {plasmid_name_tuple[1]}"
+        run_config[CONFIG_MODEL_PARAMETER_NAME]["Plasmids"] = " ".join(
+            plasmid_name_tuple
+        )
         run_config[CONFIG_MODEL_PARAMETER_NAME]["WindowLength"] = str(window_length)
         run_config[CONFIG_MODEL_PARAMETER_NAME]["Padding"] = str(padding_length)
         run_config[CONFIG_MODEL_PARAMETER_NAME]["NumberOfModels"] = str(
-            len(model1_folders)
+            len(model_folders[0])
         )
 
         with open(
@@ -304,24 +363,34 @@ def main() -> None:
             run_config.write(configfile)
 
         union_runs: list[UnionParameters] = []
-        for run_folder_tuple in zip(model1_folders, model2_folders):
+        for run_folder_tuple in zip(*model_folders):
             union_runs.append(
                 UnionParameters(
                     union_collection_folder=union_model_collection_folder,
-                    plasmid_1=plasmid_tuple[0],
-                    plasmid_2=plasmid_tuple[1],
-                    plasmid_1_model_folder=pathlib.Path(model_folder_tuple[0])
-                    / run_folder_tuple[0],
-                    plasmid_2_model_folder=pathlib.Path(model_folder_tuple[1])
-                    / run_folder_tuple[1],
+                    plasmids=plasmid_tuple,
+                    model_folders=[
+                        pathlib.Path(model_folder) / run_folder
+                        for model_folder, run_folder in zip(
+                            model_folder_tuple, run_folder_tuple
+                        )
+                    ],
                     window_length=window_length,
                     padding_length=padding_length,
                     method=args.method,
+                    cache=stage_cache.StageCache.from_arguments(args),
+                    average=args.average,
                 )
             )
 
-        with multiprocessing.Pool(NUMBER_OF_PROCESSES) as pool:
-            pool.map(build_union_model, union_runs)
+        execution.run_tasks(
+            build_union_model,
+            union_runs,
+            args.jobs,
+            args.backend,
+            lambda index, _: f"union run {index}",
+            args.profile,
+            union_model_collection_folder,
+        )
 
 
 if __name__ == "__main__":